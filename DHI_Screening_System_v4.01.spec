@@ -22,6 +22,14 @@ a = Analysis(
         ('操作说明.md', '.'),
         ('mastitis_monitoring.py', '.'),
         ('data_processor.py', '.'),
+        ('columnar_store.py', '.'),
+        ('herd_table.py', '.'),
+        ('ingest_normalizer.py', '.'),
+        ('header_templates.py', '.'),
+        ('screening_index.py', '.'),
+        ('result_cache.py', '.'),
+        ('monthly_aggregates.py', '.'),
+        ('file_signatures.py', '.'),
         ('models.py', '.'),
         ('urea_tracker.py', '.'),
         ('progress_manager.py', '.'),
@@ -80,6 +88,7 @@ a = Analysis(
         'openpyxl.workbook',
         'openpyxl.worksheet',
         'yaml',
+        'pyarrow',
         'pyqtgraph',
         'pydantic',
         'dateutil',
@@ -87,6 +96,14 @@ a = Analysis(
         # 本地模块 (解决动态导入)
         'mastitis_monitoring',
         'data_processor',
+        'columnar_store',
+        'herd_table',
+        'ingest_normalizer',
+        'header_templates',
+        'screening_index',
+        'result_cache',
+        'monthly_aggregates',
+        'file_signatures',
         'models',
         'logging',
         'threading',
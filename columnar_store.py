@@ -0,0 +1,376 @@
+"""
+列式存储模块
+为解析结果提供基于内容哈希的持久化缓存，以及按月份/牛场分区的临时数据存储
+（Parquet，缺少pyarrow时回退为pickle）
+"""
+
+import hashlib
+import json
+import os
+import shutil
+import time
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as pa_ds
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+    logger.warning("未安装pyarrow，列式缓存将回退为pickle格式")
+
+# 缓存内容格式版本，解析结果的列或类型约定变化时递增
+CACHE_FORMAT_VERSION = 2
+
+_HASH_CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(file_path: str) -> str:
+    """计算文件内容的SHA-256摘要"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_SIZE), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def rules_digest(*sections: Any) -> str:
+    """计算规则片段（如field_map）的摘要，作为缓存键的版本部分"""
+    payload = json.dumps([CACHE_FORMAT_VERSION, *sections], sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:16]
+
+
+def write_frame(df: pd.DataFrame, base_path: str) -> str:
+    """将DataFrame写为 base_path.parquet（失败时写 base_path.pkl），attrs另存为JSON
+
+    写入先落到临时文件再原子替换，多个解析进程并发写同一条目时不会读到半成品。
+
+    Returns:
+        实际写入的数据文件路径
+    """
+    data_path = None
+    if PARQUET_AVAILABLE:
+        data_path = base_path + '.parquet'
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        try:
+            df.to_parquet(tmp_path)
+            os.replace(tmp_path, data_path)
+        except Exception as e:
+            # 混合类型的object列等无法写入Parquet，改用pickle
+            logger.debug(f"Parquet写入失败，改用pickle: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            data_path = None
+
+    if data_path is None:
+        data_path = base_path + '.pkl'
+        tmp_path = f"{data_path}.{os.getpid()}.tmp"
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, data_path)
+
+    attrs_path = base_path + '.attrs.json'
+    tmp_path = f"{attrs_path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(df.attrs, f, ensure_ascii=False, default=str)
+    os.replace(tmp_path, attrs_path)
+    return data_path
+
+
+def read_frame(base_path: str, columns: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+    """读取write_frame写出的DataFrame（含attrs），不存在时返回None"""
+    parquet_path = base_path + '.parquet'
+    pickle_path = base_path + '.pkl'
+    if PARQUET_AVAILABLE and os.path.exists(parquet_path):
+        df = pd.read_parquet(parquet_path, columns=columns)
+    elif os.path.exists(pickle_path):
+        df = pd.read_pickle(pickle_path)
+        if columns is not None:
+            df = df[[col for col in columns if col in df.columns]]
+    else:
+        return None
+
+    attrs_path = base_path + '.attrs.json'
+    if os.path.exists(attrs_path):
+        with open(attrs_path, 'r', encoding='utf-8') as f:
+            df.attrs = json.load(f)
+    return df
+
+
+class ParseCache:
+    """按文件内容寻址的解析结果缓存
+
+    键 = 文件内容摘要 + 规则版本摘要；同一份月报无论何时、从哪个标签页再次上传，
+    都可以直接读取已规范化的DataFrame，跳过Excel解析。
+    """
+
+    def __init__(self, cache_dir: str, retention_hours: float = 24, max_bytes: int = 512 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.retention_seconds = max(0.0, float(retention_hours)) * 3600
+        self.max_bytes = max_bytes
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def make_key(self, file_path: str, rules_version: str) -> str:
+        """生成缓存键"""
+        return f"{file_digest(file_path)}_{rules_version}"
+
+    def _base_path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key)
+
+    def _entry_files(self, key: str) -> List[str]:
+        base_path = self._base_path(key)
+        return [path for path in (base_path + '.parquet', base_path + '.pkl', base_path + '.attrs.json')
+                if os.path.exists(path)]
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        """读取缓存，未命中或条目损坏时返回None"""
+        try:
+            df = read_frame(self._base_path(key))
+        except Exception as e:
+            logger.warning(f"解析缓存条目损坏，已丢弃: {key}: {e}")
+            self._remove(key)
+            return None
+        if df is None:
+            return None
+        # 刷新访问时间，淘汰时按最近使用排序
+        now = time.time()
+        for path in self._entry_files(key):
+            try:
+                os.utime(path, (now, now))
+            except OSError:
+                pass
+        return df
+
+    def put(self, key: str, df: pd.DataFrame) -> None:
+        """写入缓存并执行淘汰"""
+        try:
+            write_frame(df, self._base_path(key))
+        except Exception as e:
+            logger.warning(f"写入解析缓存失败: {e}")
+            return
+        self.evict()
+
+    def _remove(self, key: str) -> None:
+        for path in self._entry_files(key):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def evict(self) -> Dict[str, int]:
+        """按保留时长与总大小淘汰条目（最久未使用的先淘汰）"""
+        entries: Dict[str, Dict[str, float]] = {}
+        try:
+            names = os.listdir(self.cache_dir)
+        except OSError:
+            return {'expired': 0, 'oversize': 0}
+
+        for name in names:
+            path = os.path.join(self.cache_dir, name)
+            key = name.split('.', 1)[0]
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entry = entries.setdefault(key, {'size': 0, 'mtime': 0})
+            entry['size'] += stat.st_size
+            entry['mtime'] = max(entry['mtime'], stat.st_mtime)
+
+        now = time.time()
+        expired = [key for key, entry in entries.items()
+                   if self.retention_seconds and now - entry['mtime'] > self.retention_seconds]
+        for key in expired:
+            self._remove(key)
+            entries.pop(key, None)
+
+        oversize = 0
+        total = sum(entry['size'] for entry in entries.values())
+        for key, entry in sorted(entries.items(), key=lambda item: item[1]['mtime']):
+            if total <= self.max_bytes:
+                break
+            self._remove(key)
+            total -= entry['size']
+            oversize += 1
+
+        if expired or oversize:
+            logger.info(f"解析缓存淘汰: 过期{len(expired)}条, 超出容量{oversize}条")
+        return {'expired': len(expired), 'oversize': oversize}
+
+    def clear(self) -> None:
+        """清空缓存"""
+        for name in os.listdir(self.cache_dir):
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+            except OSError:
+                pass
+
+
+class TempDataStore:
+    """临时数据的列式存储
+
+    每份数据保存为一个按 year_month / farm_id 分区的Parquet数据集，加载时支持
+    列投影和月份/牛场谓词下推，只读取需要的分区和列。
+    """
+
+    # 分区列与行序列名（不能以"_"或"."开头，否则会被数据集扫描忽略）
+    MONTH_PARTITION = 'store_year_month'
+    FARM_PARTITION = 'store_farm_id'
+    ROW_ORDER = 'store_row_order'
+    SCHEMA_FILE = '_common_metadata'
+    ATTRS_FILE = '_attrs.json'
+
+    def __init__(self, root_dir: str):
+        self.root_dir = root_dir
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def _dataset_dir(self, file_id: str) -> str:
+        return os.path.join(self.root_dir, file_id)
+
+    def _partitioning(self):
+        return pa_ds.partitioning(
+            pa.schema([(self.MONTH_PARTITION, pa.string()), (self.FARM_PARTITION, pa.string())]),
+            flavor='hive'
+        )
+
+    def _with_store_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        """附加分区列与原始行序"""
+        stored = df.reset_index(drop=True)
+        if 'sample_date' in stored.columns:
+            months = pd.to_datetime(stored['sample_date'], errors='coerce').dt.strftime('%Y-%m')
+            months = months.astype(object).where(months.notna(), None)
+        else:
+            months = pd.Series([None] * len(stored), dtype=object)
+        if 'farm_id' in stored.columns:
+            farms = stored['farm_id'].astype(object).where(stored['farm_id'].notna(), None)
+            farms = farms.map(lambda value: None if value is None else str(value))
+        else:
+            farms = pd.Series([None] * len(stored), dtype=object)
+        return stored.assign(**{
+            self.MONTH_PARTITION: months,
+            self.FARM_PARTITION: farms,
+            self.ROW_ORDER: np.arange(len(stored), dtype=np.int64),
+        })
+
+    def save(self, df: pd.DataFrame, file_id: str) -> str:
+        """保存数据，返回数据集路径（同名数据会被整体替换）
+
+        新数据先完整写入临时目录，成功后才替换旧数据集；写入失败时旧数据保持不变。
+        """
+        dataset_dir = self._dataset_dir(file_id)
+        tmp_dir = f"{dataset_dir}.{os.getpid()}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        try:
+            written = False
+            if PARQUET_AVAILABLE:
+                try:
+                    table = pa.Table.from_pandas(self._with_store_columns(df), preserve_index=False)
+                    pa_ds.write_dataset(table, tmp_dir, format='parquet', partitioning=self._partitioning())
+                    os.makedirs(tmp_dir, exist_ok=True)
+                    # 数据集扫描时不会保留pandas元数据，单独保存完整schema以便还原列类型
+                    pq.write_metadata(table.schema, os.path.join(tmp_dir, self.SCHEMA_FILE))
+                    written = True
+                except (pa.ArrowException, TypeError, ValueError) as e:
+                    # 混合类型的object列等无法转换为Arrow，改用pickle
+                    logger.debug(f"临时数据 {file_id} 无法写为Parquet，改用pickle: {e}")
+                    shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not written:
+                os.makedirs(tmp_dir, exist_ok=True)
+                df.to_pickle(os.path.join(tmp_dir, 'data.pkl'))
+
+            with open(os.path.join(tmp_dir, self.ATTRS_FILE), 'w', encoding='utf-8') as f:
+                json.dump(df.attrs, f, ensure_ascii=False, default=str)
+        except Exception:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            raise
+
+        # 目录不能直接覆盖非空目录：旧数据集先移开，新数据集就位后再删除
+        old_dir = f"{dataset_dir}.{os.getpid()}.old"
+        shutil.rmtree(old_dir, ignore_errors=True)
+        if os.path.isdir(dataset_dir):
+            os.replace(dataset_dir, old_dir)
+        os.replace(tmp_dir, dataset_dir)
+        shutil.rmtree(old_dir, ignore_errors=True)
+        return dataset_dir
+
+    def load(self, file_id: str, columns: Optional[List[str]] = None,
+             months: Optional[Iterable[str]] = None,
+             farm_ids: Optional[Iterable[str]] = None) -> Optional[pd.DataFrame]:
+        """加载数据
+
+        Args:
+            file_id: 数据标识
+            columns: 只读取这些列（None表示全部）
+            months: 只读取这些月份（'YYYY-MM'），按采样日期分区
+            farm_ids: 只读取这些牛场
+
+        Returns:
+            按原始行序排列的DataFrame（索引重置），不存在时返回None
+        """
+        dataset_dir = self._dataset_dir(file_id)
+        if not os.path.isdir(dataset_dir):
+            return None
+
+        pickle_path = os.path.join(dataset_dir, 'data.pkl')
+        if os.path.exists(pickle_path):
+            df = pd.read_pickle(pickle_path).reset_index(drop=True)
+            if months is not None and 'sample_date' in df.columns:
+                month_values = pd.to_datetime(df['sample_date'], errors='coerce').dt.strftime('%Y-%m')
+                df = df[month_values.isin(list(months))]
+            if farm_ids is not None and 'farm_id' in df.columns:
+                df = df[df['farm_id'].astype(str).isin([str(farm) for farm in farm_ids])]
+            if columns is not None:
+                df = df[[col for col in columns if col in df.columns]]
+            df = df.reset_index(drop=True)
+        elif PARQUET_AVAILABLE:
+            schema = pq.read_schema(os.path.join(dataset_dir, self.SCHEMA_FILE))
+            dataset = pa_ds.dataset(dataset_dir, format='parquet', schema=schema,
+                                    partitioning=self._partitioning())
+            expression = None
+            if months is not None:
+                expression = pa_ds.field(self.MONTH_PARTITION).isin([str(month) for month in months])
+            if farm_ids is not None:
+                farm_expression = pa_ds.field(self.FARM_PARTITION).isin([str(farm) for farm in farm_ids])
+                expression = farm_expression if expression is None else expression & farm_expression
+            store_columns = {self.MONTH_PARTITION, self.FARM_PARTITION, self.ROW_ORDER}
+            if columns is None:
+                read_columns = [name for name in schema.names if name not in store_columns]
+            else:
+                read_columns = [col for col in columns if col in schema.names and col not in store_columns]
+            table = dataset.to_table(columns=read_columns + [self.ROW_ORDER], filter=expression)
+            df = table.to_pandas()
+            df = df.sort_values(self.ROW_ORDER, kind='stable').drop(columns=[self.ROW_ORDER]).reset_index(drop=True)
+        else:
+            logger.warning(f"临时数据 {file_id} 为Parquet格式，但未安装pyarrow")
+            return None
+
+        attrs_path = os.path.join(dataset_dir, self.ATTRS_FILE)
+        if os.path.exists(attrs_path):
+            with open(attrs_path, 'r', encoding='utf-8') as f:
+                df.attrs = json.load(f)
+        return df
+
+    def remove(self, file_id: str) -> None:
+        """删除数据"""
+        shutil.rmtree(self._dataset_dir(file_id), ignore_errors=True)
+
+    def clear(self) -> None:
+        """删除全部临时数据（含中断写入留下的临时目录）"""
+        try:
+            names = os.listdir(self.root_dir)
+        except OSError:
+            return
+        for name in names:
+            path = os.path.join(self.root_dir, name)
+            if os.path.isdir(path):
+                shutil.rmtree(path, ignore_errors=True)
+            else:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
@@ -1,19 +1,181 @@
 import pandas as pd
+import numpy as np
+from pandas.io.parsers import TextParser
 import zipfile
 import os
 import sys
 import re
 import yaml
+import json
 import tempfile
 import shutil
-from typing import Dict, List, Tuple, Optional, Any
+import uuid
+import weakref
+from collections import OrderedDict
+from typing import IO, Dict, List, Tuple, Optional, Any, Union
 from datetime import datetime
 import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
 
 from models import FilterConfig
+from columnar_store import ParseCache, TempDataStore, rules_digest
+from herd_table import HerdTable, ID_FIELDS, INTERNAL_COLUMNS, format_months, normalize_id_series
+from ingest_normalizer import IngestNormalizer, intern_strings
+from header_templates import HeaderTemplateRegistry
+from screening_index import ScreeningIndex, format_plan, popcount
+from result_cache import ResultCache, make_cache_key, normalize_filters
+from monthly_aggregates import MonthlyAggregates
+from file_signatures import FileSignature, SignatureIndex, signature_similarity
 
 logger = logging.getLogger(__name__)
 
+# ZIP成员读入内存的上限，超过后缓冲区自动转存临时文件
+ZIP_MEMBER_SPOOL_BYTES = 64 * 1024 * 1024
+
+# 保留月度汇总聚合的最近报告数（报告attrs只记录报告键，聚合由处理器按键保存）
+REPORT_AGGREGATES_LIMIT = 16
+
+# 未配置field_schema时沿用的字段类型（与早期版本的转换结果一致）
+DEFAULT_FIELD_SCHEMA = {
+    'farm_id': 'string',
+    'management_id': 'string',
+    'sample_date': 'datetime64[ns]',
+    'parity': 'float64',
+    'lactation_days': 'Int64',
+    'protein_pct': 'float64',
+    'milk_yield': 'float64',
+}
+
+
+# 月度报告中各字段的中文列名（月度明细列为“YYYY年MM月”+列名）
+REPORT_FIELD_NAMES = {
+    'protein_pct': '蛋白率(%)',
+    'fat_pct': '乳脂率(%)',
+    'fat_protein_ratio': '脂蛋比',
+    'somatic_cell_count': '体细胞数(万/ml)',
+    'somatic_cell_score': '体细胞分',
+    'urea_nitrogen': '尿素氮(mg/dl)',
+    'lactose_pct': '乳糖率',
+    'milk_loss': '奶损失(Kg)',
+    'milk_payment_diff': '奶款差',
+    'economic_loss': '经济损失',
+    'corrected_milk': '校正奶(Kg)',
+    'persistency': '持续力',
+    'whi': 'WHI',
+    'fore_milk_yield': '前奶量(Kg)',
+    'fore_somatic_cell_count': '前体细胞(万/ml)',
+    'fore_somatic_cell_score': '前体细胞分',
+    'fore_milk_loss': '前奶损失(Kg)',
+    'peak_milk_yield': '高峰奶(Kg)',
+    'peak_days': '高峰日(天)',
+    'milk_305': '305奶量(Kg)',
+    'total_milk_yield': '总奶量(Kg)',
+    'total_fat_pct': '总乳脂(%)',
+    'total_protein_pct': '总蛋白(%)',
+    'mature_equivalent': '成年当量(Kg)',
+    'milk_yield': '产奶量(Kg)',
+    'lactation_days': '泌乳天数(天)'
+}
+
+# 按产奶量加权平均的字段：(每头牛的平均值列, 全部数据总平均值的attrs键)
+WEIGHTED_REPORT_FIELDS = {
+    'protein_pct': ('平均蛋白率(%)', 'overall_protein_avg'),
+    'fat_pct': ('平均乳脂率(%)', 'overall_fat_avg'),
+    'lactose_pct': ('平均乳糖率(%)', 'overall_lactose_avg'),
+}
+
+# 计算各月平均值（attrs['monthly_averages']）的字段及保留小数位
+MONTHLY_AVERAGE_DIGITS = {
+    'protein_pct': 2,
+    'somatic_cell_count': 1,
+    'fat_pct': 2,
+    'milk_yield': 1,
+    'lactation_days': 1,
+    'fat_protein_ratio': 2,
+    'urea_nitrogen': 1,
+    'total_fat_pct': 2,
+    'total_protein_pct': 2,
+    'mature_equivalent': 1,
+}
+
+
+def frame_memory_bytes(df: pd.DataFrame) -> int:
+    """估算DataFrame占用的内存，同一字符串对象只计算一次"""
+    total = int(df.index.memory_usage())
+    for col in df.columns:
+        series = df[col]
+        if series.dtype == object:
+            values = series.to_numpy()
+            unique_objects = {id(value): value for value in values}
+            total += values.nbytes + sum(sys.getsizeof(value) for value in unique_objects.values())
+        else:
+            total += int(series.memory_usage(index=False, deep=True))
+    return total
+
+
+def legacy_column_bytes(series: pd.Series, legacy_dtype: str) -> int:
+    """估算某列按早期版本类型（DEFAULT_FIELD_SCHEMA）保存时的内存占用"""
+    row_count = len(series)
+    if legacy_dtype == 'string':
+        # 早期版本每行都是独立的字符串对象
+        return row_count * 8 + sum(sys.getsizeof(str(value)) for value in series.dropna())
+    if legacy_dtype == 'Int64':
+        return row_count * 9
+    return row_count * 8
+
+
+# 计算数值范围（筛选条件默认值）的字段，各文件上传时统计一次
+RANGE_FIELDS = [
+    'protein_pct', 'fat_pct', 'lactose_pct', 'solids_pct', 
+    'milk_yield', 'lactation_days', 'somatic_cell_count',
+    'fat_protein_ratio', 'somatic_cell_score', 'urea_nitrogen',
+    'freezing_point', 'total_bacterial_count', 'dry_matter_intake',
+    'net_energy_lactation', 'metabolizable_protein', 'crude_protein',
+    'neutral_detergent_fiber', 'acid_detergent_fiber', 'starch',
+    'ether_extract', 'ash', 'calcium', 'phosphorus', 'magnesium',
+    'sodium', 'potassium', 'sulfur'
+]
+
+
+def widen_float32(series: pd.Series) -> pd.Series:
+    """将float32列还原为float64用于展示和导出，消除3.0999999这类单精度尾数"""
+    if series.dtype == np.float32:
+        return series.astype('float64').round(6)
+    return series
+
+
+def widen_compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """将紧凑类型还原为报表使用的类型（float32→float64，小整数→早期版本的类型）"""
+    df = df.copy()
+    for col in df.columns:
+        dtype = str(df[col].dtype)
+        if dtype == 'float32':
+            df[col] = widen_float32(df[col])
+        elif dtype in ('Int8', 'Int16', 'Int32'):
+            df[col] = df[col].astype(DEFAULT_FIELD_SCHEMA.get(col, 'Int64'))
+    return df
+
+
+# 并行解析工作进程内复用的处理器（每个进程只加载一次规则与配置）
+_worker_processor = None
+
+
+def _init_parse_worker(rules_path: str, config_path: str, temp_dir: str) -> None:
+    """工作进程初始化：创建本进程专用的DataProcessor"""
+    global _worker_processor
+    _worker_processor = DataProcessor(rules_path, config_path, temp_dir)
+
+
+def _parse_file_in_worker(index: int, file_path: str, filename: str) -> Tuple[int, bool, str, Optional[pd.DataFrame]]:
+    """在工作进程中解析单个上传文件，返回上传顺序索引以便主进程按序归位"""
+    try:
+        success, message, df = _worker_processor.process_uploaded_file(file_path, filename)
+    except Exception as e:
+        success, message, df = False, f"处理文件时出错: {str(e)}", None
+    return index, success, message, df
+
 
 class DataProcessor:
     """数据处理核心类"""
@@ -24,6 +186,8 @@ class DataProcessor:
         rules_path = rules_file if os.path.isabs(rules_file) else os.path.join(base_dir, rules_file)
         config_path = config_file if os.path.isabs(config_file) else os.path.join(base_dir, config_file)
 
+        self.rules_path = rules_path
+        self.config_path = config_path
         self.rules = self._load_yaml(rules_path)
         self.config = self._load_yaml(config_path)
         
@@ -47,6 +211,50 @@ class DataProcessor:
         
         os.makedirs(self.temp_dir, exist_ok=True)
         
+        # 解析结果缓存（按文件内容寻址，保存在temp_dir下）
+        upload_config = self.config.get("upload", {}) if self.config else {}
+        export_config = self.config.get("export", {}) if self.config else {}
+        self.parse_cache = None
+        if upload_config.get("parse_cache_enabled", True):
+            self.parse_cache = ParseCache(
+                os.path.join(self.temp_dir, "parse_cache"),
+                retention_hours=export_config.get("temp_retention_hours", 24),
+                max_bytes=int(upload_config.get("parse_cache_max_mb", 512)) * 1024 * 1024
+            )
+            self.parse_cache.evict()
+        
+        # 临时数据列式存储（按月份/牛场分区）
+        self.temp_store = TempDataStore(os.path.join(self.temp_dir, "temp_data"))
+        
+        # 表头模板注册表（按表头指纹记住表头行与字段映射）
+        self.header_templates = None
+        if upload_config.get("header_templates_enabled", True):
+            self.header_templates = HeaderTemplateRegistry(
+                os.path.join(self.temp_dir, "header_templates.json"),
+                self._get_parse_rules_version()
+            )
+        
+        # 规范化阶段（汇总行过滤、类型转换、日期格式缓存），按rules.yaml编译一次
+        legacy_config = self.rules.get("file_ingest", {}).get("legacy_support", {})
+        self.normalizer = IngestNormalizer(self._get_field_schema(), legacy_config.get("placeholder_values"))
+        
+        # 牛群长表（各分析共用的合并数据，按文件增量构建）
+        self.herd_table = HerdTable(stats_fields=RANGE_FIELDS)
+        # 多筛选项位图索引（按所选文件、长表版本和基础筛选条件缓存最近一次）
+        self._screening_index_key = None
+        self._screening_index: Optional[ScreeningIndex] = None
+        # 最近一次多筛选项的执行计划与各步耗时（过程日志行）
+        self.last_filter_plan: List[str] = []
+        
+        # 筛选结果与月度报告缓存（数据内容摘要+筛选条件为键，数据变化或统一牧场编号时清空）
+        app_config = self.config.get("app", {}) if self.config else {}
+        self.result_cache = ResultCache(int(app_config.get("result_cache_max_mb", 256)) * 1024 * 1024)
+        self._result_cache_version = None
+        # 月度报告的汇总聚合（报告键 -> MonthlyAggregates），按最近使用淘汰
+        self._report_aggregates: "OrderedDict[str, MonthlyAggregates]" = OrderedDict()
+        # 各文件的重复检测签名（文件名 -> (源数据弱引用, (行数, 列), 签名)），上传时计算一次
+        self._file_signatures: Dict[str, Tuple[weakref.ref, Tuple, FileSignature]] = {}
+        
         # 在群牛数据存储
         self.active_cattle_list = None
         self.active_cattle_enabled = False
@@ -226,25 +434,156 @@ class DataProcessor:
             logger.error(f"Error extracting date range: {e}")
             return None
     
+    def _get_parse_rules_version(self) -> str:
+        """影响解析结果的规则版本（field_map与文件识别规则）"""
+        file_ingest = self.rules.get("file_ingest", {})
+        return rules_digest(
+            self.rules.get("field_map", {}),
+            self._get_field_schema(),
+            file_ingest.get("legacy_support", {}),
+            file_ingest.get("internal_targets", []),
+            file_ingest.get("excluded_files", [])
+        )
+    
+    def _load_cached_parse(self, cache_key: str, file_path: str, filename: str,
+                           detected_date: Optional[str]) -> Optional[Tuple[bool, str, pd.DataFrame]]:
+        """命中解析缓存时直接返回规范化后的数据"""
+        df = self.parse_cache.get(cache_key)
+        if df is None:
+            return None
+        
+        missing_farm_id_info = df.attrs.get('missing_farm_id_info')
+        if missing_farm_id_info and not filename.endswith('.zip'):
+            # 直接上传的Excel以本次上传的文件名提示用户
+            missing_farm_id_info['filename'] = file_path.split('/')[-1]
+        
+        # 列式文件读回的管理号是独立的字符串对象，重新复用
+        if self._get_field_schema().get('management_id') == 'interned_string' and 'management_id' in df.columns:
+            df['management_id'] = intern_strings(df['management_id'])
+        
+        logger.info(f"解析缓存命中: {filename}，跳过Excel解析")
+        message = f"成功处理文件，共 {len(df)} 行数据"
+        if detected_date:
+            message += f"，检测到日期: {detected_date}"
+        if missing_farm_id_info:
+            message += f"，缺少牛场编号需要用户输入"
+        return True, message, df
+    
     def process_uploaded_file(self, file_path: str, filename: str) -> Tuple[bool, str, Optional[pd.DataFrame]]:
         """处理上传的文件"""
         try:
             detected_date = self.extract_date_from_filename(filename)
             
+            if not filename.endswith(('.zip', '.xlsx', '.xls')):
+                return False, "不支持的文件格式", None
+            
+            cache_key = None
+            if self.parse_cache is not None:
+                try:
+                    cache_key = self.parse_cache.make_key(file_path, self._get_parse_rules_version())
+                    cached = self._load_cached_parse(cache_key, file_path, filename, detected_date)
+                    if cached is not None:
+                        return cached
+                except OSError as e:
+                    logger.warning(f"解析缓存不可用: {e}")
+                    cache_key = None
+            
             if filename.endswith('.zip'):
-                return self._process_zip_file(file_path, detected_date)
-            elif filename.endswith(('.xlsx', '.xls')):
-                return self._process_excel_file(file_path, detected_date)
+                success, message, df = self._process_zip_file(file_path, detected_date)
             else:
-                return False, "不支持的文件格式", None
+                success, message, df = self._process_excel_file(file_path, detected_date)
+            
+            if success and df is not None and cache_key:
+                self.parse_cache.put(cache_key, df)
+            
+            return success, message, df
                 
         except Exception as e:
             logger.error(f"Error processing file {filename}: {e}")
             return False, f"处理文件时出错: {str(e)}", None
     
-    def _process_zip_file(self, zip_path: str, detected_date: Optional[str]) -> Tuple[bool, str, Optional[pd.DataFrame]]:
-        """处理ZIP压缩包 - 支持递归搜索和多种文件名"""
-        target_files = self.rules.get("file_ingest", {}).get("internal_targets", [
+    def _get_parallel_workers(self, file_count: int) -> int:
+        """根据规则配置和文件数量确定并行解析的进程数"""
+        configured = self.rules.get("file_ingest", {}).get("parallel_workers", 0) or 0
+        try:
+            configured = int(configured)
+        except (TypeError, ValueError):
+            configured = 0
+        if configured <= 0:
+            configured = os.cpu_count() or 1
+        return max(1, min(configured, file_count))
+
+    def parse_files_parallel(self, file_paths: List[str], filenames: List[str],
+                             max_workers: Optional[int] = None,
+                             on_file_done=None) -> List[Tuple[bool, str, Optional[pd.DataFrame]]]:
+        """使用进程池并行解析多个上传文件
+
+        Args:
+            file_paths: 文件路径列表
+            filenames: 与file_paths一一对应的原始文件名
+            max_workers: 进程数，None时读取rules.yaml的file_ingest.parallel_workers
+            on_file_done: 每个文件解析完成时的回调 (index, filename, success, message, df)，
+                在调用线程中按完成先后触发，可用于进度与日志更新
+
+        Returns:
+            与上传顺序一致的 (success, message, df) 列表
+        """
+        total = len(file_paths)
+        results: List[Optional[Tuple[bool, str, Optional[pd.DataFrame]]]] = [None] * total
+        workers = max_workers if max_workers else self._get_parallel_workers(total)
+        workers = max(1, min(workers, total)) if total else 1
+
+        def _record(index, success, message, df):
+            results[index] = (success, message, df)
+            if on_file_done:
+                try:
+                    on_file_done(index, filenames[index], success, message, df)
+                except Exception as e:
+                    logger.warning(f"文件完成回调出错: {e}")
+
+        pending = list(range(total))
+        if workers > 1:
+            logger.info(f"并行解析 {total} 个文件，进程数: {workers}")
+            try:
+                # 使用spawn避免在带Qt线程的进程中fork带来的死锁风险
+                context = multiprocessing.get_context("spawn")
+                with ProcessPoolExecutor(max_workers=workers, mp_context=context,
+                                         initializer=_init_parse_worker,
+                                         initargs=(self.rules_path, self.config_path, self.temp_dir)) as executor:
+                    futures = {executor.submit(_parse_file_in_worker, i, file_paths[i], filenames[i]): i
+                               for i in range(total)}
+                    for future in as_completed(futures):
+                        try:
+                            index, success, message, df = future.result()
+                        except BrokenProcessPool:
+                            raise
+                        except Exception as e:
+                            # 结果无法回传等单文件异常，留给下方逐个解析重试
+                            logger.warning(f"文件 {filenames[futures[future]]} 并行解析异常: {e}")
+                            continue
+                        _record(index, success, message, df)
+            except (BrokenProcessPool, OSError, RuntimeError) as e:
+                logger.warning(f"进程池解析失败，回退为逐个解析: {e}")
+            pending = [i for i in range(total) if results[i] is None]
+
+        # 单文件、单进程或进程池异常时逐个解析
+        for i in pending:
+            try:
+                success, message, df = self.process_uploaded_file(file_paths[i], filenames[i])
+            except Exception as e:
+                success, message, df = False, f"处理文件时出错: {str(e)}", None
+            _record(i, success, message, df)
+        
+        # 本批命中的表头模板一次写回最近使用时间
+        if self.header_templates is not None:
+            self.header_templates.flush()
+
+        return results
+
+    def _get_zip_target_rules(self) -> Tuple[List[str], List[str]]:
+        """获取ZIP包内目标文件（按优先级排序）与排除文件列表"""
+        file_ingest = self.rules.get("file_ingest", {})
+        target_files = file_ingest.get("internal_targets", [
             "04-2综合测定结果表.xlsx",
             "04-2综合测定结果表.xls", 
             "04综合测定结果表.xlsx",
@@ -252,86 +591,98 @@ class DataProcessor:
             "综合测定结果表.xlsx",
             "综合测定结果表.xls"
         ])
+        excluded_files = file_ingest.get("excluded_files", [])
+        return target_files, excluded_files
+    
+    @staticmethod
+    def _decode_zip_member_name(info: zipfile.ZipInfo) -> str:
+        """还原ZIP成员文件名：未标记UTF-8的中文文件名通常为GBK编码"""
+        if info.flag_bits & 0x800:
+            return info.filename
+        try:
+            return info.filename.encode('cp437').decode('gbk')
+        except (UnicodeEncodeError, UnicodeDecodeError):
+            return info.filename
+    
+    def _resolve_zip_member(self, zip_ref: zipfile.ZipFile) -> Tuple[Optional[zipfile.ZipInfo], Optional[str], List[str]]:
+        """仅根据ZIP目录选出要解析的成员，不解压任何文件
+        
+        先按internal_targets优先级匹配文件名，找不到时退回第一个未被排除的Excel文件。
+        
+        Returns:
+            (成员信息, 成员文件名, ZIP包内所有文件名)
+        """
+        target_files, excluded_files = self._get_zip_target_rules()
+        
+        candidates = []
+        for info in zip_ref.infolist():
+            if info.is_dir():
+                continue
+            parts = self._decode_zip_member_name(info).replace('\\', '/').split('/')
+            member_name = parts[-1]
+            # 跳过macOS打包产生的资源文件
+            if '__MACOSX' in parts or member_name.startswith('._'):
+                continue
+            candidates.append((info, member_name))
+        
+        found_files = [member_name for _, member_name in candidates]
+        usable = [(info, member_name) for info, member_name in candidates if member_name not in excluded_files]
         
-        # 获取需要排除的文件名列表
-        excluded_files = self.rules.get("file_ingest", {}).get("excluded_files", [])
+        for target_file in target_files:
+            for info, member_name in usable:
+                if member_name == target_file:
+                    return info, member_name, found_files
+        
+        for info, member_name in usable:
+            if member_name.endswith(('.xlsx', '.xls')) and not member_name.startswith('~'):
+                logger.info(f"未找到目标文件，尝试使用其他Excel文件: {member_name}")
+                return info, member_name, found_files
+        
+        return None, None, found_files
+    
+    @staticmethod
+    def _read_zip_member(zip_ref: zipfile.ZipFile, info: zipfile.ZipInfo) -> IO[bytes]:
+        """将单个ZIP成员读入缓冲区（超过阈值时自动落盘），调用方负责关闭"""
+        buffer = tempfile.SpooledTemporaryFile(max_size=ZIP_MEMBER_SPOOL_BYTES)
+        with zip_ref.open(info) as member:
+            shutil.copyfileobj(member, buffer)
+        buffer.seek(0)
+        return buffer
+    
+    def _process_zip_file(self, zip_path: str, detected_date: Optional[str]) -> Tuple[bool, str, Optional[pd.DataFrame]]:
+        """处理ZIP压缩包 - 按目录选出目标成员，只读取该成员"""
+        target_files, excluded_files = self._get_zip_target_rules()
         
         logger.info(f"开始处理ZIP文件: {zip_path}")
         logger.info(f"目标文件列表: {target_files}")
         logger.info(f"排除文件列表: {excluded_files}")
         
-        with tempfile.TemporaryDirectory() as temp_dir:
-            try:
-                with zipfile.ZipFile(zip_path, 'r') as zip_ref:
-                    # 显示ZIP包中的所有文件
-                    file_list = zip_ref.namelist()
-                    logger.info(f"ZIP包中的文件: {file_list}")
-                    
-                    zip_ref.extractall(temp_dir)
-                    logger.info(f"ZIP文件解压到: {temp_dir}")
-                
-                # 递归查找目标Excel文件
-                excel_path = None
-                found_files = []
-                target_filename = None
-                
-                for root, dirs, files in os.walk(temp_dir):
-                    logger.info(f"扫描目录: {root}, 文件: {files}")
-                    for file in files:
-                        found_files.append(file)
-                        
-                        # 检查文件是否在排除列表中
-                        if file in excluded_files:
-                            logger.info(f"跳过排除的文件: {file}")
-                            continue
-                        
-                        # 按优先级顺序查找目标文件
-                        for target_file in target_files:
-                            if file == target_file:
-                                excel_path = os.path.join(root, file)
-                                target_filename = target_file
-                                logger.info(f"找到目标文件: {excel_path}")
-                                break
-                        if excel_path:
-                            break
-                    if excel_path:
-                        break
+        try:
+            with zipfile.ZipFile(zip_path, 'r') as zip_ref:
+                # 显示ZIP包中的所有文件
+                logger.info(f"ZIP包中的文件: {zip_ref.namelist()}")
                 
-                if not excel_path:
+                member, target_filename, found_files = self._resolve_zip_member(zip_ref)
+                if member is None:
                     logger.error(f"未找到任何目标文件")
                     logger.info(f"实际找到的文件: {found_files}")
-                    # 尝试查找任何Excel文件（排除掉excluded_files中的文件）
-                    excel_files = [f for f in found_files 
-                                 if f.endswith(('.xlsx', '.xls')) 
-                                 and not f.startswith('~') 
-                                 and f not in excluded_files]
-                    if excel_files:
-                        logger.info(f"找到其他Excel文件: {excel_files}")
-                        # 尝试使用第一个Excel文件
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                if file in excel_files:
-                                    excel_path = os.path.join(root, file)
-                                    target_filename = file
-                                    logger.info(f"尝试使用文件: {excel_path}")
-                                    break
-                            if excel_path:
-                                break
-                
-                if not excel_path:
                     excluded_msg = f"，已排除文件: {excluded_files}" if excluded_files else ""
                     return False, f"未找到目标文件，支持的文件名: {target_files}，实际文件: {found_files}{excluded_msg}", None
                 
-                return self._process_excel_file(excel_path, detected_date, target_filename)
-                
-            except zipfile.BadZipFile as e:
-                logger.error(f"ZIP文件格式错误: {e}")
-                return False, "无效的ZIP文件", None
-            except Exception as e:
-                logger.error(f"处理ZIP文件时出错: {e}")
-                return False, f"处理ZIP文件失败: {str(e)}", None
+                logger.info(f"找到目标文件: {member.filename}")
+                buffer = self._read_zip_member(zip_ref, member)
+            
+            with buffer:
+                return self._process_excel_file(buffer, detected_date, target_filename)
+            
+        except zipfile.BadZipFile as e:
+            logger.error(f"ZIP文件格式错误: {e}")
+            return False, "无效的ZIP文件", None
+        except Exception as e:
+            logger.error(f"处理ZIP文件时出错: {e}")
+            return False, f"处理ZIP文件失败: {str(e)}", None
     
-    def _process_excel_file(self, excel_path: str, detected_date: Optional[str], target_filename: Optional[str] = None) -> Tuple[bool, str, Optional[pd.DataFrame]]:
+    def _process_excel_file(self, excel_path: Union[str, IO[bytes]], detected_date: Optional[str], target_filename: Optional[str] = None) -> Tuple[bool, str, Optional[pd.DataFrame]]:
         """处理Excel文件 - 支持老版本DHI报告"""
         try:
             # 获取老版本支持配置
@@ -339,16 +690,19 @@ class DataProcessor:
             max_header_rows = legacy_config.get("max_header_search_rows", 15)
             summary_keywords = legacy_config.get("summary_row_keywords", ["小计", "平均与总计", "合计", "总计", "平均"])
             
-            # 检测表头位置
-            header_row = self._detect_header_row(excel_path, max_header_rows)
-            logger.info(f"检测到表头位置: 第{header_row + 1}行")
+            # 只读取一次前几行作为表头预览：先比对已知模板的表头行指纹，命中则跳过表头检测与列名匹配
+            preview = self._read_header_preview(excel_path, max_header_rows)
+            header_row, template = self._match_header_template(preview)
             
-            # 设置数据类型，确保管理号/牛号作为字符串读取
-            dtype_dict = {}
-            
-            # 使用检测到的表头位置读取文件
-            df = pd.read_excel(excel_path, header=header_row, dtype=dtype_dict)
-            logger.info(f"读取Excel文件成功，原始列名: {list(df.columns)}")
+            if template is None:
+                # 检测表头位置（复用同一份预览）
+                header_row = self._detect_header_row(excel_path, max_header_rows, preview)
+                logger.info(f"检测到表头位置: 第{header_row + 1}行")
+            else:
+                logger.info(f"表头模板命中: 第{header_row + 1}行，跳过表头检测")
+            df = pd.read_excel(excel_path, header=header_row)
+            raw_columns = list(df.columns)
+            logger.info(f"读取Excel文件成功，原始列名: {raw_columns}")
             logger.info(f"数据行数: {len(df)}")
             
             # 过滤汇总行（老版本兼容）
@@ -366,117 +720,23 @@ class DataProcessor:
                 }
                 logger.warning(f"文件 {target_filename} 缺少牛场编号列，需要用户输入")
             
-            # 验证表头
-            field_map = self.rules.get("field_map", {})
-            missing_columns = []
-            
-            # 检查必要的列 - 移除强制的蛋白率要求，改为可选
-            # 同时移除对牧场编号的强制要求
-            required_columns = ['管理号', '胎次(胎)', '采样日期']
-            # 推荐列，不强制要求
-            recommended_columns = ['蛋白率(%)', '产奶量(Kg)', '泌乳天数(天)', '牛场编号']
-            
-            # 兼容老版本字段名
-            if not any(col in df.columns for col in required_columns):
-                # 尝试老版本字段名
-                alt_required = ['牛号', '胎次', '采样日期']
-                alt_recommended = ['蛋白率', '产奶量', '泌乳天数', '牛场编号']
-                
-                # 检查是否存在老版本字段
-                if any(col in df.columns for col in alt_required):
-                    required_columns = alt_required
-                    recommended_columns = alt_recommended
-                else:
-                    # 如果都不存在，尝试更灵活的匹配
-                    flexible_required = []
-                    for col in df.columns:
-                        if any(keyword in col for keyword in ['牛号', '管理号', '编号']) and '牧场' not in col and '牛场' not in col:
-                            if '管理号' in required_columns:
-                                required_columns = [col if c == '管理号' else c for c in required_columns]
-                            elif '牛号' in required_columns:
-                                required_columns = [col if c == '牛号' else c for c in required_columns]
-                            break
-            
-            for chinese_col in required_columns:
-                if chinese_col not in df.columns:
-                    missing_columns.append(chinese_col)
-            
-            # 如果缺少必要列，先检查是否是老版本兼容性问题
-            if missing_columns:
-                # 尝试更宽松的列名匹配
-                alternative_matches = {
-                    '牛号': ['牛号', '管理号', '奶牛号', '牛编号'],
-                    '管理号': ['管理号', '牛号', '奶牛号', '牛编号'],
-                    '胎次': ['胎次', '胎次(胎)', '胎数', '产犊胎次'],
-                    '胎次(胎)': ['胎次(胎)', '胎次', '胎数', '产犊胎次'],
-                    '采样日期': ['采样日期', '样品日期', '测定日期', '检测日期'],
-                    '蛋白率': ['蛋白率', '蛋白率(%)', '蛋白质率', '蛋白含量'],
-                    '蛋白率(%)': ['蛋白率(%)', '蛋白率', '蛋白质率', '蛋白含量']
-                }
-                
-                # 尝试找到替代列名
-                found_alternatives = []
-                still_missing = []
-                
-                for missing_col in missing_columns:
-                    found = False
-                    if missing_col in alternative_matches:
-                        for alt_name in alternative_matches[missing_col]:
-                            if alt_name in df.columns:
-                                found_alternatives.append((missing_col, alt_name))
-                                found = True
-                                break
-                    if not found:
-                        still_missing.append(missing_col)
-                
-                # 如果找到了替代列，更新missing_columns
-                if found_alternatives:
-                    logger.info(f"找到替代列名: {found_alternatives}")
-                    missing_columns = still_missing
-            
-            # 简化的缺失列检查 - 只要有基本字段就允许处理
-            if missing_columns:
-                # 检查是否至少有管理号/牛号和采样日期
-                essential_found = 0
-                id_found = False
-                date_found = False
-                
-                for col in df.columns:
-                    if any(keyword in col for keyword in ['牛号', '管理号', '编号']) and '牧场' not in col and '牛场' not in col:
-                        id_found = True
-                        essential_found += 1
-                    elif any(keyword in col for keyword in ['日期', '时间']):
-                        date_found = True
-                        essential_found += 1
-                
-                # 只要有ID字段和日期字段就允许处理
-                if id_found and date_found:
-                    logger.warning(f"文件缺少部分列但包含基本字段，继续处理: {missing_columns}")
-                    missing_columns = []  # 清空，允许继续处理
-                elif essential_found >= 1:
-                    # 至少有一个关键字段，也允许处理
-                    logger.warning(f"文件缺少部分列但包含关键字段，继续处理: {missing_columns}")
-                    missing_columns = []
-                
-                if missing_columns:
-                    logger.error(f"缺失必要列: {missing_columns}")
-                    logger.info(f"文件中实际包含的列: {list(df.columns)}")
-                    
-                    error_msg = f"缺失必要列: {', '.join(missing_columns)}"
-                    if missing_farm_id_info:
-                        # 创建一个包含错误信息但保留missing_farm_id_info的特殊返回
-                        temp_df = pd.DataFrame()
-                        temp_df.attrs['missing_farm_id_info'] = missing_farm_id_info
-                        temp_df.attrs['processing_error'] = error_msg
-                        return False, error_msg, temp_df
-                    else:
-                        return False, error_msg, None
+            # 验证表头（按模板读取的文件已在登记时校验过）
+            if template is None:
+                error_result = self._validate_report_columns(df, missing_farm_id_info)
+                if error_result is not None:
+                    return error_result
             
             # 重命名列 - 只重命名存在的列
-            rename_dict = {}
-            for chinese_col, english_col in field_map.items():
-                if chinese_col in df.columns:
-                    rename_dict[chinese_col] = english_col
+            if template is None:
+                field_map = self.rules.get("field_map", {})
+                rename_dict = {}
+                for chinese_col, english_col in field_map.items():
+                    if chinese_col in df.columns:
+                        rename_dict[chinese_col] = english_col
+                if self.header_templates is not None:
+                    self.header_templates.register(raw_columns, header_row, rename_dict)
+            else:
+                rename_dict = template['rename']
             
             df = df.rename(columns=rename_dict)
             logger.info(f"重命名后的列名: {list(df.columns)}")
@@ -514,8 +774,160 @@ class DataProcessor:
             logger.error(f"处理Excel文件时出错: {str(e)}")
             return False, f"读取Excel文件失败: {str(e)}", None
     
-    def _detect_header_row(self, excel_path: str, max_rows: int = 15) -> int:
-        """检测表头所在行数 - 智能识别新老版本"""
+    def _validate_report_columns(self, df: pd.DataFrame, missing_farm_id_info: Optional[Dict]) -> Optional[Tuple[bool, str, Optional[pd.DataFrame]]]:
+        """校验表头是否包含必要列，缺失时返回错误结果，通过时返回None"""
+        missing_columns = []
+        
+        # 检查必要的列 - 移除强制的蛋白率要求，改为可选
+        # 同时移除对牧场编号的强制要求
+        required_columns = ['管理号', '胎次(胎)', '采样日期']
+        # 推荐列，不强制要求
+        recommended_columns = ['蛋白率(%)', '产奶量(Kg)', '泌乳天数(天)', '牛场编号']
+        
+        # 兼容老版本字段名
+        if not any(col in df.columns for col in required_columns):
+            # 尝试老版本字段名
+            alt_required = ['牛号', '胎次', '采样日期']
+            alt_recommended = ['蛋白率', '产奶量', '泌乳天数', '牛场编号']
+        
+            # 检查是否存在老版本字段
+            if any(col in df.columns for col in alt_required):
+                required_columns = alt_required
+                recommended_columns = alt_recommended
+            else:
+                # 如果都不存在，尝试更灵活的匹配
+                flexible_required = []
+                for col in df.columns:
+                    if any(keyword in col for keyword in ['牛号', '管理号', '编号']) and '牧场' not in col and '牛场' not in col:
+                        if '管理号' in required_columns:
+                            required_columns = [col if c == '管理号' else c for c in required_columns]
+                        elif '牛号' in required_columns:
+                            required_columns = [col if c == '牛号' else c for c in required_columns]
+                        break
+        
+        for chinese_col in required_columns:
+            if chinese_col not in df.columns:
+                missing_columns.append(chinese_col)
+        
+        # 如果缺少必要列，先检查是否是老版本兼容性问题
+        if missing_columns:
+            # 尝试更宽松的列名匹配
+            alternative_matches = {
+                '牛号': ['牛号', '管理号', '奶牛号', '牛编号'],
+                '管理号': ['管理号', '牛号', '奶牛号', '牛编号'],
+                '胎次': ['胎次', '胎次(胎)', '胎数', '产犊胎次'],
+                '胎次(胎)': ['胎次(胎)', '胎次', '胎数', '产犊胎次'],
+                '采样日期': ['采样日期', '样品日期', '测定日期', '检测日期'],
+                '蛋白率': ['蛋白率', '蛋白率(%)', '蛋白质率', '蛋白含量'],
+                '蛋白率(%)': ['蛋白率(%)', '蛋白率', '蛋白质率', '蛋白含量']
+            }
+        
+            # 尝试找到替代列名
+            found_alternatives = []
+            still_missing = []
+        
+            for missing_col in missing_columns:
+                found = False
+                if missing_col in alternative_matches:
+                    for alt_name in alternative_matches[missing_col]:
+                        if alt_name in df.columns:
+                            found_alternatives.append((missing_col, alt_name))
+                            found = True
+                            break
+                if not found:
+                    still_missing.append(missing_col)
+        
+            # 如果找到了替代列，更新missing_columns
+            if found_alternatives:
+                logger.info(f"找到替代列名: {found_alternatives}")
+                missing_columns = still_missing
+        
+        # 简化的缺失列检查 - 只要有基本字段就允许处理
+        if missing_columns:
+            # 检查是否至少有管理号/牛号和采样日期
+            essential_found = 0
+            id_found = False
+            date_found = False
+        
+            for col in df.columns:
+                if any(keyword in col for keyword in ['牛号', '管理号', '编号']) and '牧场' not in col and '牛场' not in col:
+                    id_found = True
+                    essential_found += 1
+                elif any(keyword in col for keyword in ['日期', '时间']):
+                    date_found = True
+                    essential_found += 1
+        
+            # 只要有ID字段和日期字段就允许处理
+            if id_found and date_found:
+                logger.warning(f"文件缺少部分列但包含基本字段，继续处理: {missing_columns}")
+                missing_columns = []  # 清空，允许继续处理
+            elif essential_found >= 1:
+                # 至少有一个关键字段，也允许处理
+                logger.warning(f"文件缺少部分列但包含关键字段，继续处理: {missing_columns}")
+                missing_columns = []
+        
+            if missing_columns:
+                logger.error(f"缺失必要列: {missing_columns}")
+                logger.info(f"文件中实际包含的列: {list(df.columns)}")
+        
+                error_msg = f"缺失必要列: {', '.join(missing_columns)}"
+                if missing_farm_id_info:
+                    # 创建一个包含错误信息但保留missing_farm_id_info的特殊返回
+                    temp_df = pd.DataFrame()
+                    temp_df.attrs['missing_farm_id_info'] = missing_farm_id_info
+                    temp_df.attrs['processing_error'] = error_msg
+                    return False, error_msg, temp_df
+                else:
+                    return False, error_msg, None
+        
+        return None
+    
+    @staticmethod
+    def _read_header_preview(excel_path: Union[str, IO[bytes]], max_rows: int) -> Optional[pd.DataFrame]:
+        """不指定表头读取前max_rows行，供表头模板比对与表头检测共用；读取失败时返回None"""
+        try:
+            return pd.read_excel(excel_path, header=None, nrows=max_rows)
+        except Exception as e:
+            logger.debug(f"读取表头预览失败: {e}")
+            return None
+    
+    @staticmethod
+    def _preview_header_columns(preview: pd.DataFrame, header_row: int) -> Optional[List]:
+        """把预览中的一行转换为按该行作表头读取时的列名，转换失败时返回None
+        
+        与read_excel一致：空单元格为"Unnamed: n"，重名列加".1"等后缀，整数值的浮点数按整数。
+        """
+        values = []
+        for value in preview.iloc[header_row].tolist():
+            if isinstance(value, float):
+                value = '' if pd.isna(value) else (int(value) if value.is_integer() else value)
+            values.append(value)
+        try:
+            # read_excel同样由TextParser解析表头行
+            return list(TextParser([values], header=0).read().columns)
+        except Exception as e:
+            logger.debug(f"按第{header_row + 1}行解析表头失败: {e}")
+            return None
+    
+    def _match_header_template(self, preview: Optional[pd.DataFrame]) -> Tuple[Optional[int], Optional[Dict]]:
+        """在表头预览中逐个比对已知模板的表头行（最近使用的在前），返回(表头行, 模板)；未命中时返回(None, None)"""
+        if self.header_templates is None or preview is None:
+            return None, None
+        
+        for header_row in self.header_templates.header_rows():
+            if header_row >= len(preview):
+                continue
+            columns = self._preview_header_columns(preview, header_row)
+            if columns is None:
+                continue
+            template = self.header_templates.lookup(columns, header_row)
+            if template is not None:
+                return header_row, template
+        return None, None
+    
+    def _detect_header_row(self, excel_path: Union[str, IO[bytes]], max_rows: int = 15,
+                           preview: Optional[pd.DataFrame] = None) -> int:
+        """检测表头所在行数 - 智能识别新老版本（可传入已读取的表头预览）"""
         try:
             # 获取检测配置
             legacy_config = self.rules.get("file_ingest", {}).get("legacy_support", {})
@@ -523,53 +935,49 @@ class DataProcessor:
             old_version_indicators = legacy_config.get("old_version_indicators", ["牛号", "胎次", "采样日期", "蛋白率"])
             core_indicators = legacy_config.get("core_indicators", ["胎次", "采样日期", "蛋白率"])
             
-            # 读取前几行来检测表头位置
-            for row_num in range(max_rows):
-                try:
-                    # 尝试以当前行作为表头读取
-                    sample_df = pd.read_excel(excel_path, header=row_num, nrows=1)
-                    columns = [str(col).strip() for col in sample_df.columns]
-                    
-                    # 检查新版本指示字段匹配度
-                    new_version_matches = sum(1 for indicator in new_version_indicators 
-                                            if any(indicator in col for col in columns))
-                    
-                    # 检查老版本指示字段匹配度
-                    old_version_matches = sum(1 for indicator in old_version_indicators 
-                                            if any(indicator in col for col in columns))
-                    
-                    # 检查核心字段匹配度
-                    core_matches = sum(1 for indicator in core_indicators 
-                                     if any(indicator in col for col in columns))
-                    
-                    # 判断是否找到有效表头
-                    # 新版本：至少匹配3个新版本字段
-                    # 老版本：至少匹配3个老版本字段
-                    # 或者：至少匹配所有核心字段
-                    is_valid_header = (
-                        new_version_matches >= 3 or 
-                        old_version_matches >= 3 or 
-                        core_matches >= len(core_indicators)
-                    )
+            # 只读取一次前max_rows行（不指定表头），在内存中逐行评分
+            if preview is None:
+                preview = pd.read_excel(excel_path, header=None, nrows=max_rows)
+            
+            for row_num in range(len(preview)):
+                columns = [str(value).strip() for value in preview.iloc[row_num].tolist() if pd.notna(value)]
+                
+                # 检查新版本指示字段匹配度
+                new_version_matches = sum(1 for indicator in new_version_indicators 
+                                        if any(indicator in col for col in columns))
+                
+                # 检查老版本指示字段匹配度
+                old_version_matches = sum(1 for indicator in old_version_indicators 
+                                        if any(indicator in col for col in columns))
+                
+                # 检查核心字段匹配度
+                core_matches = sum(1 for indicator in core_indicators 
+                                 if any(indicator in col for col in columns))
+                
+                # 判断是否找到有效表头
+                # 新版本：至少匹配3个新版本字段
+                # 老版本：至少匹配3个老版本字段
+                # 或者：至少匹配所有核心字段
+                is_valid_header = (
+                    new_version_matches >= 3 or 
+                    old_version_matches >= 3 or 
+                    core_matches >= len(core_indicators)
+                )
+                
+                if is_valid_header:
+                    # 判断版本类型
+                    if new_version_matches >= 3:
+                        version_type = "新版本"
+                        match_count = new_version_matches
+                    elif old_version_matches >= 3:
+                        version_type = "老版本"
+                        match_count = old_version_matches
+                    else:
+                        version_type = "通用"
+                        match_count = core_matches
                     
-                    if is_valid_header:
-                        # 判断版本类型
-                        if new_version_matches >= 3:
-                            version_type = "新版本"
-                            match_count = new_version_matches
-                        elif old_version_matches >= 3:
-                            version_type = "老版本"
-                            match_count = old_version_matches
-                        else:
-                            version_type = "通用"
-                            match_count = core_matches
-                        
-                        logger.info(f"在第{row_num + 1}行找到{version_type}表头，匹配{match_count}个字段: {columns}")
-                        return row_num
-                        
-                except Exception as e:
-                    logger.debug(f"尝试第{row_num + 1}行作为表头失败: {e}")
-                    continue
+                    logger.info(f"在第{row_num + 1}行找到{version_type}表头，匹配{match_count}个字段: {columns}")
+                    return row_num
             
             # 如果没有找到，默认使用第一行
             logger.warning("未能自动检测表头位置，使用第1行")
@@ -597,21 +1005,9 @@ class DataProcessor:
             logger.warning("未找到管理号/牛号列，跳过汇总行过滤")
             return df
         
-        # 过滤包含汇总关键字的行
+        # 过滤包含汇总关键字的行（所有关键字合并为一个正则，一次匹配）
         original_count = len(df)
-        
-        # 转换为字符串进行比较
-        id_values = df[id_column].astype(str)
-        
-        # 创建过滤条件
-        filter_condition = pd.Series([True] * len(df))
-        
-        for keyword in summary_keywords:
-            # 过滤掉包含汇总关键字的行
-            keyword_condition = ~id_values.str.contains(keyword, na=False, case=False)
-            filter_condition = filter_condition & keyword_condition
-        
-        filtered_df = df[filter_condition].copy()
+        filtered_df = self.normalizer.filter_summary_rows(df, id_column, summary_keywords)
         filtered_count = len(filtered_df)
         
         logger.info(f"过滤汇总行: 原始{original_count}行 -> 过滤后{filtered_count}行，移除了{original_count - filtered_count}行汇总数据")
@@ -623,61 +1019,49 @@ class DataProcessor:
         farm_id_columns = ['牛场编号', 'farm_id']
         return any(col in df.columns for col in farm_id_columns)
     
+    def _get_field_schema(self) -> Dict[str, str]:
+        """获取字段类型定义（rules.yaml中的field_schema）"""
+        return self.rules.get("field_schema") or DEFAULT_FIELD_SCHEMA
+    
+    def _cast_field(self, series: pd.Series, field: str, dtype: str) -> pd.Series:
+        """按字段类型定义转换单列"""
+        return self.normalizer.cast_series(series, field, dtype)[0]
+    
     def _convert_data_types(self, df: pd.DataFrame) -> pd.DataFrame:
-        """数据类型转换 - 简化版本，只处理必要字段"""
+        """数据类型转换 - 按rules.yaml的field_schema压缩内存，并记录内存报告"""
         try:
-            # 数值型字段 - 只保留必要的
-            numeric_fields = ['parity', 'protein_pct', 'milk_yield']
-            for field in numeric_fields:
-                if field in df.columns:
-                    logger.info(f"转换字段 {field} 为数值型")
-                    df[field] = pd.to_numeric(df[field], errors='coerce')
-                    non_null_count = df[field].notna().sum()
-                    logger.info(f"字段 {field}: {non_null_count} 个有效数值")
-            
-            # 整数型字段（如泌乳天数）
-            integer_fields = ['lactation_days']
-            for field in integer_fields:
-                if field in df.columns:
-                    logger.info(f"转换字段 {field} 为整数型")
-                    df[field] = pd.to_numeric(df[field], errors='coerce')
-                    # 转换为整数，保留NaN值
-                    df[field] = df[field].astype('Int64')  # 使用可空整数类型
-                    non_null_count = df[field].notna().sum()
-                    logger.info(f"字段 {field}: {non_null_count} 个有效整数")
-            
-            # 日期字段 - 只保留采样日期
-            date_fields = ['sample_date']
-            for field in date_fields:
-                if field in df.columns:
-                    logger.info(f"转换字段 {field} 为日期型")
-                    # 先显示原始日期数据的样例
-                    sample_values = df[field].dropna().head(3).tolist()
-                    logger.info(f"字段 {field} 样例值: {sample_values}")
-                    
-                    df[field] = pd.to_datetime(df[field], errors='coerce')
-                    non_null_count = df[field].notna().sum()
-                    logger.info(f"字段 {field}: {non_null_count} 个有效日期")
-            
-            # 字符串字段确保为字符串类型，保留前导零
-            string_fields = ['farm_id', 'management_id']
-            for field in string_fields:
-                if field in df.columns:
-                    # 先转换为字符串，保留前导零
-                    df[field] = df[field].astype(str)
-                    # 移除'nan'字符串，但保留"0"开头的有效字符串
-                    df.loc[df[field] == 'nan', field] = None
-                    # 确保空字符串被转换为None
-                    df.loc[df[field] == '', field] = None
-                    
-                    # 检查并记录管理号的格式
-                    if field == 'management_id':
-                        unique_values = df[field].dropna().unique()
-                        zero_prefixed = [v for v in unique_values if v.startswith('0')]
-                        if zero_prefixed:
-                            logger.info(f"字段 {field}: 发现{len(zero_prefixed)}个0开头的管理号，已保留前导零")
-                    
-                    logger.info(f"字段 {field}: {df[field].notna().sum()} 个有效值")
+            index_bytes = int(df.index.memory_usage())
+            column_memory_before = {col: frame_memory_bytes(df[[col]]) - index_bytes for col in df.columns}
+            
+            placeholder_counts = self.normalizer.cast_frame(df)
+            converted = [field for field in self.normalizer.field_schema if field in df.columns]
+            logger.info(f"类型转换完成: {len(converted)}个字段，采样日期格式: "
+                        f"{self.normalizer.date_formats.get('sample_date', '自动识别')}")
+            if placeholder_counts:
+                logger.info(f"占位符按缺失处理: {placeholder_counts}")
+            
+            # 对比基准：早期版本同样会转换的字段按其旧类型估算，其余字段按读取时的原样计算
+            memory_before = memory_after = index_bytes
+            changed_columns = {}
+            for col in df.columns:
+                after = frame_memory_bytes(df[[col]]) - index_bytes
+                if col in DEFAULT_FIELD_SCHEMA:
+                    before = legacy_column_bytes(df[col], DEFAULT_FIELD_SCHEMA[col])
+                else:
+                    before = column_memory_before.get(col, after)
+                memory_before += before
+                memory_after += after
+                if after != before:
+                    changed_columns[col] = {'dtype': str(df[col].dtype), 'before_bytes': before, 'after_bytes': after}
+            saved_pct = round((1 - memory_after / memory_before) * 100, 1) if memory_before else 0.0
+            df.attrs['memory_report'] = {
+                'rows': len(df),
+                'before_bytes': memory_before,
+                'after_bytes': memory_after,
+                'saved_pct': saved_pct,
+                'columns': changed_columns
+            }
+            logger.info(f"内存占用: {memory_before / 1024 / 1024:.2f}MB → {memory_after / 1024 / 1024:.2f}MB（节省{saved_pct}%）")
             
             return df
         except Exception as e:
@@ -688,6 +1072,15 @@ class DataProcessor:
         """应用筛选条件"""
         filtered_df = df.copy()
         
+        # 需要历史数据填充的字段在第一个此类筛选项处一次性填充
+        history_fields = [
+            filter_value.get('field') for filter_name, filter_value in filters.items()
+            if filter_name not in ['date_range', 'farm_id', 'parity']
+            and filter_value.get('enabled', False)
+            and filter_value.get('empty_handling') == '历史数据填充'
+            and filter_value.get('field') in filtered_df.columns
+        ]
+        
         for filter_name, filter_value in filters.items():
             if not filter_value.get('enabled', False):
                 continue
@@ -696,6 +1089,10 @@ class DataProcessor:
             if field not in filtered_df.columns:
                 continue
             
+            if history_fields and field in history_fields and filter_name not in ['date_range', 'farm_id', 'parity']:
+                filtered_df = self._fill_empty_values_with_history(filtered_df, history_fields)
+                history_fields = []
+            
             try:
                 if filter_name == 'date_range':
                     filtered_df = self._apply_date_filter(filtered_df, field, filter_value)
@@ -744,8 +1141,8 @@ class DataProcessor:
         if field not in df.columns:
             return df
         
-        # 处理空值填充
-        if empty_handling == '历史数据填充':
+        # 处理空值填充（apply_filters已一次性填充过的字段不再重复填充）
+        if empty_handling == '历史数据填充' and f'{field}_historical_filled' not in df.columns:
             df = self._fill_empty_values_with_history(df, field)
         
         # 创建筛选条件
@@ -775,47 +1172,37 @@ class DataProcessor:
         
         return df[condition]
     
-    def _fill_empty_values_with_history(self, df: pd.DataFrame, field: str) -> pd.DataFrame:
-        """使用历史数据填充空值，并标记填充的值"""
+    def _fill_empty_values_with_history(self, df: pd.DataFrame, fields: Union[str, List[str]]) -> pd.DataFrame:
+        """使用历史数据填充空值，并标记填充的值
+        
+        整表按(管理号, 采样日期)排序一次，各字段在同一次分组中前向再后向填充，
+        填充标记列{field}_historical_filled由填充前后的空值掩码求得。结果按管理号、
+        采样日期排列，管理号为空的行不属于任何一头牛，不保留。
+        """
         if 'management_id' not in df.columns or 'sample_date' not in df.columns:
             logger.warning(f"缺少management_id或sample_date列，无法进行历史数据填充")
             return df
         
-        df_copy = df.copy()
-        
-        # 确保sample_date是datetime类型
-        df_copy['sample_date'] = pd.to_datetime(df_copy['sample_date'], errors='coerce')
-        
-        # 记录原始空值位置
-        original_null_mask = df_copy[field].isna()
-        
-        # 按牛只分组进行填充
-        def fill_cow_data(group):
-            # 按日期排序
-            group = group.sort_values('sample_date')
-            # 记录填充前的空值位置
-            null_before = group[field].isna()
-            # 前向填充，然后后向填充
-            group[field] = group[field].ffill().bfill()
-            # 记录填充后的空值位置
-            null_after = group[field].isna()
-            # 标记被填充的值（原来是空的，现在不是空的）
-            filled_mask = null_before & ~null_after
-            
-            # 为历史填充的值添加标记
-            if f'{field}_historical_filled' not in group.columns:
-                group[f'{field}_historical_filled'] = False
-            group.loc[filled_mask, f'{field}_historical_filled'] = True
-            
-            return group
+        fields = [fields] if isinstance(fields, str) else list(fields)
+        fields = [field for field in dict.fromkeys(fields) if field in df.columns]
+        if not fields:
+            return df
         
         try:
-            filled_df = df_copy.groupby('management_id', group_keys=False).apply(fill_cow_data)
+            filled_df = df[df['management_id'].notna()]
+            filled_df = filled_df.assign(sample_date=pd.to_datetime(filled_df['sample_date'], errors='coerce'))
+            filled_df = filled_df.sort_values(['management_id', 'sample_date'], kind='stable')
+            
+            null_before = filled_df[fields].isna()
+            cow_groups = filled_df.groupby('management_id', sort=False, observed=True)
+            filled_values = cow_groups[fields].ffill()
+            filled_values = filled_values.groupby(filled_df['management_id'], sort=False, observed=True).bfill()
+            filled_df[fields] = filled_values
             
-            # 统计填充数量
-            if f'{field}_historical_filled' in filled_df.columns:
-                filled_count = filled_df[f'{field}_historical_filled'].sum()
-                logger.info(f"已对字段{field}进行历史数据填充，共填充{filled_count}个空值")
+            filled_mask = null_before & filled_values.notna()
+            for field in fields:
+                filled_df[f'{field}_historical_filled'] = filled_mask[field]
+                logger.info(f"已对字段{field}进行历史数据填充，共填充{int(filled_mask[field].sum())}个空值")
             
             return filled_df
         except Exception as e:
@@ -838,7 +1225,7 @@ class DataProcessor:
         # 统计原始牛头数
         if 'management_id' in df.columns:
             if 'farm_id' in df.columns:
-                original_cow_count = len(df.groupby(['farm_id', 'management_id']))
+                original_cow_count = len(df.groupby(['farm_id', 'management_id'], observed=True))
             else:
                 mgmt_series = df['management_id']
                 original_cow_count = len(mgmt_series.dropna().unique())
@@ -853,7 +1240,7 @@ class DataProcessor:
         # 统计筛选后牛头数
         if not filtered_df.empty and 'management_id' in filtered_df.columns:
             if 'farm_id' in filtered_df.columns:
-                filtered_cow_count = len(filtered_df.groupby(['farm_id', 'management_id']))
+                filtered_cow_count = len(filtered_df.groupby(['farm_id', 'management_id'], observed=True))
             else:
                 mgmt_ids = filtered_df['management_id'].dropna().unique()
                 filtered_cow_count = len(mgmt_ids)
@@ -864,7 +1251,7 @@ class DataProcessor:
         if not filtered_df.empty:
             # 统计每头牛的胎次分布
             if 'farm_id' in filtered_df.columns and 'management_id' in filtered_df.columns:
-                cow_parity_stats = filtered_df.groupby(['farm_id', 'management_id'])['parity'].agg(['min', 'max', 'nunique']).reset_index()
+                cow_parity_stats = filtered_df.groupby(['farm_id', 'management_id'], observed=True)['parity'].agg(['min', 'max', 'nunique']).reset_index()
                 logger.info(f"筛选后牛只胎次分布: 最小{cow_parity_stats['min'].min()}胎, 最大{cow_parity_stats['max'].max()}胎")
                 
                 # 统计有多胎次数据的牛只
@@ -932,101 +1319,76 @@ class DataProcessor:
         
         return future_lactation_df[condition]
     
-    def _calculate_future_lactation_days(self, df: pd.DataFrame, plan_date: pd.Timestamp) -> pd.DataFrame:
-        """计算每头牛的未来泌乳天数"""
+    @staticmethod
+    def future_days_column(plan_date: pd.Timestamp) -> str:
+        """多个计划调群日期时，各日期未来泌乳天数列的列名"""
+        return f"future_lactation_days_{pd.Timestamp(plan_date).strftime('%Y-%m-%d')}"
+    
+    @staticmethod
+    def _future_lactation_days(last_sample_dates: pd.Series, last_lactation_days: pd.Series,
+                               plan_dates: List[pd.Timestamp]) -> pd.DataFrame:
+        """按计划调群日期计算未来泌乳天数，每个计划日期一列（列名为该日期）
         
-        # 确保关键字段为字符串类型，保持数据一致性
+        未来泌乳天数 = (计划调群日 - 最后一次采样日)的天数 + 最后一次泌乳天数（取整）；
+        泌乳天数为空或结果不为正数时为空值。
+        """
+        sample_dates = pd.to_datetime(last_sample_dates, errors='coerce')
+        lactation_days = pd.to_numeric(last_lactation_days, errors='coerce').astype(float)
+        columns = {}
+        for plan_date in plan_dates:
+            future_days = np.trunc((pd.Timestamp(plan_date) - sample_dates).dt.days + lactation_days)
+            columns[plan_date] = future_days.where(future_days > 0)
+        return pd.DataFrame(columns, index=last_sample_dates.index)
+    
+    def _calculate_future_lactation_days(self, df: pd.DataFrame,
+                                         plan_date: Union[pd.Timestamp, List[pd.Timestamp]]) -> pd.DataFrame:
+        """计算每头牛的未来泌乳天数（取每头牛最后一次采样的记录）
+        
+        plan_date为单个日期时返回future_lactation_days、plan_date、days_from_last_sample列，
+        剔除未来泌乳天数不为正数的牛（泌乳天数为空的牛保留，未来泌乳天数为空）；
+        为日期列表时每个日期返回一列（future_days_column），不剔除牛只。
+        """
+        plan_dates = list(plan_date) if isinstance(plan_date, (list, tuple)) else [plan_date]
+        plan_dates = [pd.Timestamp(date) for date in plan_dates]
+        
+        # 牛只标识统一为字符串，缺少牛场编号或管理号的记录不属于任何一头牛
         df = df.copy()
-        for field in ['farm_id', 'management_id']:
+        for field in ID_FIELDS:
             if field in df.columns:
-                df[field] = df[field].astype(str)
-                # 移除'nan'字符串，转换为None
-                df.loc[df[field] == 'nan', field] = None
+                df[field] = normalize_id_series(df[field])
+        df['sample_date'] = pd.to_datetime(df['sample_date'], errors='coerce')
+        cow_keys = [field for field in ID_FIELDS if field in df.columns]
+        valid = df.dropna(subset=cow_keys + ['sample_date'])
         
-        # 按牛分组，找到每头牛最后一次采样的数据
-        cow_groups = df.groupby(['farm_id', 'management_id'])
-        result_rows = []
+        if valid.empty or not plan_dates or 'management_id' not in cow_keys:
+            logger.warning("没有计算出任何未来泌乳天数")
+            return pd.DataFrame()
         
-        for (farm_id, mgmt_id), group in cow_groups:
-            try:
-                # 确保sample_date是datetime类型
-                group = group.copy()
-                group['sample_date'] = pd.to_datetime(group['sample_date'], errors='coerce')
-                
-                # 过滤掉无效日期的记录
-                valid_dates = group.dropna(subset=['sample_date'])
-                
-                if valid_dates.empty:
-                    continue
-                
-                # 找到最后一次采样记录
-                latest_record = valid_dates.loc[valid_dates['sample_date'].idxmax()]
-                
-                # 获取最后一次的泌乳天数
-                last_lactation_days = latest_record['lactation_days']
-                last_sample_date = latest_record['sample_date']
-                
-                # 检查采样日期有效性（必须有）
-                if pd.isna(last_sample_date):
-                    continue
-                
-                # 检查泌乳天数有效性（可以为空，但如果有值必须是数值）
-                if pd.isna(last_lactation_days):
-                    # 泌乳天数为空时，跳过未来泌乳天数计算，但保留原始记录
-                    new_record = latest_record.copy()
-                    new_record['future_lactation_days'] = None  # 无法计算
-                    new_record['plan_date'] = plan_date
-                    new_record['days_from_last_sample'] = None
-                    result_rows.append(new_record)
-                    logger.debug(f"牛场{farm_id}-管理号{mgmt_id}: 泌乳天数为空，保留记录但未来泌乳天数为空")
-                    continue
-                
-                # 确保泌乳天数是数值类型
-                try:
-                    last_lactation_days = float(last_lactation_days)
-                except (ValueError, TypeError):
-                    # 泌乳天数无法转换为数值时，也保留记录但不计算未来泌乳天数
-                    new_record = latest_record.copy()
-                    new_record['future_lactation_days'] = None
-                    new_record['plan_date'] = plan_date
-                    new_record['days_from_last_sample'] = None
-                    result_rows.append(new_record)
-                    logger.debug(f"牛场{farm_id}-管理号{mgmt_id}: 泌乳天数格式错误，保留记录但未来泌乳天数为空")
-                    continue
-                
-                # 计算日期差异（天数）
-                days_diff = (plan_date - last_sample_date).days
-                
-                # 计算未来泌乳天数：(计划调群日 - 最后一次采样日的天数) + 最后一个月泌乳天数
-                future_lactation_days = int(days_diff + last_lactation_days)
-                
-                # 确保未来泌乳天数为正数
-                if future_lactation_days > 0:
-                    # 创建记录，包含原始数据和计算结果
-                    new_record = latest_record.copy()
-                    new_record['future_lactation_days'] = future_lactation_days
-                    new_record['plan_date'] = plan_date
-                    new_record['days_from_last_sample'] = days_diff
-                    
-                    result_rows.append(new_record)
-                    
-                    logger.debug(f"牛场{farm_id}-管理号{mgmt_id}: "
-                               f"最后采样日{last_sample_date.strftime('%Y-%m-%d')}, "
-                               f"泌乳天数{last_lactation_days}, "
-                               f"间隔{days_diff}天, "
-                               f"未来泌乳天数{future_lactation_days}")
-            
-            except Exception as e:
-                logger.warning(f"计算牛场{farm_id}-管理号{mgmt_id}的未来泌乳天数时出错: {e}")
-                continue
+        # 每头牛最后一次采样记录（一次分组取idxmax）
+        latest_index = valid.groupby(cow_keys, observed=True)['sample_date'].idxmax()
+        result_df = valid.loc[latest_index.to_numpy()].copy()
+        if 'lactation_days' in result_df.columns:
+            lactation_days = result_df['lactation_days']
+        else:
+            lactation_days = pd.Series(np.nan, index=result_df.index)
+        future_days = self._future_lactation_days(result_df['sample_date'], lactation_days, plan_dates)
         
-        if result_rows:
-            result_df = pd.DataFrame(result_rows)
-            logger.info(f"成功计算{len(result_df)}头牛的未来泌乳天数")
-            return result_df
+        if isinstance(plan_date, (list, tuple)):
+            for date in plan_dates:
+                result_df[self.future_days_column(date)] = future_days[date].astype('Int64')
         else:
+            date = plan_dates[0]
+            computable = pd.to_numeric(lactation_days, errors='coerce').notna()
+            result_df['future_lactation_days'] = future_days[date].astype('Int64')
+            result_df['plan_date'] = date
+            result_df['days_from_last_sample'] = (date - result_df['sample_date']).dt.days.where(computable).astype('Int64')
+            result_df = result_df[~computable | future_days[date].notna()]
+        
+        if result_df.empty:
             logger.warning("没有计算出任何未来泌乳天数")
             return pd.DataFrame()
+        logger.info(f"成功计算{len(result_df)}头牛的未来泌乳天数（计划调群日{len(plan_dates)}个）")
+        return result_df
     
     def export_results(self, df: pd.DataFrame, output_path: str) -> bool:
         """导出筛选结果"""
@@ -1086,18 +1448,41 @@ class DataProcessor:
         return available_filters
     
     def save_temp_data(self, df: pd.DataFrame, file_id: str) -> str:
-        """保存临时数据"""
-        temp_file = os.path.join(self.temp_dir, f"{file_id}.pkl")
-        df.to_pickle(temp_file)
-        return temp_file
+        """保存临时数据（按year_month/farm_id分区的列式存储）"""
+        return self.temp_store.save(df, file_id)
     
-    def load_temp_data(self, file_id: str) -> Optional[pd.DataFrame]:
-        """加载临时数据"""
+    def load_temp_data(self, file_id: str, columns: Optional[List[str]] = None,
+                       months: Optional[List[str]] = None,
+                       farm_ids: Optional[List[str]] = None) -> Optional[pd.DataFrame]:
+        """加载临时数据
+        
+        Args:
+            file_id: 保存时使用的标识
+            columns: 只读取需要的列
+            months: 只读取这些月份（'YYYY-MM'）
+            farm_ids: 只读取这些牛场
+        """
+        df = self.temp_store.load(file_id, columns=columns, months=months, farm_ids=farm_ids)
+        if df is not None:
+            return df
+        
+        # 兼容旧版本保存的pickle临时文件
         temp_file = os.path.join(self.temp_dir, f"{file_id}.pkl")
         if os.path.exists(temp_file):
             return pd.read_pickle(temp_file)
         return None
     
+    def get_herd_table(self, data_list: List[Dict]) -> HerdTable:
+        """获取与data_list对齐的牛群长表（只整理新增或被替换的文件）"""
+        herd_table = self.herd_table.sync(data_list)
+        self._prune_file_signatures(herd_table.filenames)
+        return herd_table
+    
+    @staticmethod
+    def _drop_internal_columns(df: pd.DataFrame) -> pd.DataFrame:
+        """去除牛群长表的内部列（cow_key/month）"""
+        return df.drop(columns=[col for col in INTERNAL_COLUMNS if col in df.columns])
+    
     def process_multiple_files_with_progress(self, file_paths: List[str], filenames: List[str]) -> Dict[str, Any]:
         """批量处理多个文件（带进度更新）"""
         # 导入进度变量
@@ -1113,18 +1498,21 @@ class DataProcessor:
         }
         
         total_files = len(file_paths)
+        completed = [0]
         
-        for i, (file_path, filename) in enumerate(zip(file_paths, filenames)):
-            # 更新进度
+        def on_file_done(index, filename, success, message, df):
+            # 按完成先后更新进度
+            completed[0] += 1
             processing_progress.update({
                 "current_file": filename,
-                "current_step": f"处理文件 ({i+1}/{total_files})",
-                "progress_percentage": 30 + int((i / total_files) * 60)  # 处理占60%
+                "current_step": f"处理文件 ({completed[0]}/{total_files})",
+                "progress_percentage": 30 + int((completed[0] / total_files) * 60)  # 处理占60%
             })
-            
-            logger.info(f"处理文件 {i+1}/{total_files}: {filename}")
-            success, message, df = self.process_uploaded_file(file_path, filename)
-            
+            logger.info(f"处理文件 {index+1}/{total_files}: {filename}")
+        
+        parsed = self.parse_files_parallel(file_paths, filenames, on_file_done=on_file_done)
+        
+        for filename, (success, message, df) in zip(filenames, parsed):
             if success and df is not None:
                 # 从数据中提取日期范围
                 date_range = self.extract_date_range_from_data(df)
@@ -1141,6 +1529,8 @@ class DataProcessor:
                     'data': df,
                     'date_range': date_range
                 })
+                self.herd_table.add_file(filename, df)
+                self.file_signature(filename, df)
                 
                 if date_range:
                     results['date_ranges'].append(date_range)
@@ -1184,9 +1574,9 @@ class DataProcessor:
             'all_data': []
         }
         
-        for file_path, filename in zip(file_paths, filenames):
-            success, message, df = self.process_uploaded_file(file_path, filename)
-            
+        parsed = self.parse_files_parallel(file_paths, filenames)
+        
+        for filename, (success, message, df) in zip(filenames, parsed):
             if success and df is not None:
                 # 从数据中提取日期范围
                 date_range = self.extract_date_range_from_data(df)
@@ -1203,6 +1593,8 @@ class DataProcessor:
                     'data': df,
                     'date_range': date_range
                 })
+                self.herd_table.add_file(filename, df)
+                self.file_signature(filename, df)
                 
                 if date_range:
                     results['date_ranges'].append(date_range)
@@ -1283,19 +1675,9 @@ class DataProcessor:
         if not selected_data:
             return pd.DataFrame()
         
-        # 合并所有数据
-        all_dfs = []
-        for item in selected_data:
-            df = item['data'].copy()
-            df['source_file'] = item['filename']
-            
-            # 添加年月列
-            if 'sample_date' in df.columns:
-                df['year_month'] = pd.to_datetime(df['sample_date']).dt.strftime('%Y-%m')
-            
-            all_dfs.append(df)
-        
-        combined_df = pd.concat(all_dfs, ignore_index=True)
+        # 从牛群长表获取合并数据（已含来源文件、年月列与牛只键；apply_filters会复制）
+        herd_table = self.get_herd_table(data_list)
+        combined_df = herd_table.frame(selected_files, copy=False)
         
         # 应用基础筛选条件
         filtered_df = self.apply_filters(combined_df, filters)
@@ -1305,56 +1687,33 @@ class DataProcessor:
         
         # 应用跨月逻辑：找出在所有月份都符合条件的牛
         if 'management_id' not in filtered_df.columns:
-            return filtered_df
+            return self._drop_internal_columns(filtered_df)
         
-        # 动态确定分组键
+        # 获取选中文件对应的月份（牛群长表已预先计算）
+        selected_months = set()
+        for item in selected_data:
+            if item.get('date_range'):
+                selected_months.update(herd_table.file_months(item['filename']))
+        
+        # 有牛只键的行才参与分组（管理号或牛场编号缺失的行不属于任何一头牛）
+        has_cow = filtered_df['cow_key'] >= 0
         if 'farm_id' in filtered_df.columns:
-            group_keys = ['farm_id', 'management_id']
-        else:
-            group_keys = ['management_id']
+            has_cow &= filtered_df['farm_id'].notna()
         
-        # 按分组键分组
-        cow_groups = filtered_df.groupby(group_keys)
+        # 统计每头牛覆盖的选定月份数，覆盖全部选定月份的牛通过
+        if selected_months:
+            in_selected = has_cow & filtered_df['year_month'].isin(selected_months)
+            coverage = filtered_df.loc[in_selected].groupby('cow_key')['year_month'].nunique()
+            valid_cow_keys = coverage.index[coverage == len(selected_months)]
+        else:
+            valid_cow_keys = filtered_df.loc[has_cow, 'cow_key'].unique()
         
-        # 获取选中文件对应的月份
-        selected_months = set()
-        for item in selected_data:
-            date_range = item.get('date_range')
-            if date_range:
-                # 简化处理：从文件名或日期范围推断月份
-                sample_data = item['data']
-                if 'sample_date' in sample_data.columns:
-                    months = pd.to_datetime(sample_data['sample_date']).dt.strftime('%Y-%m').unique()
-                    selected_months.update(months)
-        
-        # 筛选在所有选定月份都有数据的牛
-        valid_cows = []
-        for group_key, group in cow_groups:
-            cow_months = set(group['year_month'].unique())
-            
-            # 检查是否在所有选定月份都符合条件
-            if selected_months.issubset(cow_months):
-                # 保持与其他函数一致的处理方式
-                if 'farm_id' in df.columns:
-                    farm_id, mgmt_id = group_key
-                    valid_cows.append((farm_id, mgmt_id))
-                else:
-                    mgmt_id = group_key if not isinstance(group_key, tuple) else group_key[0]
-                    valid_cows.append(mgmt_id)
+        logger.info(f"跨月筛选：{len(valid_cow_keys)}头牛在全部{len(selected_months)}个选定月份都符合条件")
         
         # 返回符合条件的牛的所有数据
-        if valid_cows:
-            if 'farm_id' in filtered_df.columns:
-                cow_filter = filtered_df.apply(
-                    lambda row: (row['farm_id'], row['management_id']) in valid_cows, 
-                    axis=1
-                )
-            else:
-                cow_filter = filtered_df.apply(
-                    lambda row: row['management_id'] in valid_cows, 
-                    axis=1
-                )
-            return filtered_df[cow_filter]
+        if len(valid_cow_keys) > 0:
+            result_df = filtered_df[has_cow & filtered_df['cow_key'].isin(valid_cow_keys)]
+            return self._drop_internal_columns(result_df)
         
         return pd.DataFrame()
     
@@ -1377,41 +1736,14 @@ class DataProcessor:
                 "progress_percentage": 40
             })
         except Exception as e:
-            logger.warning(f"更新进度失败: {e}")
-        
-        # 合并所有数据
-        all_dfs = []
-        all_months = set()
-        
-        for item in selected_data:
-            df = item['data'].copy()
-            df['source_file'] = item['filename']
-            
-            # 确保关键字段为字符串类型，保持数据一致性
-            for field in ['farm_id', 'management_id']:
-                if field in df.columns:
-                    df[field] = df[field].astype(str)
-                    # 移除'nan'字符串，转换为None
-                    df.loc[df[field] == 'nan', field] = None
-            
-            # 添加年月列
-            if 'sample_date' in df.columns:
-                df['year_month'] = pd.to_datetime(df['sample_date']).dt.strftime('%Y-%m')
-                # 收集所有月份
-                months = df['year_month'].dropna().unique()
-                all_months.update(months)
-            
-            all_dfs.append(df)
-        
-        combined_df = pd.concat(all_dfs, ignore_index=True)
+            logger.warning(f"更新进度失败: {e}")
         
-        # 合并后再次确保字符串字段类型一致性
-        for field in ['farm_id', 'management_id']:
-            if field in combined_df.columns:
-                combined_df[field] = combined_df[field].astype(str)
-                combined_df.loc[combined_df[field] == 'nan', field] = None
+        # 从牛群长表获取合并数据（ID已标准化，已含来源文件、年月列与牛只键；apply_filters会复制）
+        herd_table = self.get_herd_table(data_list)
+        combined_df = herd_table.frame(selected_files, copy=False)
+        all_months = herd_table.months(selected_files)
         
-        logger.info(f"合并数据：共{len(combined_df)}行，覆盖月份：{sorted(all_months)}")
+        logger.info(f"合并数据：共{len(combined_df)}行，覆盖月份：{all_months}")
         
         # 使用传入的空值处理参数
         include_null_as_match = treat_empty_as_match
@@ -1439,148 +1771,119 @@ class DataProcessor:
         
         # 检查必要字段
         if 'management_id' not in base_filtered_df.columns:
-            return base_filtered_df
-        
-        # 获取所有牛只
-        if 'farm_id' in base_filtered_df.columns:
-            all_cows = base_filtered_df[['farm_id', 'management_id']].drop_duplicates()
-        else:
-            all_cows = base_filtered_df[['management_id']].drop_duplicates()
-        logger.info(f"筛选范围内共有{len(all_cows)}头牛")
-        
-        # 对每头牛检查每个月份的符合情况
-        valid_cows = []
+            return self._drop_internal_columns(base_filtered_df)
         
         # 更新进度
         try:
             from main import processing_progress
             processing_progress.update({
-                "current_step": "逐头牛分析符合情况",
+                "current_step": "按牛只×月份分组分析符合情况",
                 "progress_percentage": 60
             })
         except Exception as e:
             logger.warning(f"更新进度失败: {e}")
         
-        for _, cow_row in all_cows.iterrows():
-            if 'farm_id' in cow_row.index:
-                farm_id = cow_row['farm_id']
-                mgmt_id = cow_row['management_id']
-                
-                # 获取这头牛的所有数据
-                cow_data = base_filtered_df[
-                    (base_filtered_df['farm_id'] == farm_id) & 
-                    (base_filtered_df['management_id'] == mgmt_id)
-                ]
-            else:
-                farm_id = None
-                mgmt_id = cow_row['management_id']
-                
-                # 获取这头牛的所有数据
-                cow_data = base_filtered_df[
-                    base_filtered_df['management_id'] == mgmt_id
-                ]
-            
-            # 检查每个月份的符合情况
-            matched_months = 0
-            
-            for month in all_months:
-                # 检查这头牛在这个月份的数据
-                month_data = cow_data[cow_data['year_month'] == month]
-                
-                if len(month_data) == 0:
-                    # 这个月份没有数据
-                    if include_null_as_match:
-                        matched_months += 1
-                        logger.debug(f"牛场{farm_id}-管理号{mgmt_id} {month}月：无数据，空值判定为符合")
-                    else:
-                        logger.debug(f"牛场{farm_id}-管理号{mgmt_id} {month}月：无数据，不符合")
-                else:
-                    # 这个月份有数据，检查所有启用的月份逻辑筛选项
-                    month_satisfies_all = True
-                    filter_details = []
-                    
-                    if not monthly_filters:
-                        # 没有月份逻辑筛选项，有数据就算符合
-                        matched_months += 1
-                        logger.debug(f"牛场{farm_id}-管理号{mgmt_id} {month}月：无月份筛选项，有数据符合")
-                    else:
-                        # 检查每个月份逻辑筛选项
-                        for filter_name, filter_config in monthly_filters.items():
-                            field = filter_config.get('field')
-                            
-                            if not field or field not in month_data.columns:
-                                filter_details.append(f"{filter_name}:字段不存在")
-                                continue
-                            
-                            # 获取该字段的值
-                            field_values = month_data[field].dropna()
-                            
-                            if len(field_values) == 0:
-                                # 该字段为空
-                                if include_null_as_match:
-                                    filter_details.append(f"{filter_name}:空值符合")
-                                else:
-                                    month_satisfies_all = False
-                                    filter_details.append(f"{filter_name}:空值不符合")
-                                    break
-                            else:
-                                # 该字段有值，检查是否符合条件
-                                # 创建临时筛选配置，包含空值处理参数
-                                temp_filter_config = filter_config.copy()
-                                temp_filter_config['include_null_as_match'] = include_null_as_match
-                                
-                                month_filtered = self.apply_numeric_filter(month_data, field, temp_filter_config)
-                                if len(month_filtered) > 0:
-                                    filter_details.append(f"{filter_name}:数值符合")
-                                else:
-                                    month_satisfies_all = False
-                                    filter_details.append(f"{filter_name}:数值不符合")
-                                    break
-                        
-                        # 所有筛选项都符合才算这个月符合
-                        if month_satisfies_all:
-                            matched_months += 1
-                            logger.debug(f"牛场{farm_id}-管理号{mgmt_id} {month}月：所有条件符合 ({', '.join(filter_details)})")
-                        else:
-                            logger.debug(f"牛场{farm_id}-管理号{mgmt_id} {month}月：条件不符合 ({', '.join(filter_details)})")
-            
-            if matched_months >= min_match_months:
-                if farm_id is not None:
-                    valid_cows.append((farm_id, mgmt_id))
-                    logger.debug(f"牛场{farm_id}-管理号{mgmt_id}: {matched_months}个月符合条件，保留")
-                else:
-                    valid_cows.append(mgmt_id)
-                    logger.debug(f"管理号{mgmt_id}: {matched_months}个月符合条件，保留")
-            else:
-                if farm_id is not None:
-                    logger.debug(f"牛场{farm_id}-管理号{mgmt_id}: {matched_months}个月符合条件，不足{min_match_months}个月，淘汰")
-                else:
-                    logger.debug(f"管理号{mgmt_id}: {matched_months}个月符合条件，不足{min_match_months}个月，淘汰")
-        
-        logger.info(f"符合{min_match_months}个月条件的牛：{len(valid_cows)}头")
+        # 按牛只×月份分组计算每头牛的符合月数
+        cow_match_months = self._count_partial_month_matches(
+            base_filtered_df, monthly_filters, all_months, include_null_as_match
+        )
+        passing_keys = cow_match_months.index[cow_match_months >= min_match_months]
+        logger.info(f"筛选范围内共有{len(cow_match_months)}头牛，符合{min_match_months}个月条件的牛：{len(passing_keys)}头")
         
         # 返回符合条件的牛的所有数据 - 从base_filtered_df中返回，保持基础筛选条件
-        if valid_cows:
-            if 'farm_id' in base_filtered_df.columns:
-                all_cow_data = base_filtered_df[
-                    base_filtered_df.apply(
-                        lambda row: (row['farm_id'], row['management_id']) in valid_cows, 
-                        axis=1
-                    )
-                ]
-            else:
-                all_cow_data = base_filtered_df[
-                    base_filtered_df.apply(
-                        lambda row: row['management_id'] in valid_cows, 
-                        axis=1
-                    )
-                ]
-            return all_cow_data
+        # （缺少管理号或牛场编号的行不属于任何一头牛，不参与统计也不返回）
+        keep_mask = base_filtered_df['cow_key'].isin(passing_keys) & self._partial_month_keyed_rows(base_filtered_df)
+        
+        if keep_mask.any():
+            return self._drop_internal_columns(base_filtered_df[keep_mask])
         
         return pd.DataFrame()
     
-    def create_monthly_report(self, df: pd.DataFrame, display_fields: List[str], plan_date: str = None) -> pd.DataFrame:
-        """创建按月展开的报告"""
+    @staticmethod
+    def _partial_month_keyed_rows(df: pd.DataFrame) -> pd.Series:
+        """有完整牛只标识（管理号，以及存在时的牛场编号）的行"""
+        keyed = df['cow_key'] >= 0
+        if 'farm_id' in df.columns:
+            keyed &= df['farm_id'].notna()
+        return keyed
+    
+    def _count_partial_month_matches(self, df: pd.DataFrame, monthly_filters: Dict[str, Any],
+                                     all_months: List[str], include_null_as_match: bool) -> pd.Series:
+        """按牛只×月份分组评估，返回每头牛（cow_key）的符合月数
+        
+        某月有数据时，所有月份筛选项都符合才算该月符合：筛选项字段全为空时按空值处理，
+        否则该月至少一条记录落在范围内即符合（empty_handling为“视为符合”时空值记录也算）；
+        某月没有数据时按空值处理。
+        """
+        keyed = df[self._partial_month_keyed_rows(df)]
+        all_cow_keys = pd.Index(keyed['cow_key'].unique())
+        rows = keyed[keyed['year_month'].isin(all_months)]
+        cell_keys = [rows['cow_key'], rows['year_month']]
+        
+        # 每个有数据的牛只×月份单元格是否符合所有筛选项
+        cell_ok = rows.groupby(cell_keys, sort=False).size().astype(bool)
+        for filter_name, filter_config in monthly_filters.items():
+            field = filter_config.get('field')
+            if not field or field not in rows.columns:
+                continue
+            
+            values = rows[field]
+            min_val = filter_config.get('min')
+            max_val = filter_config.get('max')
+            treat_null_as_pass = filter_config.get('empty_handling', '视为不符合') == '视为符合'
+            
+            # 与apply_numeric_filter相同的比较（历史数据填充只会用同月已有的值补空，不改变结果）
+            row_pass = pd.Series(True, index=rows.index)
+            if min_val is not None:
+                row_pass &= values >= min_val
+            if max_val is not None:
+                row_pass &= values <= max_val
+            if treat_null_as_pass and (min_val is not None or max_val is not None):
+                row_pass |= values.isna()
+            
+            has_value = values.notna().groupby(cell_keys, sort=False).any()
+            any_pass = row_pass.groupby(cell_keys, sort=False).any()
+            filter_ok = any_pass.where(has_value, include_null_as_match)
+            cell_ok &= filter_ok.reindex(cell_ok.index).astype(bool)
+        
+        # 没有数据的月份按空值处理
+        cow_cells = cell_ok.groupby(level=0)
+        matched = cow_cells.sum().reindex(all_cow_keys, fill_value=0)
+        if include_null_as_match:
+            present = cow_cells.size().reindex(all_cow_keys, fill_value=0)
+            matched = matched + (len(all_months) - present)
+        return matched
+    
+    def create_monthly_report(self, df: pd.DataFrame, display_fields: List[str],
+                              plan_date: Union[str, List[str], None] = None,
+                              filter_key: Optional[str] = None) -> pd.DataFrame:
+        """创建按月展开的报告
+        
+        Args:
+            plan_date: 计划调群日期；为列表时第一个日期写入“未来泌乳天数(天)”，
+                其余日期各增加一列“未来泌乳天数(天)[YYYY-MM-DD]”，便于对比多个调群方案
+            filter_key: df对应的筛选缓存键（filter_cache_key），提供时按筛选键、显示字段和计划调群日期缓存报告
+        """
+        if filter_key is None:
+            return self._build_monthly_report(df, display_fields, plan_date)
+        
+        cache_key = make_cache_key('monthly_report', filter_key, display_fields, plan_date, self.active_cattle_enabled)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None and self.report_aggregates(cached) is not None:
+            logger.info(f"使用缓存的月度报告：{len(cached)}行")
+            return cached
+        
+        # 未缓存，或报告的汇总聚合已被淘汰（无法再扣减被剔除的行）时重新生成
+        report = self._build_monthly_report(df, display_fields, plan_date)
+        self.result_cache.put(cache_key, report)
+        return report
+    
+    def _build_monthly_report(self, df: pd.DataFrame, display_fields: List[str],
+                              plan_date: Union[str, List[str], None] = None) -> pd.DataFrame:
+        """按月展开生成报告：每头牛一行，按(牛, 月份)透视出月度明细列
+        
+        每头牛每月取该月最后一条记录；加权平均值按产奶量加权，逐月累加的顺序与逐条计算一致。
+        """
         if df.empty:
             return pd.DataFrame()
         
@@ -1592,430 +1895,187 @@ class DataProcessor:
                 # 移除'nan'字符串，转换为None
                 df.loc[df[field] == 'nan', field] = None
         
+        # 紧凑类型还原为报表使用的精度
+        df = widen_compact_dtypes(df)
+        
         # 使用传入的display_fields参数，支持动态字段配置
         logger.info(f"生成月度报告，使用字段: {display_fields}")
         
-        # 动态确定基础列和分组键
+        # 动态确定分组键
         if 'farm_id' in df.columns:
-            base_columns = ['farm_id', 'management_id', 'parity']
             group_keys = ['farm_id', 'management_id']
         else:
-            base_columns = ['management_id', 'parity']
             group_keys = ['management_id']
         
-        # 按牛分组
+        # 按牛分组：牛只编号与分组键排序一致
         cow_groups = df.groupby(group_keys)
-        
-        result_rows = []
-        all_protein_milk_pairs = []  # 收集所有(蛋白率, 产奶量)对用于计算加权总平均值
-        all_fat_milk_pairs = []  # 收集所有(乳脂率, 产奶量)对用于计算加权总平均值  
-        all_lactose_milk_pairs = []  # 收集所有(乳糖率, 产奶量)对用于计算加权总平均值
-        all_total_milk = 0  # 总产奶量
-        
-        # 收集所有月份信息
-        all_months_data = {}
-        for group_key, group in cow_groups:
-            for _, record in group.iterrows():
-                if pd.notna(record['sample_date']):
-                    sample_date = pd.to_datetime(record['sample_date'])
-                    year_month = sample_date.strftime('%Y年%m月')
-                    if year_month not in all_months_data:
-                        all_months_data[year_month] = sample_date
-        
-        # 按时间顺序排序所有月份
-        sorted_all_months = sorted(all_months_data.items(), key=lambda x: x[1])
-        sorted_month_names = [month for month, _ in sorted_all_months]
-        
-        for group_key, group in cow_groups:
-            # 解析分组键
-            if 'farm_id' in df.columns:
-                farm_id, mgmt_id = group_key
+        cow_index = cow_groups.size().index
+        cow_count = len(cow_index)
+        cow_codes = cow_groups.ngroup()
+        
+        # 已有的未来泌乳天数（每头牛第一个非空值）优先于按计划调群日计算的结果
+        existing_future_days = pd.Series([None] * cow_count, dtype=object)
+        if 'future_lactation_days' in df.columns and cow_count:
+            existing_future_days = pd.Series(cow_groups['future_lactation_days'].first().to_numpy(), dtype=object)
+        
+        # 有采样日期的记录，及每头牛每月最后一条记录
+        sample_dates = pd.to_datetime(df['sample_date'], errors='coerce')
+        valid = (cow_codes.notna() & sample_dates.notna()).to_numpy()
+        rows = df[valid]
+        row_cows = cow_codes[valid].to_numpy().astype(np.int64)
+        row_dates = sample_dates[valid]
+        row_periods = row_dates.dt.to_period('M')
+        month_periods = sorted(row_periods.unique())
+        month_names = [period.strftime('%Y年%m月') for period in month_periods]
+        month_count = len(month_periods)
+        row_months = pd.Categorical(row_periods, categories=month_periods).codes.astype(np.int64)
+        
+        last_in_month = ~pd.Series(row_cows * month_count + row_months).duplicated(keep='last').to_numpy()
+        kept = rows[last_in_month]
+        kept_cows = row_cows[last_in_month]
+        kept_months = row_months[last_in_month]
+        kept_dates = row_dates[last_in_month]
+        
+        def to_grid(values: np.ndarray, fill=None, dtype=object) -> np.ndarray:
+            grid = np.full((cow_count, month_count), fill, dtype=dtype)
+            grid[kept_cows, kept_months] = values
+            return grid
+        
+        def object_values(series: pd.Series) -> np.ndarray:
+            values = series.astype(object).to_numpy()
+            values[series.isna().to_numpy()] = None
+            return values
+        
+        # 月度明细：display_fields中有中文列名的字段
+        report_fields = [field for field in dict.fromkeys(display_fields)
+                         if field not in ['farm_id', 'management_id', 'parity'] and field in REPORT_FIELD_NAMES]
+        def numeric_grid(field: str) -> np.ndarray:
+            if field not in kept.columns:
+                return np.full((cow_count, month_count), np.nan)
+            values = pd.to_numeric(kept[field].astype(object), errors='coerce').astype(float).to_numpy()
+            return to_grid(values, fill=np.nan, dtype=float)
+        
+        grids = {}
+        numeric_grids = {}
+        lactation_numeric = None
+        for field in report_fields:
+            if field not in kept.columns:
+                grids[field] = to_grid(np.full(len(kept), None, dtype=object))
+                numeric_grids[field] = numeric_grid(field)
+            elif field == 'lactation_days':
+                # 泌乳天数转为整数，无法转换的视为空值
+                lactation_numeric = pd.to_numeric(kept[field].astype(object), errors='coerce').astype(float).to_numpy()
+                has_value = ~np.isnan(lactation_numeric)
+                values = np.full(len(kept), None, dtype=object)
+                values[has_value] = np.trunc(lactation_numeric[has_value]).astype(np.int64).astype(object)
+                grids[field] = to_grid(values)
+                numeric_grids[field] = to_grid(np.trunc(lactation_numeric), fill=np.nan, dtype=float)
             else:
-                farm_id = None
-                # 确保mgmt_id是标量值，不是元组
-                mgmt_id = group_key if not isinstance(group_key, tuple) else group_key[0]
-            # 获取胎次（取最后一次采样时的胎次）
-            parity = None
-            latest_sample_date = None
-            for _, record in group.iterrows():
-                if pd.notna(record['sample_date']):
-                    sample_date = pd.to_datetime(record['sample_date'])
-                    if latest_sample_date is None or sample_date > latest_sample_date:
-                        latest_sample_date = sample_date
-                        if pd.notna(record['parity']):
-                            parity = record['parity']
-            
-            # 基础信息 - 按固定顺序
-            row_data = {}
-            
-            # 按月份整理数据，按日期排序
-            monthly_data = {}
-            for _, record in group.iterrows():
-                if pd.notna(record['sample_date']):
-                    sample_date = pd.to_datetime(record['sample_date'])
-                    year_month = sample_date.strftime('%Y年%m月')
-                    monthly_data[year_month] = {
-                        'record': record,
-                        'date': sample_date
-                    }
-            
-            # 计算这头牛的加权平均值（蛋白率、乳脂率、乳糖率）
-            cow_protein_values = []  # 存储(蛋白率, 产奶量)对
-            cow_fat_values = []  # 存储(乳脂率, 产奶量)对
-            cow_lactose_values = []  # 存储(乳糖率, 产奶量)对
-            cow_total_milk = 0  # 总产奶量
-            last_lactation_days = None
-            
-            # 按固定顺序组织列
-            # 1. 基础列
-            if farm_id is not None:
-                row_data['farm_id'] = farm_id
-            row_data['management_id'] = mgmt_id
-            row_data['parity'] = parity
-            
-            # 2. 按月份顺序添加启用的筛选项的月度明细
-            # 定义字段的中文名称映射
-            field_chinese_map = {
-                'protein_pct': '蛋白率(%)',
-                'fat_pct': '乳脂率(%)',
-                'fat_protein_ratio': '脂蛋比',
-                'somatic_cell_count': '体细胞数(万/ml)',
-                'somatic_cell_score': '体细胞分',
-                'urea_nitrogen': '尿素氮(mg/dl)',
-                'lactose_pct': '乳糖率',
-                'milk_loss': '奶损失(Kg)',
-                'milk_payment_diff': '奶款差',
-                'economic_loss': '经济损失',
-                'corrected_milk': '校正奶(Kg)',
-                'persistency': '持续力',
-                'whi': 'WHI',
-                'fore_milk_yield': '前奶量(Kg)',
-                'fore_somatic_cell_count': '前体细胞(万/ml)',
-                'fore_somatic_cell_score': '前体细胞分',
-                'fore_milk_loss': '前奶损失(Kg)',
-                'peak_milk_yield': '高峰奶(Kg)',
-                'peak_days': '高峰日(天)',
-                'milk_305': '305奶量(Kg)',
-                'total_milk_yield': '总奶量(Kg)',
-                'total_fat_pct': '总乳脂(%)',
-                'total_protein_pct': '总蛋白(%)',
-                'mature_equivalent': '成年当量(Kg)',
-                'milk_yield': '产奶量(Kg)',
-                'lactation_days': '泌乳天数(天)'
-            }
-            
-            for year_month in sorted_month_names:
-                if year_month in monthly_data:
-                    record = monthly_data[year_month]['record']
-                    
-                    # 为每个启用的字段添加月度明细列
-                    for field in display_fields:
-                        if field in ['farm_id', 'management_id', 'parity']:
-                            continue  # 跳过基础字段
-                        
-                        if field in field_chinese_map:
-                            chinese_name = field_chinese_map[field]
-                            column_name = f"{year_month}{chinese_name}"
-                            
-                            # 获取字段值
-                            field_value = None
-                            if field in record and pd.notna(record[field]):
-                                field_value = record[field]
-                                
-                                # 特殊处理：泌乳天数转为整数
-                                if field == 'lactation_days':
-                                    try:
-                                        field_value = int(float(field_value))
-                                        if field_value is not None:
-                                            last_lactation_days = field_value  # 更新为最新的
-                                    except (ValueError, TypeError):
-                                        field_value = None
-                                
-                                row_data[column_name] = field_value
-                            else:
-                                row_data[column_name] = None
-                            
-                            # 收集蛋白率、乳脂率、乳糖率和产奶量用于加权平均计算
-                            if field in ['protein_pct', 'fat_pct', 'lactose_pct'] and field_value is not None:
-                                # 需要对应的产奶量
-                                milk_value = None
-                                if 'milk_yield' in record and pd.notna(record['milk_yield']):
-                                    milk_value = record['milk_yield']
-                                    
-                                if milk_value is not None:
-                                    # 收集各个指标的加权平均数据
-                                    if field == 'protein_pct':
-                                        cow_protein_values.append((float(field_value), float(milk_value)))
-                                        all_protein_milk_pairs.append((float(field_value), float(milk_value)))
-                                    elif field == 'fat_pct':
-                                        cow_fat_values.append((float(field_value), float(milk_value)))
-                                        all_fat_milk_pairs.append((float(field_value), float(milk_value)))
-                                    elif field == 'lactose_pct':
-                                        cow_lactose_values.append((float(field_value), float(milk_value)))
-                                        all_lactose_milk_pairs.append((float(field_value), float(milk_value)))
-                                    
-                                    cow_total_milk += float(milk_value)
-                                    all_total_milk += float(milk_value)
-                else:
-                    # 该月份没有数据，为所有启用的字段添加空值
-                    for field in display_fields:
-                        if field in ['farm_id', 'management_id', 'parity']:
-                            continue  # 跳过基础字段
-                        
-                        if field in field_chinese_map:
-                            chinese_name = field_chinese_map[field]
-                            column_name = f"{year_month}{chinese_name}"
-                            row_data[column_name] = None
-            
-            # 3. 添加加权平均值（蛋白率、乳脂率、乳糖率）
-            # 加权平均蛋白率
-            if 'protein_pct' in display_fields:
-                if cow_protein_values and cow_total_milk > 0:
-                    weighted_protein_sum = sum(protein * milk for protein, milk in cow_protein_values)
-                    cow_avg = weighted_protein_sum / cow_total_milk
-                    row_data['平均蛋白率(%)'] = round(cow_avg, 2)
-                else:
-                    row_data['平均蛋白率(%)'] = None
-            
-            # 加权平均乳脂率
-            if 'fat_pct' in display_fields:
-                if cow_fat_values and cow_total_milk > 0:
-                    weighted_fat_sum = sum(fat * milk for fat, milk in cow_fat_values)
-                    cow_avg = weighted_fat_sum / cow_total_milk
-                    row_data['平均乳脂率(%)'] = round(cow_avg, 2)
-                else:
-                    row_data['平均乳脂率(%)'] = None
-            
-            # 加权平均乳糖率
-            if 'lactose_pct' in display_fields:
-                if cow_lactose_values and cow_total_milk > 0:
-                    weighted_lactose_sum = sum(lactose * milk for lactose, milk in cow_lactose_values)
-                    cow_avg = weighted_lactose_sum / cow_total_milk
-                    row_data['平均乳糖率(%)'] = round(cow_avg, 2)
-                else:
-                    row_data['平均乳糖率(%)'] = None
-            
-            # 4. 添加最后一个月的泌乳天数
-            if last_lactation_days is not None:
-                try:
-                    last_lactation_days = int(float(last_lactation_days))
-                except (ValueError, TypeError):
-                    last_lactation_days = None
-            row_data['最后一个月泌乳天数(天)'] = last_lactation_days
-            
-            # 5. 添加最后一次采样日
-            last_sample_date = None
-            if monthly_data:
-                # 找到最后一次采样的日期
-                sorted_monthly = sorted(monthly_data.items(), key=lambda x: x[1]['date'])
-                if sorted_monthly:
-                    last_sample_date = sorted_monthly[-1][1]['date'].strftime('%Y-%m-%d')
-            row_data['最后一次采样日'] = last_sample_date
-            
-            # 6. 添加未来泌乳天数
-            future_lactation_days = None
-            
-            # 首先尝试从已有记录中获取
-            for _, record in group.iterrows():
-                if 'future_lactation_days' in record and pd.notna(record['future_lactation_days']):
-                    future_lactation_days = int(record['future_lactation_days'])
-                    break
-            
-            # 如果没有现成的未来泌乳天数，且有计划调群日，则计算
-            if future_lactation_days is None and plan_date and last_sample_date and last_lactation_days is not None:
-                try:
-                    plan_datetime = pd.to_datetime(plan_date)
-                    last_sample_datetime = pd.to_datetime(last_sample_date)
-                    days_diff = (plan_datetime - last_sample_datetime).days
-                    calculated_days = int(days_diff + last_lactation_days)
-                    if calculated_days > 0:
-                        future_lactation_days = calculated_days
-                        logger.debug(f"计算未来泌乳天数: 牛场{farm_id}-管理号{mgmt_id}, 计划日{plan_date}, 最后采样{last_sample_date}, 差{days_diff}天, 最后泌乳{last_lactation_days}天, 未来{future_lactation_days}天")
-                except Exception as e:
-                    logger.warning(f"计算未来泌乳天数失败: {e}")
-            
-            row_data['未来泌乳天数(天)'] = future_lactation_days
-            
-            result_rows.append(row_data)
-        
-        result_df = pd.DataFrame(result_rows)
-        
-        # 重新排序列以确保正确的顺序
-        if not result_df.empty:
-            # 构建正确的列顺序
-            ordered_columns = ['farm_id', 'management_id', 'parity']
-            
-            # 定义字段的中文名称映射（与上面保持一致）
-            field_chinese_map = {
-                'protein_pct': '蛋白率(%)',
-                'fat_pct': '乳脂率(%)',
-                'fat_protein_ratio': '脂蛋比',
-                'somatic_cell_count': '体细胞数(万/ml)',
-                'somatic_cell_score': '体细胞分',
-                'urea_nitrogen': '尿素氮(mg/dl)',
-                'lactose_pct': '乳糖率',
-                'milk_loss': '奶损失(Kg)',
-                'milk_payment_diff': '奶款差',
-                'economic_loss': '经济损失',
-                'corrected_milk': '校正奶(Kg)',
-                'persistency': '持续力',
-                'whi': 'WHI',
-                'fore_milk_yield': '前奶量(Kg)',
-                'fore_somatic_cell_count': '前体细胞(万/ml)',
-                'fore_somatic_cell_score': '前体细胞分',
-                'fore_milk_loss': '前奶损失(Kg)',
-                'peak_milk_yield': '高峰奶(Kg)',
-                'peak_days': '高峰日(天)',
-                'milk_305': '305奶量(Kg)',
-                'total_milk_yield': '总奶量(Kg)',
-                'total_fat_pct': '总乳脂(%)',
-                'total_protein_pct': '总蛋白(%)',
-                'mature_equivalent': '成年当量(Kg)',
-                'milk_yield': '产奶量(Kg)',
-                'lactation_days': '泌乳天数(天)'
-            }
-            
-            # 添加月度列（按时间顺序，按display_fields中的字段顺序）
-            for year_month in sorted_month_names:
-                for field in display_fields:
-                    if field in ['farm_id', 'management_id', 'parity']:
-                        continue  # 跳过基础字段
-                    
-                    if field in field_chinese_map:
-                        chinese_name = field_chinese_map[field]
-                        column_name = f"{year_month}{chinese_name}"
-                        ordered_columns.append(column_name)
-            
-            # 添加最后的汇总列（动态添加）
-            summary_columns = []
-            if 'protein_pct' in display_fields:
-                summary_columns.append('平均蛋白率(%)')
-            if 'fat_pct' in display_fields:
-                summary_columns.append('平均乳脂率(%)')
-            if 'lactose_pct' in display_fields:
-                summary_columns.append('平均乳糖率(%)')
-            if 'lactation_days' in display_fields:
-                summary_columns.append('最后一个月泌乳天数(天)')
-            summary_columns.append('最后一次采样日')
-            summary_columns.append('未来泌乳天数(天)')
-            
-            # 只添加实际存在的汇总列
-            for col in summary_columns:
-                if col in result_df.columns:
-                    ordered_columns.append(col)
-            
-            # 重新排序DataFrame的列
-            available_columns = [col for col in ordered_columns if col in result_df.columns]
-            result_df = result_df[available_columns]
-        
-        # 计算所有月份的加权总平均值，存储为DataFrame属性
-        # 蛋白率总平均值
-        if all_protein_milk_pairs and all_total_milk > 0:
-            weighted_overall_sum = sum(protein * milk for protein, milk in all_protein_milk_pairs)
-            overall_avg = weighted_overall_sum / all_total_milk
-            result_df.attrs['overall_protein_avg'] = round(overall_avg, 2)
-        else:
-            result_df.attrs['overall_protein_avg'] = None
-        
-        # 乳脂率总平均值
-        if all_fat_milk_pairs and all_total_milk > 0:
-            weighted_overall_sum = sum(fat * milk for fat, milk in all_fat_milk_pairs)
-            overall_avg = weighted_overall_sum / all_total_milk
-            result_df.attrs['overall_fat_avg'] = round(overall_avg, 2)
+                grids[field] = to_grid(object_values(kept[field]))
+                numeric_grids[field] = numeric_grid(field)
+        milk = numeric_grid('milk_yield')
+        
+        # 胎次：逐条遍历时每出现更晚的采样日期就取该条记录的胎次（为空则保留之前的值）
+        parity_values = np.full(cow_count, None, dtype=object)
+        if 'parity' in rows.columns and len(rows):
+            running_latest = row_dates.groupby(row_cows).cummax()
+            previous_latest = running_latest.groupby(row_cows).shift()
+            newer = (previous_latest.isna() | (row_dates > previous_latest)).to_numpy()
+            candidates = newer & rows['parity'].notna().to_numpy()
+            latest_parity = pd.Series(object_values(rows['parity'])[candidates]).groupby(row_cows[candidates]).last()
+            parity_values[latest_parity.index.to_numpy()] = latest_parity.to_numpy()
+        
+        data = {}
+        if 'farm_id' in df.columns:
+            data['farm_id'] = cow_index.get_level_values(0).tolist()
+            data['management_id'] = cow_index.get_level_values(1).tolist()
         else:
-            result_df.attrs['overall_fat_avg'] = None
-        
-        # 乳糖率总平均值
-        if all_lactose_milk_pairs and all_total_milk > 0:
-            weighted_overall_sum = sum(lactose * milk for lactose, milk in all_lactose_milk_pairs)
-            overall_avg = weighted_overall_sum / all_total_milk
-            result_df.attrs['overall_lactose_avg'] = round(overall_avg, 2)
+            data['management_id'] = cow_index.tolist()
+        data['parity'] = parity_values.tolist()
+        for j, year_month in enumerate(month_names):
+            for field in report_fields:
+                data[f"{year_month}{REPORT_FIELD_NAMES[field]}"] = grids[field][:, j].tolist()
+        
+        # 产奶量加权平均：与逐条累加相同的顺序（牛→月份→字段），每头牛的总产奶量按每个有效(值, 产奶量)对累加；
+        # 转为Python float后再保留小数，与逐条累加的舍入一致（numpy标量的round在边界值上结果不同）
+        weighted_fields = [field for field in report_fields if field in WEIGHTED_REPORT_FIELDS]
+        if weighted_fields and month_count:
+            milk_terms = np.zeros((cow_count, month_count, len(weighted_fields)))
+            products = {}
+            for k, field in enumerate(weighted_fields):
+                values = numeric_grids[field]
+                paired = ~np.isnan(values) & ~np.isnan(milk)
+                milk_terms[:, :, k] = np.where(paired, milk, 0.0)
+                products[field] = (np.where(paired, values * milk, 0.0), paired)
+            
+            cow_total_milk = np.cumsum(milk_terms.reshape(cow_count, -1), axis=1)[:, -1]
+            for field in weighted_fields:
+                product, paired = products[field]
+                cow_sum = np.cumsum(product, axis=1)[:, -1]
+                has_pairs = paired.any(axis=1)
+                data[WEIGHTED_REPORT_FIELDS[field][0]] = [
+                    round(float(total / milk_sum), 2) if has and milk_sum > 0 else None
+                    for total, milk_sum, has in zip(cow_sum, cow_total_milk, has_pairs)
+                ]
         else:
-            result_df.attrs['overall_lactose_avg'] = None
-        
-        # 计算胎次平均值
-        if not result_df.empty and 'parity' in result_df.columns:
-            parity_data = result_df['parity'].dropna()
-            if not parity_data.empty:
-                result_df.attrs['parity_avg'] = round(parity_data.mean(), 1)
+            for field in weighted_fields:
+                data[WEIGHTED_REPORT_FIELDS[field][0]] = [None] * cow_count
+        
+        # 最后一个月泌乳天数（有值的最后一个月）与最后一次采样日
+        last_lactation_days = pd.Series([None] * cow_count, dtype=object)
+        if lactation_numeric is not None and month_count:
+            lactation_grid = grids['lactation_days']
+            has_value = pd.notna(lactation_grid)
+            has_any = has_value.any(axis=1)
+            last_month = month_count - 1 - np.argmax(has_value[:, ::-1], axis=1)
+            last_lactation_days[has_any] = lactation_grid[np.flatnonzero(has_any), last_month[has_any]]
+        data['最后一个月泌乳天数(天)'] = last_lactation_days.tolist()
+        
+        last_sample_dates = pd.Series([None] * cow_count, dtype=object)
+        if len(kept):
+            latest_dates = kept_dates.groupby(kept_cows).max()
+            last_sample_dates[latest_dates.index.to_numpy()] = latest_dates.dt.strftime('%Y-%m-%d').to_numpy()
+        data['最后一次采样日'] = last_sample_dates.tolist()
+        
+        # 未来泌乳天数：所有牛、所有计划调群日期一次计算
+        plan_dates = [date for date in (plan_date if isinstance(plan_date, (list, tuple)) else [plan_date]) if date]
+        future_days = self._future_lactation_days(
+            last_sample_dates, last_lactation_days.where(last_lactation_days.notna(), np.nan),
+            [pd.to_datetime(date) for date in plan_dates]
+        )
+        future_columns = ['未来泌乳天数(天)']
+        data['未来泌乳天数(天)'] = [int(value) if pd.notna(value) else None for value in existing_future_days]
+        for i, date in enumerate(future_days.columns):
+            values = future_days[date]
+            column = '未来泌乳天数(天)'
+            if i == 0:
+                values = existing_future_days.where(existing_future_days.notna(), values)
             else:
-                result_df.attrs['parity_avg'] = None
-        else:
-            result_df.attrs['parity_avg'] = None
+                column = f"未来泌乳天数(天)[{date.strftime('%Y-%m-%d')}]"
+                future_columns.append(column)
+            data[column] = [int(value) if pd.notna(value) else None for value in values]
         
-        # 计算各月份所有启用字段的平均值
-        monthly_averages = {}
+        result_df = pd.DataFrame(data) if cow_count else pd.DataFrame()
+        
+        # 列顺序：基础列、按月份和显示字段排列的月度明细、汇总列
         if not result_df.empty:
-            # 重新定义字段的中文名称映射
-            field_chinese_map = {
-                'protein_pct': '蛋白率(%)',
-                'somatic_cell_count': '体细胞数(万/ml)',
-                'fat_pct': '乳脂率(%)',
-                'lactose_pct': '乳糖率(%)',
-                'milk_yield': '产奶量(Kg)',
-                'lactation_days': '泌乳天数(天)',
-                'solids_pct': '固形物(%)',
-                'fat_protein_ratio': '脂蛋比',
-                'urea_nitrogen': '尿素氮(mg/dl)',
-                'total_fat_pct': '总乳脂(%)',
-                'total_protein_pct': '总蛋白(%)',
-                'mature_equivalent': '成年当量(Kg)'
-            }
-            
-            for year_month in sorted_month_names:
-                for field in display_fields:
-                    if field in ['farm_id', 'management_id', 'parity']:
-                        continue  # 跳过基础字段
-                    
-                    if field in field_chinese_map:
-                        chinese_name = field_chinese_map[field]
-                        column_name = f"{year_month}{chinese_name}"
-                        
-                        if column_name in result_df.columns:
-                            month_data = result_df[column_name].dropna()
-                            
-                            if not month_data.empty:
-                                # 特殊处理：蛋白率使用加权平均（如果有产奶量数据）
-                                if field == 'protein_pct':
-                                    milk_col = f"{year_month}产奶量(Kg)"
-                                    if milk_col in result_df.columns:
-                                        # 使用产奶量加权平均
-                                        try:
-                                            combined_data = result_df[[column_name, milk_col]].dropna()
-                                            if not combined_data.empty:
-                                                weighted_sum = (combined_data[column_name] * combined_data[milk_col]).sum()
-                                                total_milk = combined_data[milk_col].sum()
-                                                if total_milk > 0:
-                                                    monthly_averages[column_name] = round(weighted_sum / total_milk, 2)
-                                                else:
-                                                    monthly_averages[column_name] = None
-                                            else:
-                                                monthly_averages[column_name] = None
-                                        except Exception as e:
-                                            logger.warning(f"计算{column_name}加权平均失败: {e}")
-                                            monthly_averages[column_name] = round(month_data.mean(), 2)
-                                    else:
-                                        # 没有产奶量数据，使用简单平均
-                                        monthly_averages[column_name] = round(month_data.mean(), 2)
-                                
-                                # 其他字段使用简单平均
-                                else:
-                                    if field in ['milk_yield', 'mature_equivalent']:
-                                        # 产奶量等保留1位小数
-                                        monthly_averages[column_name] = round(month_data.mean(), 1)
-                                    elif field in ['lactation_days']:
-                                        # 泌乳天数保留1位小数
-                                        monthly_averages[column_name] = round(month_data.mean(), 1)
-                                    elif field in ['somatic_cell_count', 'urea_nitrogen']:
-                                        # 体细胞数、尿素氮保留1位小数
-                                        monthly_averages[column_name] = round(month_data.mean(), 1)
-                                    else:
-                                        # 其他比例类数据保留2位小数
-                                        monthly_averages[column_name] = round(month_data.mean(), 2)
-                            else:
-                                monthly_averages[column_name] = None
+            ordered_columns = ['farm_id', 'management_id', 'parity']
+            for year_month in month_names:
+                for field in report_fields:
+                    ordered_columns.append(f"{year_month}{REPORT_FIELD_NAMES[field]}")
+            ordered_columns.extend(WEIGHTED_REPORT_FIELDS[field][0] for field in WEIGHTED_REPORT_FIELDS
+                                   if field in display_fields)
+            if 'lactation_days' in display_fields:
+                ordered_columns.append('最后一个月泌乳天数(天)')
+            ordered_columns.append('最后一次采样日')
+            ordered_columns.extend(future_columns)
+            result_df = result_df[[col for col in ordered_columns if col in result_df.columns]]
         
-        result_df.attrs['monthly_averages'] = monthly_averages
+        # 按(牛场, 月份, 性状)物化汇总，总平均值与各月平均值都由汇总表得出
+        farms = cow_index.get_level_values(0).to_numpy() if 'farm_id' in df.columns else np.full(cow_count, '', dtype=object)
+        aggregates = MonthlyAggregates(result_df.index, farms, month_names, numeric_grids, milk)
+        self._set_report_summary(result_df, aggregates)
+        self._store_report_aggregates(result_df, aggregates)
         
         # 如果启用了在群牛筛选，添加在群牛胎次列
         if self.active_cattle_enabled and not result_df.empty:
@@ -2038,49 +2098,146 @@ class DataProcessor:
         
         return result_df
     
+    @staticmethod
+    def _set_report_summary(result_df: pd.DataFrame, aggregates: MonthlyAggregates) -> None:
+        """由月度汇总表写入报告attrs：加权总平均值、平均胎次、各月平均值
+        
+        总平均值 = 加权字段的Σ(值×产奶量) / 所有加权字段有效配对的产奶量合计；蛋白率各月平均值
+        在报告含产奶量时按产奶量加权，其余字段为算术平均。合计均按报告行顺序求得，舍入方式与逐条
+        累加（总平均值，Python float）和逐列求平均（各月平均值，numpy标量）一致。
+        """
+        overall_averages = {attr_key: None for _, attr_key in WEIGHTED_REPORT_FIELDS.values()}
+        weighted_fields = [field for field in aggregates.traits if field in WEIGHTED_REPORT_FIELDS]
+        if weighted_fields and aggregates.months:
+            weighted, all_total_milk = aggregates.record_weighted_totals(weighted_fields)
+            for field in weighted_fields:
+                pairs, weighted_total = weighted[field]
+                if pairs > 0 and all_total_milk > 0:
+                    overall_averages[WEIGHTED_REPORT_FIELDS[field][1]] = round(weighted_total / all_total_milk, 2)
+        result_df.attrs.update(overall_averages)
+        
+        # 计算胎次平均值
+        if not result_df.empty and 'parity' in result_df.columns:
+            parity_data = result_df['parity'].dropna()
+            result_df.attrs['parity_avg'] = round(parity_data.mean(), 1) if not parity_data.empty else None
+        else:
+            result_df.attrs['parity_avg'] = None
+        
+        # 各月份平均值
+        monthly_averages = {}
+        average_fields = [field for field in aggregates.traits if field in MONTHLY_AVERAGE_DIGITS]
+        month_totals = {field: aggregates.record_month_totals(field) for field in average_fields}
+        weight_protein = 'milk_yield' in aggregates.traits
+        for year_month in aggregates.months:
+            for field in average_fields:
+                column_name = f"{year_month}{REPORT_FIELD_NAMES[field]}"
+                totals = month_totals[field].loc[year_month]
+                if totals['count'] == 0:
+                    monthly_averages[column_name] = None
+                elif field == 'protein_pct' and weight_protein:
+                    # 蛋白率有产奶量数据时使用产奶量加权平均
+                    if totals['pairs'] > 0 and totals['milk_total'] > 0:
+                        monthly_averages[column_name] = round(totals['weighted_total'] / totals['milk_total'], 2)
+                    else:
+                        monthly_averages[column_name] = None
+                else:
+                    monthly_averages[column_name] = round(totals['total'] / totals['count'],
+                                                          MONTHLY_AVERAGE_DIGITS[field])
+        
+        result_df.attrs['monthly_averages'] = monthly_averages
+    
+    def _store_report_aggregates(self, report: pd.DataFrame, aggregates: MonthlyAggregates) -> None:
+        """按新的报告键保存报告的汇总聚合，报告attrs['report_key']记录该键"""
+        key = uuid.uuid4().hex
+        report.attrs['report_key'] = key
+        self._report_aggregates[key] = aggregates
+        while len(self._report_aggregates) > REPORT_AGGREGATES_LIMIT:
+            self._report_aggregates.popitem(last=False)
+    
+    def report_aggregates(self, report: pd.DataFrame) -> Optional[MonthlyAggregates]:
+        """报告（或其剔除部分行后的结果）对应的月度汇总聚合，已被淘汰或不是本处理器生成的报告时返回None"""
+        key = getattr(report, 'attrs', {}).get('report_key')
+        aggregates = self._report_aggregates.get(key)
+        if aggregates is not None:
+            self._report_aggregates.move_to_end(key)
+        return aggregates
+    
+    def refresh_report_summary(self, report: pd.DataFrame) -> pd.DataFrame:
+        """报告行被剔除后（未来泌乳天数筛选、在群牛筛选等）更新汇总
+        
+        只扣减被剔除牛只对月度汇总表的贡献，再由汇总表重写attrs，不重新扫描报告。
+        """
+        aggregates = self.report_aggregates(report)
+        if aggregates is None:
+            return report
+        removed = aggregates.row_labels.difference(report.index)
+        if removed.empty:
+            return report
+        remaining = aggregates.without(removed)
+        self._set_report_summary(report, remaining)
+        self._store_report_aggregates(report, remaining)
+        return report
+    
+    def file_signature(self, filename: str, df: pd.DataFrame) -> FileSignature:
+        """文件的重复检测签名，数据未被替换时（同一对象，按is比较）复用已计算的签名"""
+        fingerprint = (len(df), tuple(df.columns))
+        cached = self._file_signatures.get(filename)
+        if cached is None or cached[0]() is not df or cached[1] != fingerprint:
+            cached = (weakref.ref(df), fingerprint, FileSignature(df))
+            self._file_signatures[filename] = cached
+        return cached[2]
+    
+    def _prune_file_signatures(self, filenames) -> None:
+        """丢弃已不在文件列表中的重复检测签名"""
+        present = set(filenames)
+        for filename in [name for name in self._file_signatures if name not in present]:
+            del self._file_signatures[filename]
+    
     def detect_duplicate_data(self, data_list: List[Dict]) -> Dict[str, Any]:
         """检测重复数据：文件名不同但内容相同或高度相似
         
+        每个文件只计算一次签名，通过MinHash分段桶与内容哈希找出候选文件，只对候选文件计算相似度。
+        
         Returns:
             检测结果字典，包含重复组信息
         """
         logger.info("开始检测重复数据")
         
+        self._prune_file_signatures(item['filename'] for item in data_list)
+        
+        index = SignatureIndex()
+        signatures = {}
+        for i, item in enumerate(data_list):
+            # 跳过空数据
+            if item['data'].empty:
+                continue
+            signatures[i] = self.file_signature(item['filename'], item['data'])
+            index.add(i, signatures[i])
+        
         duplicate_groups = []
         processed_indices = set()
+        compared_pairs = 0
         
-        for i, item1 in enumerate(data_list):
+        for i in signatures:
             if i in processed_indices:
                 continue
-                
-            df1 = item1['data']
-            filename1 = item1['filename']
-            
-            # 跳过空数据
-            if df1.empty:
-                continue
             
-            current_group = [{'index': i, 'filename': filename1, 'data': df1}]
+            item1 = data_list[i]
+            current_group = [{'index': i, 'filename': item1['filename'], 'data': item1['data']}]
             
-            for j, item2 in enumerate(data_list):
+            for j in sorted(index.candidates(i)):
                 if j <= i or j in processed_indices:
                     continue
-                    
-                df2 = item2['data']
-                filename2 = item2['filename']
-                
-                # 跳过空数据
-                if df2.empty:
-                    continue
                 
                 # 检测数据相似度
-                similarity = self._calculate_data_similarity(df1, df2)
+                compared_pairs += 1
+                similarity = signature_similarity(signatures[i], signatures[j])
                 
                 if similarity['is_duplicate']:
                     current_group.append({
                         'index': j, 
-                        'filename': filename2, 
-                        'data': df2,
+                        'filename': data_list[j]['filename'], 
+                        'data': data_list[j]['data'],
                         'similarity_score': similarity['score'],
                         'details': similarity['details']
                     })
@@ -2097,7 +2254,8 @@ class DataProcessor:
             'duplicate_files_count': sum(len(group) for group in duplicate_groups)
         }
         
-        logger.info(f"重复数据检测完成: 发现{len(duplicate_groups)}组重复，涉及{result['duplicate_files_count']}个文件")
+        logger.info(f"重复数据检测完成: 比较{compared_pairs}对候选文件，发现{len(duplicate_groups)}组重复，"
+                    f"涉及{result['duplicate_files_count']}个文件")
         
         return result
     
@@ -2108,129 +2266,7 @@ class DataProcessor:
         if df1.empty or df2.empty:
             return {'is_duplicate': False, 'score': 0.0, 'details': 'Empty dataframe'}
         
-        details = {}
-        similarity_scores = []
-        
-        # 1. 检查数据行数相似度
-        row_count_diff = abs(len(df1) - len(df2))
-        max_rows = max(len(df1), len(df2))
-        row_similarity = 1.0 - (row_count_diff / max_rows) if max_rows > 0 else 0.0
-        details['row_count'] = {
-            'df1_rows': len(df1),
-            'df2_rows': len(df2),
-            'similarity': row_similarity
-        }
-        similarity_scores.append(row_similarity * 0.2)  # 20% 权重
-        
-        # 2. 检查关键字段的数据重叠度
-        key_fields = ['farm_id', 'management_id', 'sample_date', 'protein_pct']
-        field_similarities = {}
-        
-        for field in key_fields:
-            if field in df1.columns and field in df2.columns:
-                # 对于关键标识字段，检查唯一值重叠度
-                if field in ['farm_id', 'management_id']:
-                    values1 = set(df1[field].dropna().astype(str))
-                    values2 = set(df2[field].dropna().astype(str))
-                    
-                    if values1 and values2:
-                        overlap = len(values1 & values2)
-                        union = len(values1 | values2)
-                        field_sim = overlap / union if union > 0 else 0.0
-                    else:
-                        field_sim = 0.0
-                
-                # 对于日期字段，检查日期范围重叠
-                elif field == 'sample_date':
-                    try:
-                        dates1 = pd.to_datetime(df1[field], errors='coerce').dropna()
-                        dates2 = pd.to_datetime(df2[field], errors='coerce').dropna()
-                        
-                        if len(dates1) > 0 and len(dates2) > 0:
-                            range1 = (dates1.min(), dates1.max())
-                            range2 = (dates2.min(), dates2.max())
-                            
-                            # 计算日期范围重叠度
-                            overlap_start = max(range1[0], range2[0])
-                            overlap_end = min(range1[1], range2[1])
-                            
-                            if overlap_start <= overlap_end:
-                                overlap_days = (overlap_end - overlap_start).days + 1
-                                total_days = max((range1[1] - range1[0]).days + 1, (range2[1] - range2[0]).days + 1)
-                                field_sim = overlap_days / total_days if total_days > 0 else 0.0
-                            else:
-                                field_sim = 0.0
-                        else:
-                            field_sim = 0.0
-                    except:
-                        field_sim = 0.0
-                
-                # 对于数值字段，检查分布相似度
-                else:
-                    try:
-                        values1 = df1[field].dropna()
-                        values2 = df2[field].dropna()
-                        
-                        if len(values1) > 0 and len(values2) > 0:
-                            # 使用统计特征比较
-                            stats1 = (values1.mean(), values1.std(), values1.min(), values1.max())
-                            stats2 = (values2.mean(), values2.std(), values2.min(), values2.max())
-                            
-                            # 计算统计特征的相似度
-                            stat_similarities = []
-                            for s1, s2 in zip(stats1, stats2):
-                                if pd.notna(s1) and pd.notna(s2) and max(abs(s1), abs(s2)) > 0:
-                                    diff = abs(s1 - s2) / max(abs(s1), abs(s2))
-                                    stat_similarities.append(1.0 - min(diff, 1.0))
-                                else:
-                                    stat_similarities.append(1.0 if pd.isna(s1) and pd.isna(s2) else 0.0)
-                            
-                            field_sim = sum(stat_similarities) / len(stat_similarities) if stat_similarities else 0.0
-                        else:
-                            field_sim = 1.0 if len(values1) == 0 and len(values2) == 0 else 0.0
-                    except:
-                        field_sim = 0.0
-                
-                field_similarities[field] = field_sim
-        
-        details['field_similarities'] = field_similarities
-        
-        # 3. 计算加权平均相似度
-        if field_similarities:
-            # 不同字段的权重
-            field_weights = {
-                'farm_id': 0.15,
-                'management_id': 0.25,
-                'sample_date': 0.25,
-                'protein_pct': 0.15
-            }
-            
-            weighted_sum = 0.0
-            total_weight = 0.0
-            
-            for field, similarity in field_similarities.items():
-                weight = field_weights.get(field, 0.1)
-                weighted_sum += similarity * weight
-                total_weight += weight
-            
-            field_similarity_score = weighted_sum / total_weight if total_weight > 0 else 0.0
-            similarity_scores.append(field_similarity_score * 0.8)  # 80% 权重
-        
-        # 4. 计算最终相似度分数
-        final_score = sum(similarity_scores)
-        
-        # 5. 判断是否为重复数据
-        # 阈值：相似度超过85%认为是重复数据
-        is_duplicate = final_score > 0.85
-        
-        details['final_score'] = final_score
-        details['threshold'] = 0.85
-        
-        return {
-            'is_duplicate': is_duplicate,
-            'score': final_score,
-            'details': details
-        }
+        return signature_similarity(FileSignature(df1), FileSignature(df2))
 
     def _get_field_chinese_name(self, field: str) -> str:
         """获取字段的中文名称"""
@@ -2263,74 +2299,42 @@ class DataProcessor:
     def debug_zip_processing(self, zip_path: str, filename: str) -> Dict:
         """调试ZIP文件处理过程"""
         debug_info = {"processing_steps": []}
-        target_files = self.rules.get("file_ingest", {}).get("internal_targets", [
-            "04-2综合测定结果表.xlsx",
-            "04-2综合测定结果表.xls", 
-            "04综合测定结果表.xlsx",
-            "04综合测定结果表.xls",
-            "综合测定结果表.xlsx",
-            "综合测定结果表.xls"
-        ])
-        
-        # 获取需要排除的文件名列表
-        excluded_files = self.rules.get("file_ingest", {}).get("excluded_files", [])
+        target_files, excluded_files = self._get_zip_target_rules()
         
         try:
             # 步骤2：解析ZIP文件
             with zipfile.ZipFile(zip_path, 'r') as zip_ref:
                 file_list = zip_ref.namelist()
+                member, member_name, found_files = self._resolve_zip_member(zip_ref)
                 debug_info["processing_steps"].append({
                     "step": "2. 解析ZIP文件",
                     "success": True,
                     "zip_files": [str(f) for f in file_list],
                     "target_files": [str(f) for f in target_files],
                     "excluded_files": [str(f) for f in excluded_files],
-                    "target_found": any(f in target_files and f not in excluded_files for f in file_list)
+                    "target_found": member_name in target_files
                 })
                 
-                # 步骤3：提取文件
-                with tempfile.TemporaryDirectory() as temp_dir:
-                    zip_ref.extractall(temp_dir)
-                    
-                    # 查找Excel文件（排除excluded_files）
-                    excel_files = []
-                    target_path = None
-                    
-                    for root, dirs, files in os.walk(temp_dir):
-                        for file in files:
-                            if file.endswith(('.xlsx', '.xls')):
-                                if file not in excluded_files:
-                                    excel_files.append(file)
-                                    if file in target_files:
-                                        target_path = os.path.join(root, file)
-                    
+                # 步骤3：定位Excel成员（不解压其他文件）
+                excel_files = [f for f in found_files
+                               if f.endswith(('.xlsx', '.xls')) and f not in excluded_files]
+                debug_info["processing_steps"].append({
+                    "step": "3. 查找Excel文件",
+                    "excel_files_found": [str(f) for f in excel_files],
+                    "target_file_path": str(member.filename) if member else None
+                })
+                
+                # 步骤4：处理Excel文件
+                if member is not None:
+                    with self._read_zip_member(zip_ref, member) as buffer:
+                        excel_debug = self.debug_excel_processing(buffer, member_name)
+                    debug_info["processing_steps"].extend(excel_debug["processing_steps"])
+                else:
                     debug_info["processing_steps"].append({
-                        "step": "3. 查找Excel文件",
-                        "excel_files_found": [str(f) for f in excel_files],
-                        "target_file_path": str(target_path) if target_path else None,
-                        "temp_dir": str(temp_dir)
+                        "step": "4. 处理Excel文件",
+                        "success": False,
+                        "error": "未找到任何Excel文件"
                     })
-                    
-                    # 步骤4：处理Excel文件
-                    if target_path:
-                        excel_debug = self.debug_excel_processing(target_path, target_path.split('/')[-1])
-                        debug_info["processing_steps"].extend(excel_debug["processing_steps"])
-                    elif excel_files:
-                        # 尝试第一个Excel文件
-                        first_excel = excel_files[0]
-                        for root, dirs, files in os.walk(temp_dir):
-                            for file in files:
-                                if file == first_excel:
-                                    excel_debug = self.debug_excel_processing(os.path.join(root, file), first_excel)
-                                    debug_info["processing_steps"].extend(excel_debug["processing_steps"])
-                                    break
-                            break
-                    else:
-                        debug_info["processing_steps"].append({
-                            "step": "4. 处理Excel文件",
-                            "success": False,
-                            "error": "未找到任何Excel文件"
-                        })
         
         except Exception as e:
             debug_info["processing_steps"].append({
@@ -2341,7 +2345,7 @@ class DataProcessor:
         
         return debug_info
     
-    def debug_excel_processing(self, excel_path: str, filename: str) -> Dict:
+    def debug_excel_processing(self, excel_path: Union[str, IO[bytes]], filename: str) -> Dict:
         """调试Excel文件处理过程"""
         debug_info = {"processing_steps": []}
         
@@ -2478,9 +2482,23 @@ class DataProcessor:
         
         return debug_info 
     
+    def filter_cache_key(self, data_list: List[Dict], filters: Dict[str, Any], selected_files: List[str]) -> str:
+        """多筛选项结果的缓存键：所选文件的内容摘要 + 规范化后的筛选条件
+        
+        data_list有任何变化（增删、替换文件）时先清空结果缓存。
+        """
+        herd_table = self.get_herd_table(data_list)
+        if herd_table.version != self._result_cache_version:
+            self.result_cache.clear()
+            self._result_cache_version = herd_table.version
+        digests = [herd_table.file_digest(name) for name, _ in herd_table.file_frames(selected_files)]
+        return make_cache_key('multi_filter', digests, normalize_filters(filters))
+    
     def apply_multi_filter_logic(self, data_list: List[Dict], filters: Dict[str, Any], selected_files: List[str], progress_callback=None, should_stop=None) -> pd.DataFrame:
         """应用新的多筛选项逻辑：每个筛选项独立计算，所有启用的筛选项都必须符合（优化版本）
         
+        相同数据与筛选条件的结果直接取自结果缓存。
+        
         Args:
             data_list: 数据列表
             filters: 筛选条件字典
@@ -2491,6 +2509,23 @@ class DataProcessor:
         Returns:
             筛选后的DataFrame
         """
+        self.last_filter_plan = []
+        cache_key = self.filter_cache_key(data_list, filters, selected_files)
+        cached = self.result_cache.get(cache_key)
+        if cached is not None:
+            logger.info(f"使用缓存的筛选结果：{len(cached)}行")
+            self.last_filter_plan = ["   使用缓存的筛选结果，未重新执行"]
+            if progress_callback:
+                progress_callback("🚀 使用缓存的筛选结果", 90)
+            return cached
+        
+        result_df = self._run_multi_filter_logic(data_list, filters, selected_files, progress_callback, should_stop)
+        if not (should_stop and should_stop()):
+            self.result_cache.put(cache_key, result_df)
+        return result_df
+    
+    def _run_multi_filter_logic(self, data_list: List[Dict], filters: Dict[str, Any], selected_files: List[str], progress_callback=None, should_stop=None) -> pd.DataFrame:
+        """执行多筛选项逻辑（不经过结果缓存）"""
         # 筛选选中的文件
         selected_data = [item for item in data_list if item['filename'] in selected_files]
         
@@ -2507,51 +2542,15 @@ class DataProcessor:
         if progress_callback:
             progress_callback("🚀 合并数据文件（优化版本）...", 26)
         
-        # 合并所有数据
-        all_dfs = []
-        all_months = set()
-        
-        for i, item in enumerate(selected_data):
-            if should_stop and should_stop():
-                logger.info("筛选被用户取消")
-                return pd.DataFrame()
-                
-            df = item['data'].copy()
-            df['source_file'] = item['filename']
-            
-            # 确保关键字段为字符串类型，保持数据一致性
-            for field in ['farm_id', 'management_id']:
-                if field in df.columns:
-                    df[field] = df[field].astype(str)
-                    # 移除'nan'字符串，转换为None
-                    df.loc[df[field] == 'nan', field] = None
-            
-            # 添加年月列
-            if 'sample_date' in df.columns:
-                df['year_month'] = pd.to_datetime(df['sample_date']).dt.strftime('%Y-%m')
-                # 收集所有月份
-                months = df['year_month'].dropna().unique()
-                all_months.update(months)
-            
-            all_dfs.append(df)
-            
-            # 更新进度
-            if progress_callback:
-                file_progress = 26 + int((i + 1) / len(selected_data) * 5)  # 26-31%
-                progress_callback(f"🚀 处理文件 {i+1}/{len(selected_data)}: {item['filename']}", file_progress)
+        # 从牛群长表获取合并数据（只整理新增的文件；apply_filters会复制，这里直接使用缓存）
+        herd_table = self.get_herd_table(data_list)
+        combined_df = herd_table.frame(selected_files, copy=False)
+        all_months = herd_table.months(selected_files)
         
         if progress_callback:
             progress_callback("🚀 合并数据...", 32)
         
-        combined_df = pd.concat(all_dfs, ignore_index=True)
-        
-        # 合并后再次确保字符串字段类型一致性
-        for field in ['farm_id', 'management_id']:
-            if field in combined_df.columns:
-                combined_df[field] = combined_df[field].astype(str)
-                combined_df.loc[combined_df[field] == 'nan', field] = None
-        
-        logger.info(f"合并数据：共{len(combined_df)}行，覆盖月份：{sorted(all_months)}")
+        logger.info(f"合并数据：共{len(combined_df)}行，覆盖月份：{all_months}")
         
         if progress_callback:
             progress_callback("🚀 应用基础筛选条件...", 33)
@@ -2574,16 +2573,10 @@ class DataProcessor:
                             continue
                     base_filters[filter_name] = filter_config
         
-        # 应用基础筛选
-        base_filtered_df = self.apply_filters(combined_df, base_filters)
-        logger.info(f"基础筛选后：共{len(base_filtered_df)}行")
-        
-        if base_filtered_df.empty:
-            return pd.DataFrame()
-        
         # 检查必要字段 - 只需要management_id，farm_id是可选的
-        if 'management_id' not in base_filtered_df.columns:
-            return base_filtered_df
+        if 'management_id' not in combined_df.columns:
+            base_filtered_df = self.apply_filters(combined_df, base_filters)
+            return pd.DataFrame() if base_filtered_df.empty else self._drop_internal_columns(base_filtered_df)
         
         # 收集启用的特殊筛选项（蛋白率、体细胞数等）
         special_filters = {}
@@ -2595,23 +2588,40 @@ class DataProcessor:
         
         if not special_filters:
             logger.info("没有启用的特殊筛选项，返回基础筛选结果")
-            return base_filtered_df
+            base_filtered_df = self.apply_filters(combined_df, base_filters)
+            logger.info(f"基础筛选后：共{len(base_filtered_df)}行")
+            return pd.DataFrame() if base_filtered_df.empty else self._drop_internal_columns(base_filtered_df)
         
         logger.info(f"启用的特殊筛选项: {list(special_filters.keys())}")
         
-        # 使用向量化方法进行高速筛选
+        # 基础筛选结果与位图索引只在数据或基础筛选条件变化时重建，修改阈值后直接复用
+        index_key = (
+            herd_table.version,
+            tuple(name for name, _ in herd_table.file_frames(selected_files)),
+            json.dumps(base_filters, sort_keys=True, ensure_ascii=False, default=str),
+        )
+        if index_key != self._screening_index_key:
+            base_filtered_df = self.apply_filters(combined_df, base_filters)
+            logger.info(f"基础筛选后：共{len(base_filtered_df)}行")
+            if base_filtered_df.empty:
+                return pd.DataFrame()
+            if progress_callback:
+                progress_callback("🚀 建立筛选位图索引...", 35)
+            self._screening_index = ScreeningIndex(base_filtered_df, all_months)
+            self._screening_index_key = index_key
+        else:
+            logger.info("基础筛选条件未变化，复用筛选位图索引")
+        
         return self._apply_vectorized_multi_filters(
-            base_filtered_df, special_filters, list(all_months), 
-            progress_callback, should_stop
+            self._screening_index, special_filters, progress_callback, should_stop
         )
     
-    def _apply_vectorized_multi_filters(self, df: pd.DataFrame, special_filters: Dict, all_months: List[str], progress_callback=None, should_stop=None) -> pd.DataFrame:
-        """使用向量化操作应用多筛选项逻辑（高性能版本）
+    def _apply_vectorized_multi_filters(self, index: ScreeningIndex, special_filters: Dict, progress_callback=None, should_stop=None) -> pd.DataFrame:
+        """用位图索引应用多筛选项逻辑：各筛选项得到牛只位图后按位与
         
         Args:
-            df: 基础筛选后的DataFrame
+            index: 基础筛选结果上的位图索引
             special_filters: 特殊筛选项配置
-            all_months: 所有月份列表
             progress_callback: 进度回调函数
             should_stop: 停止检查函数
             
@@ -2619,133 +2629,42 @@ class DataProcessor:
             筛选后的DataFrame
         """
         if progress_callback:
-            progress_callback("🚀 开始向量化筛选（高速模式）...", 35)
-        
-        # 获取所有牛只
-        if 'farm_id' in df.columns:
-            all_cows = df[['farm_id', 'management_id']].drop_duplicates()
-            # 为每头牛创建唯一标识
-            df['cow_id'] = df['farm_id'].astype(str) + '_' + df['management_id'].astype(str)
-        else:
-            all_cows = df[['management_id']].drop_duplicates()
-            # 为每头牛创建唯一标识
-            df['cow_id'] = df['management_id'].astype(str)
-        logger.info(f"筛选范围内共有{len(all_cows)}头牛，将使用向量化处理")
-        all_cow_ids = set(df['cow_id'].unique())
-        
-        if progress_callback:
-            progress_callback("🚀 预处理数据结构...", 40)
-        
-        # 预处理：为每个筛选项创建符合条件的掩码
-        filter_masks = {}
+            progress_callback("🚀 位图筛选...", 40)
         
-        for i, (filter_name, filter_config) in enumerate(special_filters.items()):
-            if should_stop and should_stop():
-                logger.info("筛选被用户取消")
-                return pd.DataFrame()
-            
-            field = filter_config.get('field')
-            min_val = filter_config.get('min', 0)
-            max_val = filter_config.get('max', 100)
-            min_match_months = filter_config.get('min_match_months', 3)
-            treat_empty_as_match = filter_config.get('treat_empty_as_match', False)
-            
-            if not field or field not in df.columns:
-                logger.warning(f"跳过筛选项{filter_name}：字段{field}不存在")
-                continue
-            
-            if progress_callback:
-                filter_progress = 40 + int((i / len(special_filters)) * 30)  # 40-70%
-                progress_callback(f"🚀 处理筛选项: {filter_name}", filter_progress)
-            
-            # 创建数值范围掩码（向量化操作）
-            numeric_values = pd.to_numeric(df[field], errors='coerce')
-            value_mask = (numeric_values >= min_val) & (numeric_values <= max_val)
-            
-            # 处理空值逻辑
-            if treat_empty_as_match:
-                # 空值被视为符合条件
-                empty_mask = df[field].isna() | (df[field] == '')
-                condition_mask = value_mask | empty_mask
-            else:
-                # 空值不符合条件
-                condition_mask = value_mask & df[field].notna()
-            
-            # 为符合条件的记录添加标记
-            df[f'{filter_name}_match'] = condition_mask
-            
-            # 计算每头牛每个月的符合情况（使用groupby向量化操作）
-            if progress_callback:
-                progress_callback(f"🚀 统计月度符合情况: {filter_name}", filter_progress + 3)
-            
-            # 按牛只和月份分组，计算每月是否有符合条件的记录
-            monthly_matches = df.groupby(['cow_id', 'year_month'])[f'{filter_name}_match'].any().reset_index()
-            
-            # 计算每头牛的符合月数
-            cow_match_counts = monthly_matches.groupby('cow_id')[f'{filter_name}_match'].sum().reset_index()
-            cow_match_counts.columns = ['cow_id', f'{filter_name}_count']
-            
-            # 处理没有数据的月份（如果treat_empty_as_match为True）
-            if treat_empty_as_match:
-                # 为每头牛添加所有月份，缺失的月份视为符合
-                all_cow_month_combinations = pd.MultiIndex.from_product(
-                    [all_cow_ids, all_months], 
-                    names=['cow_id', 'year_month']
-                ).to_frame(index=False)
-                
-                # 左连接，缺失的会被填充为False
-                complete_monthly = all_cow_month_combinations.merge(
-                    monthly_matches, on=['cow_id', 'year_month'], how='left'
-                )
-                complete_monthly[f'{filter_name}_match'] = complete_monthly[f'{filter_name}_match'].fillna(True)
-                
-                # 重新计算符合月数
-                cow_match_counts = complete_monthly.groupby('cow_id')[f'{filter_name}_match'].sum().reset_index()
-                cow_match_counts.columns = ['cow_id', f'{filter_name}_count']
-            
-            # 创建通过此筛选项的牛只掩码
-            passing_cows = cow_match_counts[cow_match_counts[f'{filter_name}_count'] >= min_match_months]['cow_id']
-            filter_masks[filter_name] = set(passing_cows)
-            
-            logger.info(f"筛选项{filter_name}: {len(passing_cows)}头牛通过（需要{min_match_months}个月，treat_empty_as_match={treat_empty_as_match}）")
+        logger.info(f"筛选范围内共有{index.n_cows}头牛，将使用位图索引筛选")
+        passing = index.query(special_filters, should_stop)
         
-        if progress_callback:
-            progress_callback("🚀 合并筛选结果...", 70)
+        # 执行计划：按预估通过率从低到高执行，候选为空后不再计算
+        self.last_filter_plan = format_plan(index.last_plan)
+        for line in self.last_filter_plan:
+            logger.info(f"筛选计划{line}")
         
-        # 检查是否应该停止
         if should_stop and should_stop():
             logger.info("筛选被用户取消")
             return pd.DataFrame()
         
-        # 找出通过所有筛选项的牛只（集合交集操作）
-        if filter_masks:
-            valid_cow_ids = set.intersection(*filter_masks.values())
-            logger.info(f"通过所有{len(special_filters)}个筛选项的牛：{len(valid_cow_ids)}头")
-        else:
-            valid_cow_ids = all_cow_ids
-            logger.info("没有有效的筛选项，返回所有牛")
-        
         if progress_callback:
             progress_callback("🚀 提取最终结果...", 85)
         
-        # 返回符合条件的牛的所有数据（向量化筛选）
-        if valid_cow_ids:
-            result_df = df[df['cow_id'].isin(valid_cow_ids)].copy()
-            
-            # 清理临时列
-            cols_to_drop = ['cow_id'] + [col for col in result_df.columns if col.endswith('_match')]
-            result_df = result_df.drop(columns=cols_to_drop, errors='ignore')
-            
+        if passing is None:
+            logger.info("没有有效的筛选项，返回所有牛")
+            return self._drop_internal_columns(index.df)
+        
+        passing_count = popcount(passing)
+        logger.info(f"通过所有{len(special_filters)}个筛选项的牛：{passing_count}头")
+        if passing_count == 0:
             if progress_callback:
-                progress_callback("🚀 向量化筛选完成", 90)
-                
-            logger.info(f"最终结果：{len(result_df)}行数据，来自{len(valid_cow_ids)}头牛")
-            return result_df
+                progress_callback("🚀 筛选完成（无符合条件的牛）", 90)
+            return pd.DataFrame()
+        
+        # 返回符合条件的牛的所有数据（缺少牛只标识的行不属于任何一头牛）
+        result_df = self._drop_internal_columns(index.df[index.rows_for(passing)])
         
         if progress_callback:
-            progress_callback("🚀 向量化筛选完成（无符合条件的牛）", 90)
-            
-        return pd.DataFrame()
+            progress_callback("🚀 位图筛选完成", 90)
+        
+        logger.info(f"最终结果：{len(result_df)}行数据，来自{passing_count}头牛")
+        return result_df
     
     def check_farm_id_consistency(self, data_list: List[Dict]) -> Tuple[bool, List[str], Dict[str, List[str]]]:
         """检查所有文件的牧场编号一致性
@@ -2807,8 +2726,11 @@ class DataProcessor:
                 # 统计更新前的记录数
                 original_records = len(df[df['farm_id'].notna()])
                 
-                # 将所有非空的牧场编号更新为目标牧场编号
-                df.loc[df['farm_id'].notna(), 'farm_id'] = target_farm_id
+                # 将所有非空的牧场编号更新为目标牧场编号（分类类型需先还原才能写入新值）
+                farm_ids = df['farm_id'].astype(object)
+                farm_ids.loc[farm_ids.notna()] = target_farm_id
+                farm_id_dtype = self._get_field_schema().get('farm_id', 'string')
+                df['farm_id'] = self._cast_field(farm_ids, 'farm_id', farm_id_dtype)
                 
                 # 统计更新后的记录数
                 updated_records = len(df[df['farm_id'] == target_farm_id])
@@ -2822,6 +2744,8 @@ class DataProcessor:
             updated_data_list.append(updated_item)
         
         logger.info(f"牧场编号统一完成: 总共更新了{total_updated_records}条记录为牧场{target_farm_id}")
+        # 牧场编号改变后原有筛选结果全部作废
+        self.result_cache.clear()
         return updated_data_list
     
     def get_data_ranges(self, data_list: List[Dict]) -> Dict[str, Dict]:
@@ -2836,22 +2760,9 @@ class DataProcessor:
         if not data_list:
             return {}
         
-        # 合并所有数据
-        all_dfs = []
-        all_months = set()
-        
-        for item in data_list:
-            df = item['data'].copy()
-            
-            # 收集所有月份
-            if 'sample_date' in df.columns:
-                df['year_month'] = pd.to_datetime(df['sample_date'], errors='coerce').dt.strftime('%Y-%m')
-                months = df['year_month'].dropna().unique()
-                all_months.update(months)
-            
-            all_dfs.append(df)
-        
-        combined_df = pd.concat(all_dfs, ignore_index=True) if all_dfs else pd.DataFrame()
+        # 合并各文件上传时计算的统计，不读取行数据
+        merged = self.get_herd_table(data_list).merged_stats()
+        all_months = merged['months']
         
         ranges = {}
         
@@ -2862,29 +2773,24 @@ class DataProcessor:
             'description': f'数据跨越{len(all_months)}个月'
         }
         
-        # 定义需要计算范围的数值字段
-        numeric_fields = [
-            'protein_pct', 'fat_pct', 'lactose_pct', 'solids_pct', 
-            'milk_yield', 'lactation_days', 'somatic_cell_count',
-            'fat_protein_ratio', 'somatic_cell_score', 'urea_nitrogen',
-            'freezing_point', 'total_bacterial_count', 'dry_matter_intake',
-            'net_energy_lactation', 'metabolizable_protein', 'crude_protein',
-            'neutral_detergent_fiber', 'acid_detergent_fiber', 'starch',
-            'ether_extract', 'ash', 'calcium', 'phosphorus', 'magnesium',
-            'sodium', 'potassium', 'sulfur'
-        ]
+        # 采样日期范围
+        if merged['sample_dates'] is not None:
+            first_date, last_date = merged['sample_dates']
+            ranges['sample_date'] = {
+                'min': first_date,
+                'max': last_date,
+                'description': f"{first_date.strftime('%Y-%m-%d')} 到 {last_date.strftime('%Y-%m-%d')}"
+            }
         
-        for field in numeric_fields:
-            if field in combined_df.columns:
+        for field in RANGE_FIELDS:
+            if field in merged['fields']:
                 try:
-                    # 尝试转换为数值类型
-                    numeric_data = pd.to_numeric(combined_df[field], errors='coerce').dropna()
-                    
-                    if len(numeric_data) > 0:
-                        min_val = float(numeric_data.min())
-                        max_val = float(numeric_data.max())
-                        mean_val = float(numeric_data.mean())
-                        count = len(numeric_data)
+                    field_stats = merged['fields'][field]
+                    if field_stats['count'] > 0:
+                        min_val = field_stats['min']
+                        max_val = field_stats['max']
+                        mean_val = field_stats['sum'] / field_stats['count']
+                        count = field_stats['count']
                         
                         # 对于某些字段，设置更合理的默认范围
                         if field == 'protein_pct':
@@ -3427,18 +3333,16 @@ class DataProcessor:
                 logger.warning("没有选择检查月份")
                 return pd.DataFrame(columns=['management_id', 'chronic_mastitis'])
             
-            # 合并所有DHI数据
-            all_dhi = []
-            for item in dhi_data_list:
-                df = item['data'].copy()
-                if 'somatic_cell_count' in df.columns:
-                    all_dhi.append(df)
+            # 从牛群长表获取包含体细胞数的DHI数据
+            all_dhi = [item['filename'] for item in dhi_data_list
+                       if item.get('data') is not None and 'somatic_cell_count' in item['data'].columns]
             
             if not all_dhi:
                 logger.warning("没有找到包含体细胞数的DHI数据")
                 return pd.DataFrame(columns=['management_id', 'chronic_mastitis'])
             
-            combined_dhi = pd.concat(all_dhi, ignore_index=True)
+            herd_table = self.get_herd_table(dhi_data_list)
+            combined_dhi = herd_table.frame(all_dhi)
             
             # 确定使用的ID字段（优先使用management_id，如果没有则使用ear_tag）
             if 'management_id' in combined_dhi.columns:
@@ -3458,7 +3362,7 @@ class DataProcessor:
                 return pd.DataFrame(columns=[id_column, 'chronic_mastitis'])
             
             # 添加年月列（格式：YYYY年MM月）
-            combined_dhi['year_month'] = pd.to_datetime(combined_dhi['sample_date']).dt.strftime('%Y年%m月')
+            combined_dhi['year_month'] = format_months(combined_dhi['month'], '%Y年%m月')
             
             # 转换选择的月份为集合以便快速查找
             selected_months_set = set(selected_months)
@@ -4116,13 +4020,22 @@ class DataProcessor:
 
     # 删除临时分析文件
     def cleanup_temp_files(self):
-        """清理临时文件"""
+        """清理临时文件
+        
+        分区存储的临时数据（temp_data）只在本次运行中使用，全部删除；解析缓存（parse_cache）
+        按文件内容寻址、供之后再次上传同一文件时复用，不在此删除，只按保留时长与容量淘汰。
+        """
         try:
             temp_files = ['analyze_test_data.py']
             for temp_file in temp_files:
                 if os.path.exists(temp_file):
                     os.remove(temp_file)
                     logger.info(f"已删除临时文件: {temp_file}")
+            
+            self.temp_store.clear()
+            logger.info(f"已清理临时数据目录: {self.temp_store.root_dir}")
+            if self.parse_cache is not None:
+                self.parse_cache.evict()
         except Exception as e:
             logger.warning(f"清理临时文件时出错: {e}")
     
@@ -4244,18 +4157,16 @@ class DataProcessor:
             logger.info(f"筛查数据列: {screening_data.columns.tolist()}")
             logger.info(f"筛查数据行数: {len(screening_data)}")
             
-            # 合并所有DHI数据
-            all_dhi = []
-            for item in dhi_data_list:
-                df = item['data'].copy()
-                if 'somatic_cell_count' in df.columns:
-                    all_dhi.append(df)
+            # 从牛群长表获取包含体细胞数的DHI数据
+            all_dhi = [item['filename'] for item in dhi_data_list
+                       if item.get('data') is not None and 'somatic_cell_count' in item['data'].columns]
             
             if not all_dhi:
                 logger.warning("没有找到包含体细胞数的DHI数据")
                 return None
             
-            combined_dhi = pd.concat(all_dhi, ignore_index=True)
+            herd_table = self.get_herd_table(dhi_data_list)
+            combined_dhi = herd_table.frame(all_dhi)
             
             # 确定使用的ID字段
             if 'management_id' in combined_dhi.columns:
@@ -4275,7 +4186,7 @@ class DataProcessor:
                 return None
             
             # 添加年月列（格式：YYYY年MM月）
-            combined_dhi['year_month'] = pd.to_datetime(combined_dhi['sample_date']).dt.strftime('%Y年%m月')
+            combined_dhi['year_month'] = format_months(combined_dhi['month'], '%Y年%m月')
             
             # 检查筛查数据中使用的ID字段，并与DHI数据匹配
             if 'ear_tag' in screening_data.columns and 'ear_tag' in combined_dhi.columns:
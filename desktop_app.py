@@ -33,7 +33,8 @@ from PyQt6.QtGui import QIcon, QFont, QPixmap, QColor, QAction, QPalette
 import yaml
 
 # 导入我们的数据处理模块
-from data_processor import DataProcessor
+from data_processor import DataProcessor, REPORT_FIELD_NAMES
+from monthly_aggregates import report_month_stats
 from models import FilterConfig
 
 # 导入认证模块
@@ -630,29 +631,42 @@ class FileProcessThread(QThread):
             self.log_updated.emit(f"⏰ 处理开始时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
             self.progress_updated.emit("开始处理文件...", 5)
             
-            # 逐个处理文件，提供更详细的进度
+            # 汇总容器
             success_files = []
             failed_files = []
             all_data = []
             farm_ids = set()
             
-            for i, (file_path, filename) in enumerate(zip(self.file_paths, self.filenames)):
-                base_progress = 10 + int((i / total_files) * 70)  # 10-80% for file processing
-                
-                self.log_updated.emit(f"\n📄 正在处理文件 {i+1}/{total_files}: {filename}")
-                self.progress_updated.emit(f"处理文件 {i+1}/{total_files}: {filename}", base_progress)
-                
-                # 细分进度：读取文件
-                self.progress_updated.emit(f"正在读取: {filename}", base_progress + 2)
-                
+            # 如果文件很大，提前提示
+            for file_path, filename in zip(self.file_paths, self.filenames):
                 try:
-                    # 如果文件很大，添加更多进度更新
                     file_size = os.path.getsize(file_path) / (1024 * 1024)  # MB
-                    if file_size > 10:
-                        self.progress_updated.emit(f"正在解析大文件: {filename} ({file_size:.1f}MB)", base_progress + 5)
-                    
-                    success, message, df = self.processor.process_uploaded_file(file_path, filename)
-                    
+                except OSError:
+                    continue
+                if file_size > 10:
+                    self.log_updated.emit(f"📦 大文件: {filename} ({file_size:.1f}MB)")
+            
+            completed_count = [0]
+            
+            def on_file_done(index, filename, success, message, df):
+                # 各文件在进程池中并行解析，按完成先后更新进度
+                completed_count[0] += 1
+                progress = 10 + int((completed_count[0] / total_files) * 70)  # 10-80% for file processing
+                status = "✅" if success else "❌"
+                self.log_updated.emit(f"📄 已解析 {completed_count[0]}/{total_files}: {filename} {status}")
+                self.progress_updated.emit(f"处理文件 {completed_count[0]}/{total_files}: {filename}", progress)
+            
+            self.progress_updated.emit(f"正在并行读取 {total_files} 个文件...", 10)
+            parsed_results = self.processor.parse_files_parallel(
+                self.file_paths, self.filenames, on_file_done=on_file_done
+            )
+            
+            # 按上传顺序汇总结果，保证输出顺序确定
+            for i, (filename, (success, message, df)) in enumerate(zip(self.filenames, parsed_results)):
+                self.log_updated.emit(f"\n📄 文件 {i+1}/{total_files}: {filename}")
+                
+                try:
+                    date_range = None
                     if success and df is not None:
                         # 获取数据信息
                         row_count = len(df)
@@ -669,6 +683,13 @@ class FileProcessThread(QThread):
                         if date_range:
                             self.log_updated.emit(f"   📅 数据时间范围: {date_range}")
                         
+                        memory_report = df.attrs.get('memory_report')
+                        if memory_report:
+                            self.log_updated.emit(
+                                f"   💾 内存占用: {memory_report['before_bytes'] / 1024 / 1024:.2f}MB → "
+                                f"{memory_report['after_bytes'] / 1024 / 1024:.2f}MB（节省{memory_report['saved_pct']}%）"
+                            )
+                        
                         success_files.append({
                             'filename': filename,
                             'message': message,
@@ -847,27 +868,12 @@ class FilterThread(QThread):
             
             self.progress_updated.emit("统计数据规模...", 10)
             
-            # 计算全部数据的牛头数
-            all_cows = set()
-            for item in self.data_list:
-                df = item['data']
-                if 'management_id' in df.columns:
-                    cow_ids = df['management_id'].dropna().unique()
-                    for cow_id in cow_ids:
-                        all_cows.add(cow_id)
-            
+            # 全部数据与筛选范围的牛头数（合并各文件上传时统计的管理号）
+            herd_table = self.processor.get_herd_table(self.data_list)
+            all_cows = herd_table.management_ids()
             self.log_updated.emit(f"📊 全部数据: {len(all_cows)} 头牛")
             
-            # 计算筛选范围的牛头数
-            range_cows = set()
-            selected_data = [item for item in self.data_list if item['filename'] in self.selected_files]
-            for item in selected_data:
-                df = item['data']
-                if 'management_id' in df.columns:
-                    cow_ids = df['management_id'].dropna().unique()
-                    for cow_id in cow_ids:
-                        range_cows.add(cow_id)
-            
+            range_cows = herd_table.management_ids(self.selected_files)
             self.log_updated.emit(f"📊 筛选范围: {len(range_cows)} 头牛 (来自{len(self.selected_files)}个文件)")
             
             self.progress_updated.emit("应用筛选条件...", 25)
@@ -891,6 +897,11 @@ class FilterThread(QThread):
                 self.filtering_completed.emit(False, "筛选已被用户取消", pd.DataFrame(), {})
                 return
             
+            if self.processor.last_filter_plan:
+                self.log_updated.emit("🧭 筛选执行计划（按预估通过率从低到高）:")
+                for line in self.processor.last_filter_plan:
+                    self.log_updated.emit(line)
+            
             basic_filter_count = len(filtered_df)
             self.log_updated.emit(f"📊 基础筛选后: {basic_filter_count} 条记录")
             
@@ -935,7 +946,9 @@ class FilterThread(QThread):
             
             self.log_updated.emit(f"📅 计划调群日期: {plan_date}")
             
-            monthly_report = self.processor.create_monthly_report(filtered_df, display_fields, plan_date)
+            # 相同数据与筛选条件的报告直接取自结果缓存
+            filter_key = self.processor.filter_cache_key(self.data_list, self.filters, self.selected_files)
+            monthly_report = self.processor.create_monthly_report(filtered_df, display_fields, plan_date, filter_key=filter_key)
             
             self.log_updated.emit(f"📊 月度报告生成: {len(monthly_report)} 条记录")
             
@@ -966,12 +979,13 @@ class FilterThread(QThread):
                 after_active_count = len(monthly_report)
                 self.log_updated.emit(f"📊 在群牛筛选后: {after_active_count} 条记录 (筛除{before_active_count - after_active_count}条)")
             
+            # 报告行被筛除后，只扣减被筛除牛只的月度汇总，重算总平均值与各月平均值
+            monthly_report = self.processor.refresh_report_summary(monthly_report)
+            
             # 计算筛选结果的牛头数
-            result_cows = set()
+            result_cows = []
             if not monthly_report.empty and 'management_id' in monthly_report.columns:
-                cow_ids = monthly_report['management_id'].dropna().unique()
-                for cow_id in cow_ids:
-                    result_cows.add(cow_id)
+                result_cows = monthly_report['management_id'].dropna().unique()
             
             # 计算筛选率
             filter_rate = (len(result_cows) / len(all_cows) * 100) if len(all_cows) > 0 else 0
@@ -3835,6 +3849,8 @@ class MainWindow(QMainWindow):
                 color: black;
             }
         """)
+        # 调整阈值时按阈值扫描结果实时重绘趋势图
+        self.monitoring_scc_threshold.valueChanged.connect(self.preview_monitoring_threshold)
         
         # 按钮组
         button_styles = self.get_responsive_button_styles()
@@ -5588,26 +5604,13 @@ class MainWindow(QMainWindow):
         # 处理成功后设置标志
         self.dhi_processed_ok = True if self.data_list else False
         
-        # 计算总牛头数并更新分析面板
-        total_cows = set()
-        all_data_combined = []
-        
-        for item in self.data_list:
-            df = item['data']
-            if df is not None and not df.empty:
-                all_data_combined.append(df)
-                if 'management_id' in df.columns:
-                    cow_ids = df['management_id'].dropna().unique()
-                    for cow_id in cow_ids:
-                        total_cows.add(cow_id)
-        
-        # 合并所有数据用于分析
-        if all_data_combined:
-            combined_df = pd.concat(all_data_combined, ignore_index=True)
-            self.update_filter_ranges(combined_df)
+        # 总牛头数与筛选范围都由各文件上传时计算的统计合并得出
+        herd_table = self.processor.get_herd_table(self.data_list)
+        if any(item['data'] is not None and not item['data'].empty for item in self.data_list):
+            self.update_filter_ranges()
         
         # 更新全部数据统计
-        getattr(self.total_data_card, 'value_label').setText(str(len(total_cows)))
+        getattr(self.total_data_card, 'value_label').setText(str(len(herd_table.management_ids())))
         
         # 牛场编号选择器已移除 - 单牛场上传不再需要
         
@@ -5722,7 +5725,7 @@ class MainWindow(QMainWindow):
             print(f"提取月份信息时出错: {e}")
             return "月份信息提取失败"
     
-    def update_filter_ranges(self, df):
+    def update_filter_ranges(self):
         """根据数据更新筛选条件的范围和默认值"""
         try:
             # 使用新的数据范围计算功能
@@ -5821,18 +5824,16 @@ class MainWindow(QMainWindow):
                         print(f"  {filter_key}控件更新: {actual_min}-{actual_max} (实际数据范围)")
             
             # 更新日期范围
-            if 'sample_date' in df.columns:
-                date_data = pd.to_datetime(df['sample_date'], errors='coerce').dropna()
-                if not date_data.empty:
-                    min_date = date_data.min().date()
-                    max_date = date_data.max().date()
-                    
-                    # 更新日期选择器（如果存在）
-                    if hasattr(self, 'date_start') and hasattr(self, 'date_end'):
-                        self.date_start.setDate(QDate(min_date))
-                        self.date_end.setDate(QDate(max_date))
-            
-                    print(f"  日期范围更新: {min_date} 到 {max_date}")
+            if 'sample_date' in data_ranges:
+                min_date = data_ranges['sample_date']['min'].date()
+                max_date = data_ranges['sample_date']['max'].date()
+                
+                # 更新日期选择器（如果存在）
+                if hasattr(self, 'date_start') and hasattr(self, 'date_end'):
+                    self.date_start.setDate(QDate(min_date))
+                    self.date_end.setDate(QDate(max_date))
+                
+                print(f"  日期范围更新: {min_date} 到 {max_date}")
             
             # 更新未来泌乳天数的默认值和范围
             if hasattr(self, 'future_days_min'):
@@ -5861,7 +5862,7 @@ class MainWindow(QMainWindow):
             import traceback
             traceback.print_exc()
             # 如果出错，使用旧的逻辑作为备份
-            self._update_filter_ranges_fallback(df)
+            self._update_filter_ranges_fallback(self.processor.get_herd_table(self.data_list).frame(internal=False))
     
     def _update_filter_ranges_fallback(self, df):
         """备用的范围更新逻辑"""
@@ -6609,22 +6610,20 @@ class MainWindow(QMainWindow):
                 stats += f"  群体平均值: {individual_avg.mean():.2f}%\n"
                 stats += f"  标准差: {individual_avg.std():.2f}%\n\n"
         
-        # 蛋白率详细统计（仅当有蛋白率数据时显示）
-        protein_columns = [col for col in df.columns if col.endswith('月蛋白率(%)')]
+        # 蛋白率详细统计（仅当有蛋白率数据时显示），各月统计取自月度汇总表
+        protein_stats = report_month_stats(df, 'protein_pct', REPORT_FIELD_NAMES['protein_pct'],
+                                           self.processor.report_aggregates(df))
+        protein_columns = protein_stats is not None
         if protein_columns:
             stats += f"📅 蛋白率月度明细:\n"
-            # 按时间顺序排列月份列
-            sorted_protein_cols = sorted(protein_columns, key=lambda x: x[:7])  # 按YYYY年MM月排序
             
-            for col in sorted_protein_cols:
-                protein_data = df[col].dropna()
-                if not protein_data.empty:
-                    month_name = col.replace('蛋白率(%)', '')
+            for month_name, month in protein_stats.iterrows():
+                if month['count'] > 0:
                     stats += f"  {month_name}:\n"
-                    stats += f"    平均: {protein_data.mean():.2f}%\n"
-                    stats += f"    范围: {protein_data.min():.2f}%-{protein_data.max():.2f}%\n"
-                    stats += f"    标准差: {protein_data.std():.2f}%\n"
-                    stats += f"    样本数: {len(protein_data)}头\n\n"
+                    stats += f"    平均: {month['mean']:.2f}%\n"
+                    stats += f"    范围: {month['min']:.2f}%-{month['max']:.2f}%\n"
+                    stats += f"    标准差: {month['std']:.2f}%\n"
+                    stats += f"    样本数: {int(month['count'])}头\n\n"
         else:
             stats += f"📅 当前筛选结果中无蛋白率数据\n\n"
         
@@ -7633,55 +7632,31 @@ class MainWindow(QMainWindow):
         trait_name = trait_names.get(trait, trait)
         stats_text = f"{trait_name}分析\n\n"
         
-        # 查找对应的月度明细列
-        monthly_columns = []
-        for col in df.columns:
-            if trait == 'protein_pct' and '蛋白率(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'somatic_cell_count' and '体细胞数(万/ml)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'fat_pct' and '乳脂率(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'lactose_pct' and '乳糖率(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'milk_yield' and '产奶量(Kg)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'lactation_days' and '泌乳天数(天)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'solids_pct' and '固形物(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'fat_protein_ratio' and '脂蛋比' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'urea_nitrogen' and '尿素氮(mg/dl)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'total_fat_pct' and '总乳脂(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'total_protein_pct' and '总蛋白(%)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
-            elif trait == 'mature_equivalent' and '成年当量(Kg)' in col and '年' in col and '月' in col:
-                monthly_columns.append(col)
+        # 各月统计取自月度汇总表（没有汇总表时按月度明细列计算）
+        month_stats = None
+        if trait in REPORT_FIELD_NAMES:
+            month_stats = report_month_stats(df, trait, REPORT_FIELD_NAMES[trait],
+                                             self.processor.report_aggregates(df))
+        monthly_columns = [] if month_stats is None else list(month_stats.index)
         
         if not monthly_columns:
             stats_text += f"📊 筛选结果: {len(df)} 条记录\n"
             stats_text += f"❌ 未找到 {trait_name} 的月度数据列\n"
             stats_text += "请确认该性状已包含在筛选结果中。"
         else:
-            # 按时间排序月度列
-            monthly_columns.sort()
-            
             # 基础统计
             stats_text += f"📊 筛选结果: {len(df)} 条记录\n"
             stats_text += f"📅 月度数据: {len(monthly_columns)} 个月\n\n"
             
             # 各月统计
             stats_text += f"📈 各月 {trait_name} 统计:\n"
-            for col in monthly_columns:
-                month_data = df[col].dropna()
-                if len(month_data) > 0:
-                    avg_val = month_data.mean()
-                    min_val = month_data.min()
-                    max_val = month_data.max()
-                    count = len(month_data)
+            for month_name, month in month_stats.iterrows():
+                col = f"{month_name}{REPORT_FIELD_NAMES[trait]}"
+                if month['count'] > 0:
+                    avg_val = month['mean']
+                    min_val = month['min']
+                    max_val = month['max']
+                    count = int(month['count'])
                     
                     # 根据性状类型格式化数值
                     if trait in ['protein_pct', 'fat_pct', 'lactose_pct', 'solids_pct', 'total_fat_pct', 'total_protein_pct']:
@@ -7702,15 +7677,11 @@ class MainWindow(QMainWindow):
                     stats_text += f"  {col}: 无有效数据\n"
             
             # 整体统计
-            all_monthly_data = []
-            for col in monthly_columns:
-                month_data = df[col].dropna()
-                all_monthly_data.extend(month_data.tolist())
-            
-            if all_monthly_data:
-                overall_avg = sum(all_monthly_data) / len(all_monthly_data)
-                overall_min = min(all_monthly_data)
-                overall_max = max(all_monthly_data)
+            data_points = int(month_stats['count'].sum())
+            if data_points:
+                overall_avg = (month_stats['mean'] * month_stats['count']).sum() / data_points
+                overall_min = month_stats['min'].min()
+                overall_max = month_stats['max'].max()
                 
                 stats_text += f"\n🎯 整体 {trait_name} 统计:\n"
                 if trait in ['protein_pct', 'fat_pct', 'lactose_pct', 'solids_pct', 'total_fat_pct', 'total_protein_pct']:
@@ -7735,7 +7706,7 @@ class MainWindow(QMainWindow):
                     stats_text += f"  总体平均: {overall_avg:.2f}\n"
                     stats_text += f"  总体范围: {overall_min:.2f} - {overall_max:.2f}\n"
                 
-                stats_text += f"  有效数据点: {len(all_monthly_data)} 个\n"
+                stats_text += f"  有效数据点: {data_points} 个\n"
         
         widget.setText(stats_text)
     
@@ -9492,21 +9463,25 @@ class MainWindow(QMainWindow):
             # 从监测计算模块导入
             from mastitis_monitoring import MastitisMonitoringCalculator
             
-            # 创建监测计算器
-            self.mastitis_monitoring_calculator = MastitisMonitoringCalculator(scc_threshold=scc_threshold)
-            
-            # 准备DHI数据
-            dhi_data_list = []
-            for item in self.data_list:
-                if item['data'] is not None and not item['data'].empty:
-                    dhi_data_list.append(item['data'])
+            # 创建监测计算器（已有计算器时沿用其月度数据，牛群长表中已加载的文件只合并新增部分）
+            calculator = getattr(self, 'mastitis_monitoring_calculator', None)
+            if isinstance(calculator, MastitisMonitoringCalculator):
+                calculator.set_scc_threshold(scc_threshold)
+                calculator.cattle_basic_info = None
+                calculator.cattle_system_type = None
+            else:
+                calculator = MastitisMonitoringCalculator(scc_threshold=scc_threshold)
+            self.mastitis_monitoring_calculator = calculator
+
+            # 准备DHI数据（与基础筛选共用牛群长表，已整理的文件不会重复处理）
+            herd_table = self.processor.get_herd_table(self.data_list)
             
-            if len(dhi_data_list) == 0:
+            if len(herd_table) == 0:
                 QMessageBox.warning(self, "警告", "没有可用的DHI数据进行分析")
                 return
             
             # 加载DHI数据
-            load_result = self.mastitis_monitoring_calculator.load_dhi_data(dhi_data_list)
+            load_result = self.mastitis_monitoring_calculator.load_dhi_data(herd_table)
             
             if not load_result['success']:
                 QMessageBox.critical(self, "错误", f"DHI数据加载失败: {load_result.get('error', '未知错误')}")
@@ -9695,19 +9670,11 @@ class MainWindow(QMainWindow):
                     multi_item.setToolTip(ftp['multiparous'].get('formula', ''))
                 self.mastitis_monitoring_table.setItem(row, 6, multi_item)
                 
-                # 干奶前流行率（只在最新月份显示）
+                # 干奶前流行率（每个月份按测定日推算在胎天数）
                 pdp = month_data.get('pre_dry_prevalence', {})
-                is_latest_month = (row == len(months) - 1)  # 判断是否为最新月份
                 
-                # 调试输出
-                print(f"🔍 干奶前流行率调试 - 月份: {month}")
-                print(f"   是否最新月份: {is_latest_month}")
-                print(f"   干奶前流行率数据: {pdp}")
-                print(f"   数值: {pdp.get('value')}")
-                print(f"   诊断: {pdp.get('diagnosis')}")
-                
-                if is_latest_month and pdp.get('value') is not None:
-                    # 最新月份且有数值
+                if pdp.get('value') is not None:
+                    # 有数值
                     pdp_value = f"{pdp['value']:.1f}"
                     pdp_item = QTableWidgetItem(pdp_value)
                     
@@ -9723,9 +9690,8 @@ class MainWindow(QMainWindow):
                     # 设置成功计算的颜色
                     pdp_item.setBackground(QColor('#e8f5e8'))  # 浅绿色
                     
-                elif is_latest_month and pdp.get('formula'):
-                    # 最新月份但计算失败，显示具体错误
-                    print(f"   💡 干奶前流行率计算失败，显示N/A")
+                elif pdp.get('formula'):
+                    # 计算失败，显示具体错误
                     pdp_value = "N/A"
                     pdp_item = QTableWidgetItem(pdp_value)
                     
@@ -9745,11 +9711,10 @@ class MainWindow(QMainWindow):
                         pdp_item.setBackground(QColor('#fff3e0'))  # 浅橙色
                         pdp_item.setForeground(QColor('black'))  # 黑色字体
                 else:
-                    # 非最新月份，显示"-"
-                    print(f"   💡 显示'-'，原因: 非最新月份或无数据")
+                    # 无数据，显示"-"
                     pdp_value = "-"
                     pdp_item = QTableWidgetItem(pdp_value)
-                    pdp_item.setToolTip("干奶前流行率只在最新月份计算")
+                    pdp_item.setToolTip("无干奶前流行率数据")
                     pdp_item.setForeground(QColor('black'))  # 黑色字体
                 
                 self.mastitis_monitoring_table.setItem(row, 7, pdp_item)
@@ -10003,6 +9968,35 @@ class MainWindow(QMainWindow):
             self.mastitis_monitoring_calculator.set_scc_threshold(new_threshold)
             logger.info(f"体细胞阈值已更新为: {new_threshold} 万/ml")
     
+    def preview_monitoring_threshold(self, threshold):
+        """阈值调整时实时重绘监测趋势图（表格与公式在重新分析后更新）"""
+        calculator = getattr(self, 'mastitis_monitoring_calculator', None)
+        if not getattr(self, 'mastitis_monitoring_results', None) or calculator is None:
+            return
+        try:
+            sweep = calculator.sweep_scc_thresholds([threshold])
+            if not sweep['success']:
+                return
+            
+            def value(name, month):
+                result = sweep['indicators'][name].loc[month, threshold]
+                return None if pd.isna(result) else result
+            
+            # 整理成趋势图使用的指标结构
+            indicators = {}
+            for month in sweep['months']:
+                indicators[month] = {
+                    name: {'value': value(name, month)}
+                    for name in ('current_prevalence', 'new_infection_rate',
+                                 'chronic_infection_rate', 'chronic_infection_proportion')
+                }
+                indicators[month]['first_test_prevalence'] = {
+                    'primiparous': {'value': value('first_test_primiparous', month)}
+                }
+            self.update_monitoring_chart({'months': sweep['months'], 'indicators': indicators})
+        except Exception as e:
+            logger.error(f"阈值预览失败: {e}")
+    
     def update_monitoring_display(self):
         """更新隐形乳房炎监测显示（重新计算并显示结果）"""
         if hasattr(self, 'mastitis_monitoring_results') and self.mastitis_monitoring_results:
@@ -10442,4 +10436,7 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包后的程序需要支持多进程解析的子进程启动
+    import multiprocessing
+    multiprocessing.freeze_support()
     sys.exit(main())
@@ -0,0 +1,230 @@
+"""
+文件签名模块
+每个上传文件只计算一次签名：牛只管理号集合及其MinHash、采样日期范围、蛋白率统计特征和
+逐行内容哈希。重复文件检测先用MinHash分段(LSH)桶与内容哈希找出候选文件对，再只对候选
+对按签名计算相似度，不再两两重新扫描DataFrame。
+"""
+
+import hashlib
+from collections import defaultdict
+from typing import Dict, Hashable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 参与相似度计算的关键字段及权重
+ID_SIMILARITY_FIELDS = ['farm_id', 'management_id']
+SIMILARITY_FIELD_WEIGHTS = {
+    'farm_id': 0.15,
+    'management_id': 0.25,
+    'sample_date': 0.25,
+    'protein_pct': 0.15
+}
+# 相似度超过该阈值认为是重复数据
+DUPLICATE_THRESHOLD = 0.85
+
+# MinHash：64个哈希函数分为32段、每段2个。其余关键字段完全一致时，管理号集合的Jaccard
+# 系数需大于0.4才可能超过重复阈值；Jaccard=0.4时成为候选的概率约99.6%
+MINHASH_PERMUTATIONS = 64
+LSH_BANDS = 32
+
+_SEEDS = np.random.default_rng(20240615).integers(1, 2 ** 63, MINHASH_PERMUTATIONS, dtype=np.uint64)
+
+
+def _mix(values: np.ndarray) -> np.ndarray:
+    """splitmix64混合（uint64，溢出按模2^64回绕）"""
+    z = values + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def minhash(values: Set[str]) -> Optional[np.ndarray]:
+    """字符串集合的MinHash签名，空集合返回None"""
+    if not values:
+        return None
+    hashes = pd.util.hash_array(np.array(sorted(values), dtype=object))
+    with np.errstate(over='ignore'):
+        return _mix(hashes[None, :] ^ _SEEDS[:, None]).min(axis=1)
+
+
+def _value_stats(series: pd.Series):
+    """数值字段的(样本数, (平均值, 标准差, 最小值, 最大值))；统计失败时为(样本数, None)"""
+    values = series.dropna()
+    if len(values) == 0:
+        return 0, None
+    try:
+        return len(values), (values.mean(), values.std(), values.min(), values.max())
+    except Exception:
+        return len(values), None
+
+
+class FileSignature:
+    """单个文件的签名，相似度只由签名计算"""
+
+    def __init__(self, df: pd.DataFrame):
+        self.rows = len(df)
+        self.columns = set(df.columns)
+        self.id_sets: Dict[str, Set[str]] = {
+            field: set(df[field].dropna().astype(str)) for field in ID_SIMILARITY_FIELDS if field in df.columns
+        }
+        self.management_minhash = minhash(self.id_sets.get('management_id', set()))
+
+        self.date_range: Optional[Tuple[pd.Timestamp, pd.Timestamp]] = None
+        self.date_error = False
+        if 'sample_date' in df.columns:
+            try:
+                dates = pd.to_datetime(df['sample_date'], errors='coerce').dropna()
+                if len(dates) > 0:
+                    self.date_range = (dates.min(), dates.max())
+            except Exception:
+                self.date_error = True
+
+        self.protein_stats = _value_stats(df['protein_pct']) if 'protein_pct' in df.columns else None
+
+        # 逐行内容哈希（含列名与类型），相等即为完全重复
+        try:
+            digest = hashlib.sha1(repr([(str(col), str(dtype)) for col, dtype in df.dtypes.items()]).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(df, index=False).to_numpy().tobytes())
+            self.content_hash: Optional[str] = digest.hexdigest()
+        except TypeError:
+            self.content_hash = None
+
+    def band_keys(self) -> List[Tuple[int, bytes]]:
+        """LSH分段桶键"""
+        if self.management_minhash is None:
+            return []
+        rows_per_band = MINHASH_PERMUTATIONS // LSH_BANDS
+        return [(band, self.management_minhash[band * rows_per_band:(band + 1) * rows_per_band].tobytes())
+                for band in range(LSH_BANDS)]
+
+
+def _date_similarity(sig1: FileSignature, sig2: FileSignature) -> float:
+    if sig1.date_error or sig2.date_error or sig1.date_range is None or sig2.date_range is None:
+        return 0.0
+    try:
+        range1, range2 = sig1.date_range, sig2.date_range
+        # 计算日期范围重叠度
+        overlap_start = max(range1[0], range2[0])
+        overlap_end = min(range1[1], range2[1])
+        if overlap_start > overlap_end:
+            return 0.0
+        overlap_days = (overlap_end - overlap_start).days + 1
+        total_days = max((range1[1] - range1[0]).days + 1, (range2[1] - range2[0]).days + 1)
+        return overlap_days / total_days if total_days > 0 else 0.0
+    except Exception:
+        return 0.0
+
+
+def _stats_similarity(stats1, stats2) -> float:
+    (count1, values1), (count2, values2) = stats1, stats2
+    if count1 == 0 or count2 == 0:
+        return 1.0 if count1 == 0 and count2 == 0 else 0.0
+    if values1 is None or values2 is None:
+        return 0.0
+    try:
+        # 统计特征（平均值、标准差、最小值、最大值）的相对差异
+        stat_similarities = []
+        for s1, s2 in zip(values1, values2):
+            if pd.notna(s1) and pd.notna(s2) and max(abs(s1), abs(s2)) > 0:
+                diff = abs(s1 - s2) / max(abs(s1), abs(s2))
+                stat_similarities.append(1.0 - min(diff, 1.0))
+            else:
+                stat_similarities.append(1.0 if pd.isna(s1) and pd.isna(s2) else 0.0)
+        return sum(stat_similarities) / len(stat_similarities) if stat_similarities else 0.0
+    except Exception:
+        return 0.0
+
+
+def signature_similarity(sig1: FileSignature, sig2: FileSignature) -> Dict:
+    """两个文件签名的相似度：行数占20%，关键字段（ID重叠、日期范围重叠、蛋白率统计）加权占80%"""
+    details = {}
+    similarity_scores = []
+
+    # 1. 数据行数相似度
+    max_rows = max(sig1.rows, sig2.rows)
+    row_similarity = 1.0 - (abs(sig1.rows - sig2.rows) / max_rows) if max_rows > 0 else 0.0
+    details['row_count'] = {
+        'df1_rows': sig1.rows,
+        'df2_rows': sig2.rows,
+        'similarity': row_similarity
+    }
+    similarity_scores.append(row_similarity * 0.2)
+
+    # 2. 关键字段的相似度（两个文件都有该字段时才比较）
+    field_similarities = {}
+    for field in SIMILARITY_FIELD_WEIGHTS:
+        if field not in sig1.columns or field not in sig2.columns:
+            continue
+        if field in ID_SIMILARITY_FIELDS:
+            values1, values2 = sig1.id_sets[field], sig2.id_sets[field]
+            if values1 and values2:
+                union = len(values1 | values2)
+                field_similarities[field] = len(values1 & values2) / union if union > 0 else 0.0
+            else:
+                field_similarities[field] = 0.0
+        elif field == 'sample_date':
+            field_similarities[field] = _date_similarity(sig1, sig2)
+        else:
+            field_similarities[field] = _stats_similarity(sig1.protein_stats, sig2.protein_stats)
+    details['field_similarities'] = field_similarities
+
+    # 3. 加权平均
+    if field_similarities:
+        weighted_sum = 0.0
+        total_weight = 0.0
+        for field, similarity in field_similarities.items():
+            weight = SIMILARITY_FIELD_WEIGHTS.get(field, 0.1)
+            weighted_sum += similarity * weight
+            total_weight += weight
+        field_similarity_score = weighted_sum / total_weight if total_weight > 0 else 0.0
+        similarity_scores.append(field_similarity_score * 0.8)
+
+    final_score = sum(similarity_scores)
+    details['final_score'] = final_score
+    details['threshold'] = DUPLICATE_THRESHOLD
+
+    return {
+        'is_duplicate': final_score > DUPLICATE_THRESHOLD,
+        'score': final_score,
+        'details': details
+    }
+
+
+class SignatureIndex:
+    """按LSH分段桶与内容哈希索引文件签名，查询可能重复的候选文件
+
+    没有管理号的文件无法分桶，与所有文件互为候选。
+    """
+
+    def __init__(self):
+        self._signatures: Dict[Hashable, FileSignature] = {}
+        self._buckets: Dict[Tuple, List[Hashable]] = defaultdict(list)
+        self._unbanded: List[Hashable] = []
+
+    def add(self, key: Hashable, signature: FileSignature) -> None:
+        self._signatures[key] = signature
+        if signature.content_hash is not None:
+            self._buckets[('content', signature.content_hash)].append(key)
+        band_keys = signature.band_keys()
+        if not band_keys:
+            self._unbanded.append(key)
+        for band_key in band_keys:
+            self._buckets[band_key].append(key)
+
+    def candidates(self, key: Hashable) -> Set[Hashable]:
+        """与给定文件共享任一桶的文件（不含自身）"""
+        signature = self._signatures[key]
+        found = set(self._buckets.get(('content', signature.content_hash), ()))
+        band_keys = signature.band_keys()
+        if band_keys:
+            for band_key in band_keys:
+                found.update(self._buckets.get(band_key, ()))
+            found.update(self._unbanded)
+        else:
+            found.update(self._signatures)
+        found.discard(key)
+        return found
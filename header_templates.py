@@ -0,0 +1,150 @@
+"""
+表头模板注册表模块
+同一化验室每月产出的报表表头布局相同：按表头指纹记住表头所在行和列名→字段映射，
+之后指纹相同的文件直接按模板读取，跳过表头检测与列名匹配
+"""
+
+import hashlib
+import json
+import os
+import time
+from typing import Dict, Iterable, List, Optional
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 注册表内容格式版本
+TEMPLATE_FORMAT_VERSION = 1
+
+# 最多保留的模板数（按最近使用淘汰）
+MAX_TEMPLATES = 200
+
+# 模板命中时更新最近使用时间，写回注册表的最短间隔（秒），避免每个文件都重写注册表
+TOUCH_SAVE_INTERVAL = 60.0
+
+
+def header_fingerprint(columns: Iterable) -> str:
+    """表头指纹：按顺序拼接去除首尾空白的列名后取SHA-1"""
+    text = '\x1f'.join(str(column).strip() for column in columns)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+class HeaderTemplateRegistry:
+    """持久化的表头模板注册表（JSON文件，多进程解析时以文件修改时间感知更新）"""
+
+    def __init__(self, registry_path: str, rules_version: str):
+        self.registry_path = registry_path
+        self.rules_version = rules_version
+        self.templates: Dict[str, Dict] = {}
+        self._loaded_mtime: Optional[float] = None
+        # 尚未写回的命中记录（指纹 -> 最近使用时间）
+        self._touched: Dict[str, float] = {}
+        self._touch_saved_at = 0.0
+        self._load()
+
+    def _load(self) -> None:
+        """读取注册表；规则版本不一致时丢弃旧模板"""
+        try:
+            mtime = os.path.getmtime(self.registry_path)
+        except OSError:
+            return
+        if mtime == self._loaded_mtime:
+            return
+
+        try:
+            with open(self.registry_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"读取表头模板注册表失败，将重新建立: {e}")
+            return
+
+        self._loaded_mtime = mtime
+        if payload.get('version') != TEMPLATE_FORMAT_VERSION or payload.get('rules_version') != self.rules_version:
+            logger.info("解析规则已变化，忽略已有的表头模板")
+            self.templates = {}
+            return
+        self.templates = payload.get('templates', {})
+        for fingerprint, used in self._touched.items():
+            template = self.templates.get(fingerprint)
+            if template is not None and used > template.get('last_used', 0):
+                template['last_used'] = used
+
+    def _save(self) -> None:
+        """原子写入注册表"""
+        os.makedirs(os.path.dirname(self.registry_path) or '.', exist_ok=True)
+        payload = {
+            'version': TEMPLATE_FORMAT_VERSION,
+            'rules_version': self.rules_version,
+            'templates': self.templates,
+        }
+        tmp_path = f"{self.registry_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(payload, f, ensure_ascii=False)
+            os.replace(tmp_path, self.registry_path)
+            self._loaded_mtime = os.path.getmtime(self.registry_path)
+            self._touched.clear()
+            self._touch_saved_at = time.time()
+        except OSError as e:
+            logger.warning(f"保存表头模板注册表失败: {e}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def header_rows(self) -> List[int]:
+        """已知模板的表头行位置，最近使用的在前"""
+        self._load()
+        ordered = sorted(self.templates.values(), key=lambda template: template.get('last_used', 0), reverse=True)
+        rows = []
+        for template in ordered:
+            if template['header_row'] not in rows:
+                rows.append(template['header_row'])
+        return rows
+
+    def lookup(self, columns: Iterable, header_row: int) -> Optional[Dict]:
+        """按实际读到的列名查找模板（表头行位置也必须一致），命中时更新最近使用时间"""
+        self._load()
+        fingerprint = header_fingerprint(columns)
+        template = self.templates.get(fingerprint)
+        if template is None or template['header_row'] != header_row:
+            return None
+        now = time.time()
+        template['last_used'] = now
+        self._touched[fingerprint] = now
+        if now - self._touch_saved_at >= TOUCH_SAVE_INTERVAL:
+            self.flush()
+        return template
+
+    def flush(self) -> None:
+        """写回尚未保存的命中记录（先合并其他进程已写入的模板）"""
+        if not self._touched:
+            return
+        self._load()
+        self._save()
+
+    def register(self, columns: Iterable, header_row: int, rename: Dict[str, str]) -> None:
+        """记录一个已通过校验的表头布局"""
+        self._load()
+        fingerprint = header_fingerprint(columns)
+        existing = self.templates.get(fingerprint)
+        if existing and existing['header_row'] == header_row and existing['rename'] == rename:
+            return
+
+        self.templates[fingerprint] = {
+            'header_row': header_row,
+            'rename': rename,
+            'last_used': time.time(),
+        }
+        if len(self.templates) > MAX_TEMPLATES:
+            oldest = sorted(self.templates, key=lambda key: self.templates[key].get('last_used', 0))
+            for key in oldest[:len(self.templates) - MAX_TEMPLATES]:
+                del self.templates[key]
+        self._save()
+        logger.info(f"已登记表头模板: 第{header_row + 1}行，{len(rename)}个字段映射")
+
+    def clear(self) -> None:
+        self.templates = {}
+        self._touched.clear()
+        if os.path.exists(self.registry_path):
+            os.remove(self.registry_path)
+        self._loaded_mtime = None
@@ -0,0 +1,311 @@
+"""
+牛群长表模块
+把上传的各月DHI数据合并为一张长表：整数牛只键、预先计算的月份列和来源文件列，
+文件到达时增量构建，供各类筛选与分析直接使用，避免各自重复合并数据
+"""
+
+import hashlib
+import weakref
+from collections import OrderedDict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 长表附加的内部列，分析结果返回前应去除
+INTERNAL_COLUMNS = ['cow_key', 'month']
+
+# 牛只标识字段
+ID_FIELDS = ['farm_id', 'management_id']
+
+
+def normalize_id_series(series: pd.Series) -> pd.Series:
+    """将牛场编号/管理号统一为字符串，缺失值（含'nan'/'None'）统一为None"""
+    values = series.astype(object)
+    values = values.where(values.notna(), None)
+    is_text = values.map(lambda value: isinstance(value, str))
+    if not is_text.all():
+        values = values.where(is_text | values.isna(), values.astype(str))
+    return values.where(~values.isin(['nan', 'None']), None)
+
+
+def format_months(month: pd.Series, fmt: str = '%Y-%m') -> pd.Series:
+    """把月份Period列格式化为字符串，每个不同月份只格式化一次"""
+    codes, uniques = pd.factorize(month)
+    labels = np.array([period.strftime(fmt) for period in uniques] + [np.nan], dtype=object)
+    return pd.Series(labels[codes], index=month.index)
+
+
+class HerdTable:
+    """增量构建的牛群长表
+
+    每个文件单独整理一次（ID标准化、月份、来源文件、牛只键），之后只在文件新增或
+    被替换时重新整理；合并结果按文件组合缓存。
+    """
+
+    def __init__(self, stats_fields: Optional[List[str]] = None):
+        """
+        Args:
+            stats_fields: 文件统计中汇总的数值字段，None表示文件中所有数值类型的列
+        """
+        self.stats_fields = stats_fields
+        self._parts: "OrderedDict[str, Dict]" = OrderedDict()
+        self._cow_keys: Dict[Tuple[Optional[str], str], int] = {}
+        self._combined_key: Optional[Tuple[str, ...]] = None
+        self._combined: Optional[pd.DataFrame] = None
+        # 内容变化时递增，供依赖长表的缓存判断是否失效
+        self.version = 0
+
+    def _invalidate(self) -> None:
+        self._combined_key = None
+        self._combined = None
+        self.version += 1
+
+    @staticmethod
+    def _fingerprint(df: pd.DataFrame) -> Tuple:
+        """识别数据是否被替换：源对象的弱引用（按is比较，不依赖可能被复用的id）、行数、列"""
+        return weakref.ref(df), len(df), tuple(df.columns)
+
+    @staticmethod
+    def _is_same_source(fingerprint: Tuple, df: pd.DataFrame) -> bool:
+        source, length, columns = fingerprint
+        return source() is df and length == len(df) and columns == tuple(df.columns)
+
+    def __len__(self) -> int:
+        return sum(len(part['frame']) for part in self._parts.values())
+
+    @property
+    def filenames(self) -> List[str]:
+        return list(self._parts.keys())
+
+    @property
+    def cow_count(self) -> int:
+        return len(self._cow_keys)
+
+    def _assign_cow_keys(self, df: pd.DataFrame) -> np.ndarray:
+        """为(牛场编号, 管理号)分配全局整数键，管理号缺失的行为-1"""
+        if 'management_id' not in df.columns:
+            return np.full(len(df), -1, dtype=np.int32)
+
+        mgmt_codes, mgmt_uniques = pd.factorize(df['management_id'])
+        if 'farm_id' in df.columns:
+            farm_codes, farm_uniques = pd.factorize(df['farm_id'])
+        else:
+            farm_codes, farm_uniques = np.full(len(df), -1), []
+
+        # 两列编码合成一个局部编码，再映射为全局键
+        combined = (farm_codes.astype(np.int64) + 1) * (len(mgmt_uniques) + 1) + mgmt_codes
+        local_codes, local_uniques = pd.factorize(combined)
+        local_keys = np.empty(len(local_uniques), dtype=np.int32)
+        for i, value in enumerate(local_uniques):
+            farm_code, mgmt_code = divmod(int(value), len(mgmt_uniques) + 1)
+            if mgmt_code >= len(mgmt_uniques):
+                local_keys[i] = -1
+                continue
+            farm = farm_uniques[farm_code - 1] if farm_code > 0 else None
+            pair = (farm, mgmt_uniques[mgmt_code])
+            key = self._cow_keys.get(pair)
+            if key is None:
+                key = len(self._cow_keys)
+                self._cow_keys[pair] = key
+            local_keys[i] = key
+        return local_keys[local_codes]
+
+    def _prepare(self, filename: str, df: pd.DataFrame) -> pd.DataFrame:
+        """整理单个文件：ID标准化、来源文件、月份与牛只键"""
+        # 浅拷贝：未改动的列与原数据共享内存，新增/标准化的列整列替换，不影响原数据
+        frame = df.copy(deep=False)
+        frame['source_file'] = filename
+
+        for field in ID_FIELDS:
+            if field in frame.columns:
+                frame[field] = normalize_id_series(frame[field])
+
+        if 'sample_date' in frame.columns:
+            frame['month'] = pd.to_datetime(frame['sample_date'], errors='coerce').dt.to_period('M')
+            frame['year_month'] = format_months(frame['month'])
+
+        frame['cow_key'] = self._assign_cow_keys(frame)
+        return frame
+
+    def _file_stats(self, frame: pd.DataFrame) -> Dict:
+        """单个文件的统计：各数值字段的样本数/最小值/最大值/合计、管理号、牛只数、月份与采样日期范围"""
+        fields = self.stats_fields
+        if fields is None:
+            fields = [col for col in frame.columns
+                      if pd.api.types.is_numeric_dtype(frame[col]) and col not in INTERNAL_COLUMNS]
+
+        field_stats = {}
+        for field in fields:
+            if field not in frame.columns:
+                continue
+            values = pd.to_numeric(frame[field], errors='coerce').dropna()
+            if values.dtype == np.float32:
+                # 与展示一致：单精度值按6位小数还原
+                values = values.astype('float64').round(6)
+            if len(values) == 0:
+                continue
+            field_stats[field] = {
+                'count': len(values),
+                'min': float(values.min()),
+                'max': float(values.max()),
+                'sum': float(values.sum()),
+            }
+
+        management_ids = np.empty(0, dtype=object)
+        if 'management_id' in frame.columns:
+            management_ids = np.array(sorted(frame['management_id'].dropna().unique()), dtype=object)
+
+        sample_dates = None
+        if 'sample_date' in frame.columns:
+            dates = pd.to_datetime(frame['sample_date'], errors='coerce').dropna()
+            if not dates.empty:
+                sample_dates = (dates.min(), dates.max())
+
+        return {
+            'fields': field_stats,
+            'management_ids': management_ids,
+            'cow_count': int(np.unique(frame['cow_key'][frame['cow_key'] >= 0]).size),
+            'months': set(frame['year_month'].dropna()) if 'year_month' in frame.columns else set(),
+            'sample_dates': sample_dates,
+        }
+
+    def add_file(self, filename: str, df: pd.DataFrame) -> None:
+        """新增或替换一个文件的数据（同时计算文件统计）"""
+        frame = self._prepare(filename, df)
+        self._parts[filename] = {
+            'fingerprint': self._fingerprint(df),
+            'frame': frame,
+            'stats': self._file_stats(frame),
+        }
+        self._invalidate()
+
+    def remove_file(self, filename: str) -> None:
+        if self._parts.pop(filename, None) is not None:
+            self._invalidate()
+
+    def sync(self, data_list: List[Dict]) -> 'HerdTable':
+        """与data_list对齐：只整理新增或被替换的文件，移除已不存在的文件，顺序与data_list一致"""
+        present = []
+        changed = False
+        for item in data_list:
+            df = item.get('data')
+            if df is None:
+                continue
+            filename = item['filename']
+            present.append(filename)
+            part = self._parts.get(filename)
+            if part is None or not self._is_same_source(part['fingerprint'], df):
+                self.add_file(filename, df)
+                changed = True
+
+        for filename in [name for name in self._parts if name not in present]:
+            self.remove_file(filename)
+            changed = True
+
+        if list(self._parts.keys()) != present:
+            self._parts = OrderedDict((name, self._parts[name]) for name in present)
+            changed = True
+
+        if changed:
+            self._invalidate()
+            logger.info(f"牛群长表已更新：{len(self._parts)}个文件，{len(self)}行，{self.cow_count}头牛")
+        return self
+
+    def file_frames(self, filenames: Optional[List[str]] = None) -> Iterator[Tuple[str, pd.DataFrame]]:
+        """按上传顺序逐个返回已整理的文件数据（只读）"""
+        for name, part in self._parts.items():
+            if filenames is None or name in filenames:
+                yield name, part['frame']
+
+    def file_months(self, filename: str) -> List[str]:
+        """某个文件覆盖的月份（YYYY-MM，已排序）"""
+        part = self._parts.get(filename)
+        if part is None:
+            return []
+        return sorted(part['stats']['months'])
+
+    def file_stats(self, filename: str) -> Optional[Dict]:
+        """某个文件的统计（只读）"""
+        part = self._parts.get(filename)
+        return part['stats'] if part is not None else None
+
+    def management_ids(self, filenames: Optional[List[str]] = None) -> np.ndarray:
+        """所选文件中出现的全部管理号（去重）"""
+        arrays = [self._parts[name]['stats']['management_ids'] for name, _ in self.file_frames(filenames)]
+        arrays = [array for array in arrays if len(array)]
+        if not arrays:
+            return np.empty(0, dtype=object)
+        return np.unique(np.concatenate(arrays))
+
+    def merged_stats(self, filenames: Optional[List[str]] = None) -> Dict:
+        """合并所选文件的统计，不读取行数据
+
+        Returns:
+            fields: 字段 -> {count, min, max, sum}；months: 全部月份；sample_dates: (最早, 最晚)或None
+        """
+        fields: Dict[str, Dict] = {}
+        months = set()
+        sample_dates = None
+        for name, _ in self.file_frames(filenames):
+            stats = self._parts[name]['stats']
+            months |= stats['months']
+            if stats['sample_dates'] is not None:
+                if sample_dates is None:
+                    sample_dates = stats['sample_dates']
+                else:
+                    sample_dates = (min(sample_dates[0], stats['sample_dates'][0]),
+                                    max(sample_dates[1], stats['sample_dates'][1]))
+            for field, item in stats['fields'].items():
+                merged = fields.get(field)
+                if merged is None:
+                    fields[field] = dict(item)
+                else:
+                    merged['count'] += item['count']
+                    merged['min'] = min(merged['min'], item['min'])
+                    merged['max'] = max(merged['max'], item['max'])
+                    merged['sum'] += item['sum']
+        return {'fields': fields, 'months': sorted(months), 'sample_dates': sample_dates}
+
+    def file_digest(self, filename: str) -> Optional[str]:
+        """文件内容摘要（列名、类型与逐行哈希），首次使用时计算，文件被替换后重新计算"""
+        part = self._parts.get(filename)
+        if part is None:
+            return None
+        if 'digest' not in part:
+            frame = part['frame']
+            digest = hashlib.sha1()
+            digest.update(repr([(str(col), str(dtype)) for col, dtype in frame.dtypes.items()]).encode('utf-8'))
+            digest.update(pd.util.hash_pandas_object(frame, index=False).to_numpy().tobytes())
+            part['digest'] = digest.hexdigest()
+        return part['digest']
+
+    def months(self, filenames: Optional[List[str]] = None) -> List[str]:
+        """所选文件覆盖的全部月份（YYYY-MM，已排序）"""
+        months = set()
+        for name, _ in self.file_frames(filenames):
+            months.update(self.file_months(name))
+        return sorted(months)
+
+    def frame(self, filenames: Optional[List[str]] = None, internal: bool = True, copy: bool = True) -> pd.DataFrame:
+        """返回所选文件的合并长表
+
+        Args:
+            filenames: 文件名列表，None表示全部文件
+            internal: 是否包含cow_key/month内部列
+            copy: 为False时返回缓存的合并结果本身，调用方不得修改
+        """
+        names = tuple(name for name, _ in self.file_frames(filenames))
+        if names != self._combined_key:
+            frames = [self._parts[name]['frame'] for name in names]
+            self._combined = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+            self._combined_key = names
+
+        combined = self._combined
+        if not internal:
+            combined = combined.drop(columns=[col for col in INTERNAL_COLUMNS if col in combined.columns])
+            return combined
+        return combined.copy() if copy else combined
@@ -0,0 +1,168 @@
+"""
+数据规范化模块
+解析后的原始表格在一个阶段内完成规范化：汇总行过滤（合并为单个正则）、
+按field_schema转换类型（识别化验室占位符）、采样日期按检测出的格式解析并缓存
+"""
+
+import re
+import sys
+from functools import lru_cache
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 化验室报表中表示“无结果”的占位符
+DEFAULT_PLACEHOLDERS = ['-', '--', '—', '——', '－', '/', '／', 'NA', 'N/A', '#N/A']
+
+# 采样日期候选格式（按常见程度排序）
+DATE_FORMAT_CANDIDATES = [
+    '%Y-%m-%d', '%Y/%m/%d', '%Y-%m-%d %H:%M:%S', '%Y/%m/%d %H:%M:%S',
+    '%Y%m%d', '%Y.%m.%d', '%Y年%m月%d日', '%m/%d/%Y',
+]
+
+# 检测日期格式时抽取的样本数
+DATE_SAMPLE_SIZE = 20
+
+# 字符串字段中视为缺失的值
+_MISSING_TEXT = ['nan', 'None', '']
+
+
+@lru_cache(maxsize=32)
+def compile_summary_pattern(keywords: Tuple[str, ...]) -> Optional['re.Pattern']:
+    """把汇总行关键字合并为一个忽略大小写的正则"""
+    if not keywords:
+        return None
+    return re.compile('|'.join(f'(?:{keyword})' for keyword in keywords), re.IGNORECASE)
+
+
+def map_unique(series: pd.Series, func) -> pd.Series:
+    """只对不同的值计算一次func，再按编码展开回原来的行（缺失值保持缺失）"""
+    codes, uniques = pd.factorize(series)
+    mapped = func(pd.Series(uniques, dtype=object))
+    missing = pd.Series([None], dtype=object) if mapped.dtype == object else pd.Series([pd.NA]).astype(mapped.dtype)
+    result = pd.concat([mapped, missing], ignore_index=True).take(codes)
+    return pd.Series(result.to_numpy(), index=series.index, dtype=mapped.dtype)
+
+
+def intern_strings(values: pd.Series) -> pd.Series:
+    """相同字符串复用同一个对象（每个不同值只intern一次）"""
+    codes, uniques = pd.factorize(values)
+    interned = np.array([sys.intern(value) for value in uniques] + [None], dtype=object)
+    return pd.Series(interned[codes], index=values.index)
+
+
+class IngestNormalizer:
+    """按rules.yaml编译的规范化阶段：汇总行过滤、类型转换、日期解析"""
+
+    def __init__(self, field_schema: Dict[str, str], placeholders: Optional[List[str]] = None):
+        self.field_schema = field_schema
+        self.placeholders = list(DEFAULT_PLACEHOLDERS if placeholders is None else placeholders)
+        # 字段 -> 上次成功的日期格式，下一个文件优先尝试
+        self.date_formats: Dict[str, str] = {}
+
+    def filter_summary_rows(self, df: pd.DataFrame, id_column: str, keywords: List[str]) -> pd.DataFrame:
+        """一次匹配过滤ID列中包含任一汇总关键字的行"""
+        pattern = compile_summary_pattern(tuple(keywords))
+        if pattern is None or df.empty:
+            return df
+        # 每个不同的ID只匹配一次
+        codes, uniques = pd.factorize(df[id_column].astype(str))
+        is_summary = pd.Series(uniques, dtype=object).str.contains(pattern, na=False).to_numpy()
+        return df[~is_summary[codes]].copy()
+
+    def detect_date_format(self, field: str, text: pd.Series) -> Optional[str]:
+        """从文本样本中检测日期格式，优先使用缓存的格式"""
+        sample = text.dropna().head(DATE_SAMPLE_SIZE).str.strip()
+        if sample.empty:
+            return None
+
+        cached = self.date_formats.get(field)
+        candidates = ([cached] if cached else []) + [fmt for fmt in DATE_FORMAT_CANDIDATES if fmt != cached]
+        for fmt in candidates:
+            if pd.to_datetime(sample, format=fmt, errors='coerce').notna().all():
+                self.date_formats[field] = fmt
+                return fmt
+        return None
+
+    def parse_dates(self, series: pd.Series, field: str) -> pd.Series:
+        """解析日期列：已是日期类型直接返回，否则按检测到的格式一次性解析"""
+        if pd.api.types.is_datetime64_any_dtype(series):
+            return series.astype('datetime64[ns]')
+
+        if pd.api.types.infer_dtype(series, skipna=True) == 'string':
+            # 一个报表通常只有少数几个采样日期，只解析不同的值
+            fmt = self.detect_date_format(field, series)
+            if fmt is not None:
+                return map_unique(series, lambda text: self._parse_date_text(text.str.strip(), fmt, field))
+        # 混合了Excel日期单元格与文本，交给pandas识别
+        return pd.to_datetime(series, errors='coerce')
+
+    def _parse_date_text(self, text: pd.Series, fmt: str, field: str) -> pd.Series:
+        """按检测出的格式解析；样本之外还有其他格式的值时，这些值逐个识别格式（占位符仍为缺失）"""
+        parsed = pd.to_datetime(text, format=fmt, errors='coerce')
+        failed = parsed.isna() & text.notna() & (text != '') & ~text.isin(self.placeholders)
+        if failed.any():
+            parsed[failed] = pd.to_datetime(text[failed], format='mixed', errors='coerce')
+            logger.info(f"字段 {field} 有{int(failed.sum())}个值不符合格式{fmt}，已逐个识别")
+        return parsed
+
+    def coerce_numeric(self, series: pd.Series, field: str) -> Tuple[pd.Series, int]:
+        """数值转换：占位符视为缺失，返回(结果, 占位符个数)"""
+        if series.dtype != object:
+            return pd.to_numeric(series, errors='coerce'), 0
+
+        numeric = pd.to_numeric(series, errors='coerce')
+        failed = series[numeric.isna() & series.notna()]
+        if failed.empty:
+            return numeric, 0
+
+        # 只对转换失败的少量值区分占位符与异常值
+        failed_text = failed.astype(str).str.strip()
+        is_placeholder = failed_text.isin(self.placeholders) | (failed_text == '')
+        placeholder_count = int(is_placeholder.sum())
+        unexpected = failed_text[~is_placeholder]
+        if not unexpected.empty:
+            logger.warning(f"字段 {field} 有{len(unexpected)}个无法识别的值，已按缺失处理，例如: {unexpected.unique()[:3].tolist()}")
+        return numeric, placeholder_count
+
+    def cast_series(self, series: pd.Series, field: str, dtype: str) -> Tuple[pd.Series, int]:
+        """按字段类型定义转换单列，返回(结果, 占位符个数)"""
+        if dtype in ('string', 'interned_string', 'category'):
+            # 先转换为字符串，保留前导零
+            values = series.astype(object).where(series.notna(), None).astype(str)
+            # 移除'nan'/'None'及空字符串
+            values = values.where(~values.isin(_MISSING_TEXT), None)
+            if dtype == 'interned_string':
+                # 相同管理号复用同一个字符串对象
+                values = intern_strings(values)
+            elif dtype == 'category':
+                values = values.astype('category')
+            return values, 0
+
+        if dtype.startswith('datetime64'):
+            return self.parse_dates(series, field), 0
+
+        numeric, placeholder_count = self.coerce_numeric(series, field)
+        if dtype.startswith('Int') or dtype.startswith('UInt'):
+            valid = numeric.dropna()
+            if not valid.empty and not (valid == valid.round()).all():
+                logger.warning(f"字段 {field} 含有非整数值，保留为浮点型")
+                return numeric.astype('float64'), placeholder_count
+            info = np.iinfo(dtype.lower())
+            if not valid.empty and (valid.min() < info.min or valid.max() > info.max):
+                logger.warning(f"字段 {field} 超出{dtype}范围，改用Int64")
+                return numeric.astype('Int64'), placeholder_count
+        return numeric.astype(dtype), placeholder_count
+
+    def cast_frame(self, df: pd.DataFrame) -> Dict[str, int]:
+        """按field_schema原地转换所有已存在的字段，返回各字段的占位符个数"""
+        placeholder_counts = {}
+        for field, dtype in self.field_schema.items():
+            if field not in df.columns:
+                continue
+            df[field], placeholder_counts[field] = self.cast_series(df[field], field, dtype)
+        return {field: count for field, count in placeholder_counts.items() if count}
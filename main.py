@@ -39,4 +39,7 @@ def main():
 
 
 if __name__ == "__main__":
+    # 打包后的程序需要支持多进程解析的子进程启动
+    import multiprocessing
+    multiprocessing.freeze_support()
     sys.exit(main())
\ No newline at end of file
@@ -9,11 +9,255 @@
 import pandas as pd
 import numpy as np
 from datetime import datetime
-from typing import Dict, List, Tuple, Optional, Any
+from typing import Dict, List, Tuple, Optional, Any, Union
 import logging
 
+from herd_table import HerdTable, format_months
+
 logger = logging.getLogger(__name__)
 
+# 牛群长表附加的列，不进入月度数据
+HERD_COLUMNS = ['source_file', 'year_month', 'cow_key', 'month']
+# 合并月度数据时临时使用的月份列
+MONTH_COLUMN = '_month'
+
+
+# 首测流行率的泌乳天数范围
+FIRST_TEST_DIM_RANGE = (5, 35)
+# 干奶前牛只：测定时在胎天数超过该值
+PRE_DRY_GESTATION_DAYS = 180
+
+
+class CowMonthMatrix:
+    """牛只×月份体细胞数矩阵，月度数据加载后构建，之后追加的月份只编码新月份
+    
+    各月记录按(牛只, 月份)编码，体细胞数、胎次、泌乳天数是与编码平行的数组。按阈值把记录
+    计入牛只×月份的计数矩阵后，各月指标是按月计数，两月间指标是相邻两列逐元素相乘再求和。
+    标准化管理号同月重复时单元计数大于1，与按管理号合并两月数据时的配对行数一致。
+    """
+    
+    def __init__(self, monthly_data: Dict[str, pd.DataFrame]):
+        self.months: List[str] = []
+        self.frames: List[pd.DataFrame] = []
+        self.month_index: Dict[str, int] = {}
+        self.columns: List[set] = []
+        self._bounds = [0]  # 各月记录在平行数组中的起止位置
+        self._cow_values = pd.Index([], dtype=object)
+        self.month = np.empty(0, dtype=np.intp)
+        self.cow = np.empty(0, dtype=np.intp)
+        self.scc = np.empty(0)
+        self.parity = np.empty(0)
+        self.lactation_days = np.empty(0)
+        self._counts: Dict[float, Dict[str, Any]] = {}
+        # 阈值扫描用的预排序数据，按月份/相邻月份逐个补齐
+        self._sorted_months: List[Dict[str, Any]] = []
+        self._sorted_pairs: List[Dict[str, Any]] = []
+        self._append(monthly_data, sorted(monthly_data))
+    
+    @property
+    def cow_count(self) -> int:
+        return len(self._cow_values)
+    
+    def _append(self, monthly_data: Dict[str, pd.DataFrame], months: List[str]):
+        """在末尾追加月份：只编码新月份的记录，已有月份的编码与预排序数据保留"""
+        start = len(self.months)
+        frames = [monthly_data[month] for month in months]
+        self.months = self.months + months
+        self.frames = self.frames + frames
+        self.month_index = {month: position for position, month in enumerate(self.months)}
+        self.columns = self.columns + [set(frame.columns) for frame in frames]
+        for frame in frames:
+            self._bounds.append(self._bounds[-1] + len(frame))
+        
+        lengths = [len(frame) for frame in frames]
+        cow_ids = np.concatenate([frame['management_id_standardized'].to_numpy(dtype=object)
+                                  for frame in frames] + [np.empty(0, dtype=object)])
+        cows = self._cow_values.get_indexer(cow_ids)
+        unknown = cows < 0
+        if unknown.any():
+            codes, values = pd.factorize(cow_ids[unknown], use_na_sentinel=False)
+            cows[unknown] = codes + self.cow_count
+            self._cow_values = self._cow_values.append(pd.Index(values, dtype=object))
+        
+        self.month = np.concatenate([self.month, np.repeat(np.arange(start, len(self.months)), lengths)])
+        self.cow = np.concatenate([self.cow, cows])
+        self.scc = np.concatenate([self.scc, self._values(frames, 'somatic_cell_count')])
+        self.parity = np.concatenate([self.parity, self._values(frames, 'parity')])
+        self.lactation_days = np.concatenate([self.lactation_days, self._values(frames, 'lactation_days')])
+        # 按阈值的计数涉及矩阵形状，整体重算
+        self._counts = {}
+    
+    @staticmethod
+    def _values(frames: List[pd.DataFrame], column: str) -> np.ndarray:
+        """某字段按记录顺序展开为浮点数组，缺该字段的月份为NaN"""
+        return np.concatenate([
+            frame[column].to_numpy(dtype=float, na_value=np.nan) if column in frame.columns
+            else np.full(len(frame), np.nan)
+            for frame in frames
+        ] + [np.empty(0)])
+    
+    def extend(self, monthly_data: Dict[str, pd.DataFrame]) -> bool:
+        """月度数据只是在最后一个月之后追加了月份时，就地追加并返回True"""
+        months = sorted(monthly_data)
+        if len(months) <= len(self.months) or months[:len(self.months)] != self.months:
+            return False
+        if not all(monthly_data[month] is frame for month, frame in zip(self.months, self.frames)):
+            return False
+        self._append(monthly_data, months[len(self.months):])
+        return True
+    
+    def matches(self, monthly_data: Dict[str, pd.DataFrame]) -> bool:
+        """矩阵是否由当前的月度数据构建"""
+        return len(monthly_data) == len(self.frames) and all(
+            monthly_data.get(month) is frame for month, frame in zip(self.months, self.frames))
+    
+    def _month_counts(self, mask: np.ndarray) -> np.ndarray:
+        return np.bincount(self.month[mask], minlength=len(self.months))
+    
+    def _cell_counts(self, mask: np.ndarray) -> np.ndarray:
+        cells = self.cow[mask] * len(self.months) + self.month[mask]
+        return np.bincount(cells, minlength=self.cow_count * len(self.months)).reshape(self.cow_count, len(self.months))
+    
+    def counts(self, threshold: float) -> Dict[str, Any]:
+        """按阈值计数（按阈值缓存）：各月计数向量、牛只×月份计数矩阵、相邻月份的配对计数"""
+        if threshold in self._counts:
+            return self._counts[threshold]
+        
+        high = self.scc > threshold
+        low = self.scc <= threshold
+        dim_low, dim_high = FIRST_TEST_DIM_RANGE
+        first_test = (self.lactation_days >= dim_low) & (self.lactation_days <= dim_high)
+        primiparous = first_test & (self.parity == 1)
+        multiparous = first_test & (self.parity > 1)
+        month = {
+            'valid': self._month_counts(~np.isnan(self.scc)),
+            'high': self._month_counts(high),
+            'first_test': self._month_counts(first_test),
+            'primiparous': self._month_counts(primiparous),
+            'primiparous_high': self._month_counts(primiparous & high),
+            'multiparous': self._month_counts(multiparous),
+            'multiparous_high': self._month_counts(multiparous & high),
+        }
+        cells = {
+            'rows': self._cell_counts(np.ones(len(self.scc), dtype=bool)),
+            'high': self._cell_counts(high),
+            'low': self._cell_counts(low),
+        }
+        positions = np.arange(len(self.months))
+        counts = {
+            'month': month,
+            'cells': cells,
+            'adjacent': self._pair_counts(cells, positions[:-1], positions[1:]),
+        }
+        self._counts[threshold] = counts
+        return counts
+    
+    @staticmethod
+    def _pair_counts(cells: Dict[str, np.ndarray], prev: np.ndarray, curr: np.ndarray) -> Dict[str, np.ndarray]:
+        """若干(上月, 当月)列对的配对计数，每个列对一个值"""
+        rows, high, low = cells['rows'], cells['high'], cells['low']
+        return {
+            'overlap': ((rows[:, prev] > 0) & (rows[:, curr] > 0)).sum(axis=0),
+            'low_prev': (low[:, prev] * rows[:, curr]).sum(axis=0),
+            'new_infections': (low[:, prev] * high[:, curr]).sum(axis=0),
+            'high_prev': (high[:, prev] * rows[:, curr]).sum(axis=0),
+            'chronic': (high[:, prev] * high[:, curr]).sum(axis=0),
+        }
+    
+    def month_counts(self, threshold: float, month: str) -> Dict[str, np.int64]:
+        """某月的计数"""
+        position = self.month_index[month]
+        return {name: values[position] for name, values in self.counts(threshold)['month'].items()}
+    
+    def pair_counts(self, threshold: float, prev_month: str, curr_month: str) -> Dict[str, np.int64]:
+        """两个月之间的配对计数；相邻月份直接取整体计算的结果"""
+        counts = self.counts(threshold)
+        prev, curr = self.month_index[prev_month], self.month_index[curr_month]
+        if curr == prev + 1:
+            return {name: values[prev] for name, values in counts['adjacent'].items()}
+        pair = self._pair_counts(counts['cells'], np.array([prev]), np.array([curr]))
+        return {name: values[0] for name, values in pair.items()}
+    
+    def _sorted_month(self, position: int) -> Dict[str, Any]:
+        """某月的有效体细胞数，以及首测头胎/经产牛的体细胞数与头数"""
+        rows = slice(self._bounds[position], self._bounds[position + 1])
+        scc, lactation_days, parity = self.scc[rows], self.lactation_days[rows], self.parity[rows]
+        dim_low, dim_high = FIRST_TEST_DIM_RANGE
+        first_test = (lactation_days >= dim_low) & (lactation_days <= dim_high)
+        valid = ~np.isnan(scc)
+        entry = {'valid': np.sort(scc[valid])}
+        for name, mask in (('primiparous', first_test & (parity == 1)), ('multiparous', first_test & (parity > 1))):
+            entry[name] = np.sort(scc[mask & valid])
+            # 首测牛只的分母包含体细胞数缺失的记录
+            entry[f'{name}_total'] = int(mask.sum())
+        return entry
+    
+    def _sorted_pair(self, position: int) -> Dict[str, Any]:
+        """第position月与下一月按牛只配对：重叠牛只数，上月的值、当月缺失的配对中上月的值、
+        两月都有效的配对中两月的较大值与较小值"""
+        prev_rows = slice(self._bounds[position], self._bounds[position + 1])
+        curr_rows = slice(self._bounds[position + 1], self._bounds[position + 2])
+        merged = pd.DataFrame({'cow': self.cow[prev_rows], 'prev': self.scc[prev_rows]}).merge(
+            pd.DataFrame({'cow': self.cow[curr_rows], 'curr': self.scc[curr_rows]}), on='cow')
+        prev, curr = merged['prev'].to_numpy(), merged['curr'].to_numpy()
+        has_prev, has_curr = ~np.isnan(prev), ~np.isnan(curr)
+        both = has_prev & has_curr
+        return {
+            'overlap': merged['cow'].nunique(),
+            'prev': np.sort(prev[has_prev]),
+            'prev_without_curr': np.sort(prev[has_prev & ~has_curr]),
+            'both_max': np.sort(np.maximum(prev[both], curr[both])),
+            'both_min': np.sort(np.minimum(prev[both], curr[both])),
+        }
+    
+    def _sorted_values(self) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """阈值扫描用的预排序体细胞数（与阈值无关），只补齐尚未排序的月份与相邻月份"""
+        for position in range(len(self._sorted_months), len(self.months)):
+            self._sorted_months.append(self._sorted_month(position))
+        for position in range(len(self._sorted_pairs), len(self.months) - 1):
+            self._sorted_pairs.append(self._sorted_pair(position))
+        return self._sorted_months, self._sorted_pairs
+    
+    def sweep_counts(self, thresholds: np.ndarray) -> Dict[str, np.ndarray]:
+        """多个阈值下的计数，各月计数为(月份数, 阈值数)，相邻月份计数为(月份数-1, 阈值数)
+        
+        每个计数都是在预排序数组上二分查找"≤阈值"的个数，与逐个阈值计算的结果一致。
+        """
+        thresholds = np.asarray(thresholds, dtype=float)
+        months, pairs = self._sorted_values()
+        
+        def at_most(values_list: List[np.ndarray]) -> np.ndarray:
+            return np.array([np.searchsorted(values, thresholds, side='right') for values in values_list],
+                            dtype=np.int64).reshape(len(values_list), len(thresholds))
+        
+        def sizes(values_list: List[np.ndarray]) -> np.ndarray:
+            return np.array([len(values) for values in values_list], dtype=np.int64)[:, None]
+        
+        def repeat(values: List[int]) -> np.ndarray:
+            return np.repeat(np.asarray(values, dtype=np.int64).reshape(-1, 1), len(thresholds), axis=1)
+        
+        valid = [month['valid'] for month in months]
+        counts = {
+            'valid': repeat([len(values) for values in valid]),
+            'high': sizes(valid) - at_most(valid),
+        }
+        for name in ('primiparous', 'multiparous'):
+            values_list = [month[name] for month in months]
+            counts[name] = repeat([month[f'{name}_total'] for month in months])
+            counts[f'{name}_high'] = sizes(values_list) - at_most(values_list)
+        
+        prev = [pair['prev'] for pair in pairs]
+        both_min = [pair['both_min'] for pair in pairs]
+        prev_low = at_most(prev)
+        counts['overlap'] = repeat([pair['overlap'] for pair in pairs])
+        counts['low_prev'] = prev_low
+        counts['high_prev'] = sizes(prev) - prev_low
+        # 上月≤阈值且当月>阈值 = 上月≤阈值 - 两月都≤阈值 - 当月缺失
+        counts['new_infections'] = (prev_low - at_most([pair['both_max'] for pair in pairs])
+                                    - at_most([pair['prev_without_curr'] for pair in pairs]))
+        counts['chronic'] = sizes(both_min) - at_most(both_min)
+        return counts
+
 
 class MastitisMonitoringCalculator:
     """隐性乳房炎月度监测计算器"""
@@ -30,34 +274,78 @@ class MastitisMonitoringCalculator:
         self.cattle_basic_info = None  # 牛群基础信息
         self.cattle_system_type = None  # 牛群信息系统类型
         self.results = {}  # 存储计算结果
+        self._matrix = None  # 牛只×月份体细胞数矩阵，随月度数据重建
+        self._indicator_cache = {}  # 按月份/相邻月份缓存的指标结果，阈值或该月数据变化后重算
+        self._pre_dry_cache = None  # 各测定记录推算到测定日的在胎天数，随月度数据与牛群信息重建
+        self._reset_dhi_data()
     
     def set_scc_threshold(self, threshold: float):
         """设置体细胞数阈值"""
         self.scc_threshold = threshold
         logger.info(f"体细胞数阈值已设置为: {threshold}万/ml")
     
-    def load_dhi_data(self, dhi_data_list: List[pd.DataFrame]) -> Dict[str, Any]:
+    def load_dhi_data(self, dhi_data_list: Union[List[pd.DataFrame], HerdTable]) -> Dict[str, Any]:
         """
         加载DHI数据并按月份分组
         
+        传入牛群长表时，如果上次加载的文件仍按原顺序排在长表开头，只把新增文件合并进
+        涉及的月份；否则清空后重新加载。
+        
         Args:
-            dhi_data_list: DHI数据DataFrame列表
+            dhi_data_list: DHI数据DataFrame列表，或牛群长表（直接使用其月份列）
             
         Returns:
             处理结果字典
         """
+        if isinstance(dhi_data_list, HerdTable):
+            frames = [frame for _, frame in dhi_data_list.file_frames()]
+            loaded = len(self._loaded_frames)
+            if 0 < loaded <= len(frames) and all(a is b for a, b in zip(frames, self._loaded_frames)):
+                logger.info(f"牛群长表的前{loaded}个文件已加载，只合并新增的{len(frames) - loaded}个文件")
+                return self._add_dhi_frames(frames[loaded:], HERD_COLUMNS)
+            self._reset_dhi_data()
+            return self._add_dhi_frames(frames, HERD_COLUMNS)
+        self._reset_dhi_data()
+        return self._add_dhi_frames(list(dhi_data_list), [])
+    
+    def add_dhi_data(self, dhi_data_list: Union[List[pd.DataFrame], HerdTable]) -> Dict[str, Any]:
+        """
+        增量加载DHI数据：新文件的记录只合并进其涉及的月份，其余月份保持不变
+        
+        同一头牛同月的记录与已加载数据一起去重，采样日期相同时以后加载的文件为准。
+        
+        Args:
+            dhi_data_list: DHI数据DataFrame列表，或牛群长表
+            
+        Returns:
+            处理结果字典（文件计数为累计值）
+        """
+        if isinstance(dhi_data_list, HerdTable):
+            return self._add_dhi_frames([frame for _, frame in dhi_data_list.file_frames()], HERD_COLUMNS)
+        return self._add_dhi_frames(list(dhi_data_list), [])
+    
+    def _reset_dhi_data(self):
+        """清空已加载的月度数据"""
+        self.monthly_data = {}
+        self._loaded_frames = []
+        self._file_counts = {'total': 0, 'processed': 0, 'skipped': 0}
+    
+    def _add_dhi_frames(self, dhi_data_list: List[pd.DataFrame], herd_columns: List[str]) -> Dict[str, Any]:
+        """校验各文件并提取有效记录，再合并进月度数据"""
         try:
-            self.monthly_data = {}
-            total_files = len(dhi_data_list)
-            processed_files = 0
-            skipped_files = 0
+            counts = self._file_counts
+            offset = counts['total']
+            counts['total'] += len(dhi_data_list)
+            total_files = counts['total']
             
-            logger.info(f"开始加载DHI数据，共{total_files}个数据文件")
+            logger.info(f"开始加载DHI数据，共{len(dhi_data_list)}个数据文件")
             
-            for i, df in enumerate(dhi_data_list):
+            parts = []
+            for i, df in enumerate(dhi_data_list, start=offset):
+                self._loaded_frames.append(df)
                 if df.empty:
                     logger.warning(f"数据文件{i+1}为空，跳过")
-                    skipped_files += 1
+                    counts['skipped'] += 1
                     continue
                 
                 logger.info(f"处理数据文件{i+1}/{total_files}，包含{len(df)}行数据")
@@ -90,49 +378,39 @@ class MastitisMonitoringCalculator:
                             logger.info(f"  - {missing_field} 可能的相似字段: {similar_fields}")
                         else:
                             logger.info(f"  - {missing_field} 未找到相似字段")
-                    skipped_files += 1
+                    counts['skipped'] += 1
                     continue
                 
                 logger.info(f"数据文件{i+1}字段检查通过，开始按月份分组")
                 
-                # 按月份分组
-                df['sample_date'] = pd.to_datetime(df['sample_date'], errors='coerce')
-                invalid_dates = df['sample_date'].isna().sum()
+                # 按月份分组（不修改传入的DataFrame）
+                sample_dates = df['sample_date']
+                if not pd.api.types.is_datetime64_any_dtype(sample_dates):
+                    sample_dates = pd.to_datetime(sample_dates, errors='coerce')
+                valid_dates = sample_dates.notna()
+                invalid_dates = len(df) - int(valid_dates.sum())
                 if invalid_dates > 0:
                     logger.warning(f"数据文件{i+1}有{invalid_dates}行无效日期，将被忽略")
                 
-                df = df.dropna(subset=['sample_date'])
-                
-                if df.empty:
+                if invalid_dates == len(df):
                     logger.warning(f"数据文件{i+1}过滤无效日期后为空，跳过")
-                    skipped_files += 1
+                    counts['skipped'] += 1
                     continue
                 
-                months_in_file = 0
-                for month, group_df in df.groupby(df['sample_date'].dt.to_period('M')):
-                    month_str = str(month)  # 格式: 2025-01
-                    months_in_file += 1
-                    
-                    # 处理同月多次测定：按采样日期排序，取最后一次
-                    processed_df = self._process_monthly_duplicates(group_df)
-                    
-                    # 标准化管理号
-                    processed_df = self._standardize_management_ids(processed_df)
-                    
-                    # 如果已存在该月份数据，合并
-                    if month_str in self.monthly_data:
-                        existing_df = self.monthly_data[month_str]
-                        combined_df = pd.concat([existing_df, processed_df], ignore_index=True)
-                        # 再次处理重复数据
-                        self.monthly_data[month_str] = self._process_monthly_duplicates(combined_df)
-                        logger.info(f"月份{month_str}：合并数据，共{len(self.monthly_data[month_str])}头牛")
-                    else:
-                        self.monthly_data[month_str] = processed_df
-                        logger.info(f"月份{month_str}：新增数据，{len(processed_df)}头牛")
+                df = df[valid_dates].assign(sample_date=sample_dates[valid_dates])
+                month_key = df['month'] if herd_columns and 'month' in df.columns else df['sample_date'].dt.to_period('M')
+                months = format_months(month_key)  # 格式: 2025-01
+                part = df.drop(columns=[col for col in herd_columns if col in df.columns])
+                # 没有管理号的记录无法归到牛只，不参与月度数据
+                part = self._standardize_management_ids(part[part['management_id'].notna()])
+                part[MONTH_COLUMN] = months
+                parts.append(part)
                 
-                logger.info(f"数据文件{i+1}处理完成，包含{months_in_file}个月份的数据")
-                processed_files += 1
+                logger.info(f"数据文件{i+1}处理完成，包含{months.nunique()}个月份的数据")
+                counts['processed'] += 1
             
+            processed_files = counts['processed']
+            skipped_files = counts['skipped']
             if processed_files == 0:
                 error_msg = f"所有{total_files}个数据文件都无法处理"
                 if skipped_files > 0:
@@ -146,6 +424,9 @@ class MastitisMonitoringCalculator:
                     'skipped_files': skipped_files
                 }
             
+            if parts:
+                self._merge_monthly_parts(parts)
+            
             final_months = sorted(self.monthly_data.keys())
             total_records = sum(len(df) for df in self.monthly_data.values())
             
@@ -252,53 +533,52 @@ class MastitisMonitoringCalculator:
                 'indicators': {}
             }
             
-            # 计算各个指标
+            # 计算各个指标（只重算阈值或数据有变化的月份，新增月份时只计算该月及其与上月的指标）
+            cache = {}
             for month in months:
                 month_results = {}
                 
                 # 指标1: 当月流行率
-                month_results['current_prevalence'] = self._calculate_current_prevalence(month)
+                month_results['current_prevalence'] = self._cached_indicator(
+                    cache, 'current_prevalence', (month,), self._calculate_current_prevalence)
                 
                 # 指标5: 头胎/经产首测流行率
-                month_results['first_test_prevalence'] = self._calculate_first_test_prevalence(month)
+                month_results['first_test_prevalence'] = self._cached_indicator(
+                    cache, 'first_test_prevalence', (month,), self._calculate_first_test_prevalence)
                 
                 results['indicators'][month] = month_results
             
             # 计算需要两个月数据的指标
             if month_count >= 2:
                 for i in range(1, len(months)):
-                    current_month = months[i]
-                    previous_month = months[i-1]
+                    pair = (months[i-1], months[i])
+                    current_results = results['indicators'][months[i]]
                     
                     # 指标2: 新发感染率
-                    results['indicators'][current_month]['new_infection_rate'] = self._calculate_new_infection_rate(
-                        previous_month, current_month)
+                    current_results['new_infection_rate'] = self._cached_indicator(
+                        cache, 'new_infection_rate', pair, self._calculate_new_infection_rate)
                     
                     # 指标3: 慢性感染率
-                    results['indicators'][current_month]['chronic_infection_rate'] = self._calculate_chronic_infection_rate(
-                        previous_month, current_month)
+                    current_results['chronic_infection_rate'] = self._cached_indicator(
+                        cache, 'chronic_infection_rate', pair, self._calculate_chronic_infection_rate)
                     
                     # 指标4: 慢性感染牛占比
-                    results['indicators'][current_month]['chronic_infection_proportion'] = self._calculate_chronic_infection_proportion(
-                        previous_month, current_month)
-            
-            # 计算干奶前流行率（只计算最新月份）
-            latest_month = months[-1]
-            print(f"\n🔍 准备计算干奶前流行率 - 最新月份: {latest_month}")
-            print(f"   牛群基础信息状态: {self.cattle_basic_info is not None}")
-            print(f"   牛群信息数量: {len(self.cattle_basic_info) if self.cattle_basic_info is not None else 0}")
+                    current_results['chronic_infection_proportion'] = self._cached_indicator(
+                        cache, 'chronic_infection_proportion', pair, self._calculate_chronic_infection_proportion)
+            self._indicator_cache = cache
             
+            # 计算干奶前流行率（所有月份一次计算）
             if self.cattle_basic_info is not None:
-                print(f"   ✅ 开始计算干奶前流行率...")
-                results['indicators'][latest_month]['pre_dry_prevalence'] = self._calculate_pre_dry_prevalence(latest_month)
+                for month in months:
+                    results['indicators'][month]['pre_dry_prevalence'] = self._calculate_pre_dry_prevalence(month)
             else:
-                print(f"   ❌ 跳过干奶前流行率计算：未加载牛群基础信息")
-                # 为了调试，我们仍然添加一个空的结果
-                results['indicators'][latest_month]['pre_dry_prevalence'] = {
-                    'value': None,
-                    'formula': '📋 无法计算干奶前流行率 - 未加载牛群基础信息',
-                    'diagnosis': '未加载牛群基础信息'
-                }
+                logger.info("未加载牛群基础信息，跳过干奶前流行率计算")
+                for month in months:
+                    results['indicators'][month]['pre_dry_prevalence'] = {
+                        'value': None,
+                        'formula': '📋 无法计算干奶前流行率 - 未加载牛群基础信息',
+                        'diagnosis': '未加载牛群基础信息'
+                    }
             
             self.results = results
             return results
@@ -310,18 +590,127 @@ class MastitisMonitoringCalculator:
                 'error': str(e)
             }
     
-    def _process_monthly_duplicates(self, month_df: pd.DataFrame) -> pd.DataFrame:
-        """处理同月多次测定：取最后一次记录"""
-        # 按管理号分组，每组按采样日期排序取最后一条
-        result_rows = []
+    def _cached_indicator(self, cache: Dict, name: str, months: Tuple[str, ...], calculate) -> Dict[str, Any]:
+        """取缓存的指标结果；阈值或所用月份的数据对象变化时重新计算，结果写入本次的缓存"""
+        # 阈值按公式中显示的文本比较，20与20.0的公式不同
+        threshold = f'{self.scc_threshold}'
+        frames = tuple(self.monthly_data[month] for month in months)
+        key = (name, months)
+        entry = self._indicator_cache.get(key)
+        if entry is not None and entry[0] == threshold and all(a is b for a, b in zip(entry[1], frames)):
+            result = entry[2]
+        else:
+            result = calculate(*months)
+        cache[key] = (threshold, frames, result)
+        return result
+    
+    def sweep_scc_thresholds(self, thresholds) -> Dict[str, Any]:
+        """
+        一次计算多个体细胞数阈值下各月的指标值，用于阈值曲线和调整阈值时的实时预览
+        
+        体细胞数在月度数据加载后预排序一次，之后每次扫描只做二分查找，不改变当前阈值。
+        各阈值下的值与按该阈值调用calculate_all_indicators的value一致。
+        
+        Args:
+            thresholds: 体细胞数阈值（万/ml）列表
+            
+        Returns:
+            结果字典，indicators中每个指标是行为月份、列为阈值的DataFrame（%），无法计算为NaN
+        """
+        try:
+            if not self.monthly_data:
+                return {
+                    'success': False,
+                    'error': '没有可用的DHI数据'
+                }
+            
+            thresholds = list(thresholds)
+            matrix = self._cow_month_matrix()
+            counts = matrix.sweep_counts(thresholds)
+            months = matrix.months
+            
+            def rate(numerator, denominator, valid=None):
+                valid = denominator > 0 if valid is None else valid & (denominator > 0)
+                with np.errstate(divide='ignore', invalid='ignore'):
+                    values = np.where(valid, (numerator / denominator) * 100, np.nan)
+                return values
+            
+            def month_frame(values):
+                return pd.DataFrame(values, index=months, columns=thresholds)
+            
+            def pair_frame(values):
+                # 第一个月没有上月数据
+                return pd.DataFrame(np.vstack([np.full((1, len(thresholds)), np.nan), values]),
+                                    index=months, columns=thresholds)
+            
+            total_current = counts['valid'][1:]
+            indicators = {
+                'current_prevalence': month_frame(rate(counts['high'], counts['valid'])),
+                'new_infection_rate': pair_frame(rate(counts['new_infections'], counts['low_prev'])),
+                'chronic_infection_rate': pair_frame(rate(counts['chronic'], counts['high_prev'])),
+                'chronic_infection_proportion': pair_frame(
+                    rate(counts['chronic'], total_current, counts['overlap'] > 0)),
+                'first_test_primiparous': month_frame(rate(counts['primiparous_high'], counts['primiparous'])),
+                'first_test_multiparous': month_frame(rate(counts['multiparous_high'], counts['multiparous'])),
+            }
+            
+            return {
+                'success': True,
+                'months': months,
+                'thresholds': thresholds,
+                'indicators': indicators
+            }
+            
+        except Exception as e:
+            logger.error(f"阈值扫描失败: {e}")
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def _merge_monthly_parts(self, parts: List[pd.DataFrame]):
+        """把新文件的记录合并进月度数据，只重建涉及的月份
         
-        for management_id, group in month_df.groupby('management_id'):
-            # 按采样日期排序，取最后一条记录
-            sorted_group = group.sort_values('sample_date')
-            last_record = sorted_group.iloc[-1]
-            result_rows.append(last_record)
+        parts中每个DataFrame带有月份列，已标准化管理号；已有月份的数据排在新记录之前参与去重。
+        """
+        affected = sorted(set().union(*(part[MONTH_COLUMN].unique() for part in parts)))
+        sources = [self.monthly_data[month].assign(**{MONTH_COLUMN: month})
+                   for month in affected if month in self.monthly_data] + parts
+        
+        # 每个月份保留出现过该月份的所有来源的列，顺序与依次合并时一致
+        month_columns = {month: {} for month in affected}
+        for source in sources:
+            for month in source[MONTH_COLUMN].unique():
+                month_columns[month].update(dict.fromkeys(source.columns.drop(MONTH_COLUMN)))
+        
+        keys = pd.concat([
+            pd.DataFrame({
+                MONTH_COLUMN: source[MONTH_COLUMN].to_numpy(),
+                'management_id': source['management_id'].to_numpy(),
+                'sample_date': source['sample_date'].to_numpy(),
+                'source': number,
+                'row': np.arange(len(source)),
+            })
+            for number, source in enumerate(sources)
+        ], ignore_index=True)
+        kept = self._process_monthly_duplicates(keys)
+        kept['rank'] = np.arange(len(kept))
         
-        return pd.DataFrame(result_rows).reset_index(drop=True)
+        for month, month_keys in kept.groupby(MONTH_COLUMN, sort=True):
+            pieces = [sources[number].iloc[rows['row'].to_numpy()]
+                      for number, rows in month_keys.groupby('source', sort=True)]
+            ranks = np.concatenate([rows['rank'].to_numpy() for _, rows in month_keys.groupby('source', sort=True)])
+            month_df = pieces[0] if len(pieces) == 1 else pd.concat(pieces)
+            month_df = month_df.iloc[np.argsort(ranks, kind='stable')]
+            month_df = month_df.reindex(columns=list(month_columns[month])).reset_index(drop=True)
+            action = '合并数据，共' if month in self.monthly_data else '新增数据，'
+            self.monthly_data[month] = month_df
+            logger.info(f"月份{month}：{action}{len(month_df)}头牛")
+    
+    def _process_monthly_duplicates(self, rows: pd.DataFrame) -> pd.DataFrame:
+        """处理同月多次测定：按(月份, 管理号, 采样日期)稳定排序后，每头牛每月保留最后一条记录"""
+        ordered = rows.sort_values([MONTH_COLUMN, 'management_id', 'sample_date'], kind='stable')
+        return ordered.drop_duplicates(subset=[MONTH_COLUMN, 'management_id'], keep='last').reset_index(drop=True)
     
     def _standardize_management_ids(self, df: pd.DataFrame) -> pd.DataFrame:
         """标准化管理号：去除前导0"""
@@ -392,15 +781,22 @@ class MastitisMonitoringCalculator:
             # 如果日期处理出错，返回简单的结果
             return {'is_continuous': True, 'missing_months': []}
     
+    def _cow_month_matrix(self) -> CowMonthMatrix:
+        """当前月度数据的牛只×月份矩阵，月度数据变化后重新构建"""
+        if self._matrix is None or not (self._matrix.matches(self.monthly_data)
+                                        or self._matrix.extend(self.monthly_data)):
+            self._matrix = CowMonthMatrix(self.monthly_data)
+        return self._matrix
+    
     def _calculate_current_prevalence(self, month: str) -> Dict[str, Any]:
         """计算当月流行率"""
         try:
-            df = self.monthly_data[month]
+            counts = self._cow_month_matrix().month_counts(self.scc_threshold, month)
             
-            # 过滤有效的体细胞数据
-            valid_scc = df['somatic_cell_count'].dropna()
+            # 有效的体细胞数据
+            total_count = int(counts['valid'])
             
-            if len(valid_scc) == 0:
+            if total_count == 0:
                 return {
                     'value': None,
                     'formula': f'无法计算 - {month}月DHI数据中无有效体细胞数据',
@@ -408,8 +804,7 @@ class MastitisMonitoringCalculator:
                     'denominator': 0
                 }
             
-            high_scc_count = (valid_scc > self.scc_threshold).sum()
-            total_count = len(valid_scc)
+            high_scc_count = counts['high']
             prevalence = (high_scc_count / total_count) * 100
             
             formula = f'体细胞数(万/ml)>{self.scc_threshold}的牛头数({high_scc_count}) ÷ {month}月参测牛头数({total_count}) = {prevalence:.1f}%'
@@ -433,10 +828,12 @@ class MastitisMonitoringCalculator:
     def _calculate_first_test_prevalence(self, month: str) -> Dict[str, Any]:
         """计算头胎/经产首测流行率"""
         try:
-            df = self.monthly_data[month]
+            matrix = self._cow_month_matrix()
+            columns = matrix.columns[matrix.month_index[month]]
+            counts = matrix.month_counts(self.scc_threshold, month)
             
             # 筛选DIM 5-35天的牛只
-            if 'lactation_days' not in df.columns:
+            if 'lactation_days' not in columns:
                 return {
                     'primiparous': {
                         'value': None,
@@ -453,9 +850,7 @@ class MastitisMonitoringCalculator:
                 }
             
             # 筛选泌乳天数5-35天
-            dim_filtered = df[(df['lactation_days'] >= 5) & (df['lactation_days'] <= 35)].copy()
-            
-            if len(dim_filtered) == 0:
+            if counts['first_test'] == 0:
                 return {
                     'primiparous': {
                         'value': None,
@@ -471,11 +866,13 @@ class MastitisMonitoringCalculator:
                     }
                 }
             
+            if 'parity' not in columns:
+                raise KeyError('parity')
+            
             # 头胎牛 (胎次=1)
-            primiparous = dim_filtered[dim_filtered['parity'] == 1]
-            if len(primiparous) > 0:
-                primi_high_scc = (primiparous['somatic_cell_count'] > self.scc_threshold).sum()
-                primi_total = len(primiparous)
+            primi_total = int(counts['primiparous'])
+            if primi_total > 0:
+                primi_high_scc = counts['primiparous_high']
                 primi_prevalence = (primi_high_scc / primi_total) * 100
                 primi_formula = f'(胎次=1 且 DIM5-35天 且 SCC>{self.scc_threshold}的牛头数({primi_high_scc})) ÷ (胎次=1 且 DIM5-35天的参测牛头数({primi_total})) = {primi_prevalence:.1f}%'
             else:
@@ -485,10 +882,9 @@ class MastitisMonitoringCalculator:
                 primi_total = 0
             
             # 经产牛 (胎次>1)
-            multiparous = dim_filtered[dim_filtered['parity'] > 1]
-            if len(multiparous) > 0:
-                multi_high_scc = (multiparous['somatic_cell_count'] > self.scc_threshold).sum()
-                multi_total = len(multiparous)
+            multi_total = int(counts['multiparous'])
+            if multi_total > 0:
+                multi_high_scc = counts['multiparous_high']
                 multi_prevalence = (multi_high_scc / multi_total) * 100
                 multi_formula = f'(胎次>1 且 DIM5-35天 且 SCC>{self.scc_threshold}的牛头数({multi_high_scc})) ÷ (胎次>1 且 DIM5-35天的参测牛头数({multi_total})) = {multi_prevalence:.1f}%'
             else:
@@ -529,36 +925,11 @@ class MastitisMonitoringCalculator:
                 }
             }
     
-    def _get_overlapping_cattle(self, month1: str, month2: str) -> Tuple[pd.DataFrame, int, List[str]]:
-        """获取两个月重叠的牛只数据"""
-        df1 = self.monthly_data[month1]
-        df2 = self.monthly_data[month2]
-        
-        # 获取重叠的管理号
-        ids1 = set(df1['management_id_standardized'])
-        ids2 = set(df2['management_id_standardized'])
-        overlapping_ids = ids1.intersection(ids2)
-        
-        if len(overlapping_ids) == 0:
-            return pd.DataFrame(), 0, []
-        
-        # 获取重叠牛只的数据
-        overlap_df1 = df1[df1['management_id_standardized'].isin(overlapping_ids)].copy()
-        overlap_df2 = df2[df2['management_id_standardized'].isin(overlapping_ids)].copy()
-        
-        # 合并数据
-        merged_df = overlap_df1.merge(
-            overlap_df2, 
-            on='management_id_standardized', 
-            suffixes=('_prev', '_curr')
-        )
-        
-        return merged_df, len(overlapping_ids), list(overlapping_ids)
-    
     def _calculate_new_infection_rate(self, prev_month: str, curr_month: str) -> Dict[str, Any]:
         """计算新发感染率"""
         try:
-            merged_df, overlap_count, _ = self._get_overlapping_cattle(prev_month, curr_month)
+            counts = self._cow_month_matrix().pair_counts(self.scc_threshold, prev_month, curr_month)
+            overlap_count = int(counts['overlap'])
             
             if overlap_count == 0:
                 return {
@@ -571,10 +942,9 @@ class MastitisMonitoringCalculator:
                 }
             
             # 筛选条件：上月SCC≤阈值的牛只
-            prev_low_scc = merged_df['somatic_cell_count_prev'] <= self.scc_threshold
-            eligible_cattle = merged_df[prev_low_scc]
+            total_eligible = int(counts['low_prev'])
             
-            if len(eligible_cattle) == 0:
+            if total_eligible == 0:
                 return {
                     'value': None,
                     'formula': f'无法计算 - {prev_month}月所有重叠牛只SCC均>{self.scc_threshold}万/ml',
@@ -585,8 +955,7 @@ class MastitisMonitoringCalculator:
                 }
             
             # 计算新发感染：当月SCC>阈值 且 上月SCC≤阈值
-            new_infections = (eligible_cattle['somatic_cell_count_curr'] > self.scc_threshold).sum()
-            total_eligible = len(eligible_cattle)
+            new_infections = counts['new_infections']
             
             if total_eligible > 0:
                 new_infection_rate = (new_infections / total_eligible) * 100
@@ -623,7 +992,8 @@ class MastitisMonitoringCalculator:
     def _calculate_chronic_infection_rate(self, prev_month: str, curr_month: str) -> Dict[str, Any]:
         """计算慢性感染率"""
         try:
-            merged_df, overlap_count, _ = self._get_overlapping_cattle(prev_month, curr_month)
+            counts = self._cow_month_matrix().pair_counts(self.scc_threshold, prev_month, curr_month)
+            overlap_count = int(counts['overlap'])
             
             if overlap_count == 0:
                 return {
@@ -636,10 +1006,9 @@ class MastitisMonitoringCalculator:
                 }
             
             # 筛选条件：上月SCC>阈值的牛只
-            prev_high_scc = merged_df['somatic_cell_count_prev'] > self.scc_threshold
-            eligible_cattle = merged_df[prev_high_scc]
+            total_eligible = int(counts['high_prev'])
             
-            if len(eligible_cattle) == 0:
+            if total_eligible == 0:
                 return {
                     'value': None,
                     'formula': f'无法计算 - {prev_month}月无SCC>{self.scc_threshold}万/ml的重叠牛只',
@@ -650,8 +1019,7 @@ class MastitisMonitoringCalculator:
                 }
             
             # 计算慢性感染：当月SCC>阈值 且 上月SCC>阈值
-            chronic_infections = (eligible_cattle['somatic_cell_count_curr'] > self.scc_threshold).sum()
-            total_eligible = len(eligible_cattle)
+            chronic_infections = counts['chronic']
             
             chronic_infection_rate = (chronic_infections / total_eligible) * 100
             
@@ -685,7 +1053,8 @@ class MastitisMonitoringCalculator:
     def _calculate_chronic_infection_proportion(self, prev_month: str, curr_month: str) -> Dict[str, Any]:
         """计算慢性感染牛占比"""
         try:
-            merged_df, overlap_count, _ = self._get_overlapping_cattle(prev_month, curr_month)
+            counts = self._cow_month_matrix().pair_counts(self.scc_threshold, prev_month, curr_month)
+            overlap_count = int(counts['overlap'])
             
             if overlap_count == 0:
                 return {
@@ -698,16 +1067,11 @@ class MastitisMonitoringCalculator:
                 }
             
             # 计算慢性感染牛：当月SCC>阈值 且 上月SCC>阈值
-            chronic_condition = (
-                (merged_df['somatic_cell_count_curr'] > self.scc_threshold) &
-                (merged_df['somatic_cell_count_prev'] > self.scc_threshold)
-            )
-            chronic_count = chronic_condition.sum()
+            chronic_count = counts['chronic']
             
             # 分母是当月全部有效DHI参测牛头数。
             # 两个月的重叠牛只仅用于识别分子中的慢性感染牛，不能用于缩小分母。
-            current_df = self.monthly_data[curr_month]
-            total_current = current_df['somatic_cell_count'].notna().sum()
+            total_current = self._cow_month_matrix().month_counts(self.scc_threshold, curr_month)['valid']
 
             if total_current == 0:
                 return {
@@ -748,27 +1112,66 @@ class MastitisMonitoringCalculator:
                 'warning': None
             }
     
+    def _pre_dry_records(self, pregnancy_field: str) -> pd.DataFrame:
+        """
+        所有月份的测定记录及推算到测定日的在胎天数
+        
+        牛群基础信息的在胎天数视为最新一次测定时的值：最新月份的每条记录以自身测定日为基准，
+        直接取牛群信息的在胎天数（原始管理号不同、标准化后相同的多条记录互不折算）；较早月份
+        以该牛在最新月份的最后测定日为基准，最新月份无测定的牛以最新月份的最后测定日为基准。
+        各测定记录按标准化管理号对"基准日前的天数"做as-of连接（取不小于该天数的最小在胎天数，
+        即测定日当天或之前最近的一次受孕），测定日在受孕之前则当时未怀孕。
+        结果按月度数据与牛群信息对象缓存。
+        """
+        months = sorted(self.monthly_data)
+        frames = [self.monthly_data[month] for month in months]
+        cached = self._pre_dry_cache
+        if (cached is not None and cached[0] is self.cattle_basic_info and cached[1] == pregnancy_field
+                and len(cached[2]) == len(frames) and all(a is b for a, b in zip(cached[2], frames))):
+            return cached[3]
+        
+        records = pd.concat([
+            self.monthly_data[month][['management_id_standardized', 'sample_date', 'somatic_cell_count']].assign(month=month)
+            for month in months
+        ], ignore_index=True)
+        
+        cattle = self.cattle_basic_info
+        if 'ear_tag_standardized' in cattle.columns:
+            ear_tags = cattle['ear_tag_standardized']
+            gestation = pd.to_numeric(cattle[pregnancy_field], errors='coerce')
+        else:
+            ear_tags = pd.Series([], dtype=object)
+            gestation = pd.Series([], dtype=float)
+        records['matched'] = records['management_id_standardized'].isin(ear_tags)
+        
+        latest = records[records['month'] == months[-1]]
+        reference = latest.groupby('management_id_standardized')['sample_date'].max()
+        reference_date = records['management_id_standardized'].map(reference).fillna(latest['sample_date'].max())
+        # 最新月份的测定日即基准日，在胎天数与牛群信息一致
+        records['elapsed_days'] = ((reference_date - records['sample_date']) / pd.Timedelta(days=1)).where(
+            records['month'] != months[-1], 0.0)
+        pregnant = pd.DataFrame({
+            'management_id_standardized': ear_tags.to_numpy(dtype=object),
+            'gestation_days': gestation.to_numpy(dtype=float),
+        }).dropna(subset=['management_id_standardized', 'gestation_days'])
+        
+        joined = pd.merge_asof(
+            records.reset_index().sort_values('elapsed_days', kind='stable'),
+            pregnant.sort_values('gestation_days', kind='stable'),
+            left_on='elapsed_days', right_on='gestation_days',
+            by='management_id_standardized', direction='forward'
+        ).set_index('index').sort_index()
+        records['gestation_days'] = (joined['gestation_days'] - joined['elapsed_days']).to_numpy()
+        records = records.drop(columns='elapsed_days')
+        
+        self._pre_dry_cache = (self.cattle_basic_info, pregnancy_field, frames, records)
+        return records
+    
     def _calculate_pre_dry_prevalence(self, month: str) -> Dict[str, Any]:
-        """计算干奶前流行率"""
+        """计算干奶前流行率（在胎天数按测定日推算，诊断信息写入结果的diagnostics）"""
         try:
-            debug_msg = f"\n🔍 开始计算干奶前流行率 - 月份: {month}"
-            debug_msg += f"\n体细胞阈值: {self.scc_threshold}万/ml"
-            print(debug_msg)
-            
-            # 写入调试文件（跨平台兼容）
-            try:
-                import os
-                import tempfile
-                debug_file = os.path.join(tempfile.gettempdir(), 'predry_debug.log')
-                with open(debug_file, 'a', encoding='utf-8') as f:
-                    f.write(debug_msg + '\n')
-            except Exception:
-                # 如果无法写入调试文件，忽略错误继续执行
-                pass
-            
             # 检查基础数据
             if self.cattle_basic_info is None:
-                print("❌ 检查失败: 未上传牛群基础信息")
                 return {
                     'value': None,
                     'formula': '📋 无法计算干奶前流行率 - 未上传牛群基础信息<br/>💡 解决方案：请在"慢性乳房炎筛查"功能中上传包含在胎天数信息的牛群基础信息文件',
@@ -779,45 +1182,19 @@ class MastitisMonitoringCalculator:
                     'diagnosis': '缺少牛群基础信息'
                 }
             
-            # Windows环境调试：输出更多系统信息
-            try:
-                import platform
-                import sys
-                print(f"🔍 系统环境调试:")
-                print(f"   操作系统: {platform.system()} {platform.release()}")
-                print(f"   Python版本: {sys.version}")
-                print(f"   是否打包环境: {getattr(sys, 'frozen', False)}")
-                print(f"   执行路径: {sys.executable}")
-            except Exception as debug_e:
-                print(f"   系统信息获取失败: {debug_e}")
-            
-            print(f"✅ 牛群基础信息已加载: {len(self.cattle_basic_info)}头牛")
-            
-            # 获取在胎天数字段 - 增强调试
+            # 获取在胎天数字段
             available_fields = list(self.cattle_basic_info.columns)
             pregnancy_field = self._get_pregnancy_field(self.cattle_system_type or 'other')
-            
-            print(f"🔍 详细字段调试:")
-            print(f"   系统类型: {self.cattle_system_type}")
-            print(f"   牛群信息总字段数: {len(available_fields)}")
-            print(f"   所有字段: {available_fields}")
-            print(f"   包含'天数'的字段: {[f for f in available_fields if '天数' in f]}")
-            print(f"   包含'days'的字段: {[f for f in available_fields if 'days' in f.lower()]}")
-            print(f"   获取到的在胎天数字段: {pregnancy_field}")
-            
-            # 检查数据类型和数据样本
-            if pregnancy_field and pregnancy_field in self.cattle_basic_info.columns:
-                preg_data = self.cattle_basic_info[pregnancy_field]
-                print(f"   在胎天数字段数据类型: {preg_data.dtype}")
-                print(f"   在胎天数非空值数量: {preg_data.count()}")
-                print(f"   在胎天数样本值: {preg_data.dropna().head().tolist()}")
-            else:
-                print(f"   ❌ 在胎天数字段不存在或为空")
+            diagnostics = {
+                'system_type': self.cattle_system_type,
+                'cattle_count': len(self.cattle_basic_info),
+                'pregnancy_field': pregnancy_field,
+                'day_fields': [f for f in available_fields if '天数' in f or 'days' in f.lower()],
+            }
             
             if not pregnancy_field or pregnancy_field not in self.cattle_basic_info.columns:
-                pregnancy_related = [f for f in available_fields if '天数' in f or 'days' in f.lower()]
+                pregnancy_related = diagnostics['day_fields']
                 field_info = f"可用字段：{pregnancy_related}" if pregnancy_related else "未找到相关字段"
-                print(f"❌ 在胎天数字段检查失败: {field_info}")
                 
                 return {
                     'value': None,
@@ -826,117 +1203,79 @@ class MastitisMonitoringCalculator:
                     'denominator': 0,
                     'matched_count': 0,
                     'total_dhi_count': 0,
-                    'diagnosis': '缺少在胎天数字段'
+                    'diagnosis': '缺少在胎天数字段',
+                    'diagnostics': diagnostics
                 }
             
-            print(f"✅ 在胎天数字段验证通过: {pregnancy_field}")
-            
-            # 获取当月DHI数据
-            dhi_df = self.monthly_data[month]
-            print(f"\n📊 DHI数据信息:")
-            print(f"   当月({month})DHI数据: {len(dhi_df)}头牛")
-            if len(dhi_df) > 0:
-                print(f"   管理号示例: {dhi_df['management_id'].head().tolist()}")
-                print(f"   体细胞数示例: {dhi_df['somatic_cell_count'].head().tolist()}")
-            
-            # 匹配管理号与耳号
-            print(f"\n🔗 开始匹配管理号与耳号...")
-            matched_data = self._match_management_id_with_ear_tag(dhi_df)
-            match_rate = (len(matched_data) / len(dhi_df)) * 100 if len(dhi_df) > 0 else 0
-            print(f"   匹配结果: {len(matched_data)}头 / {len(dhi_df)}头 = {match_rate:.1f}%")
+            # 当月测定记录：与牛群基础信息按标准化耳号匹配，在胎天数已推算到测定日
+            records = self._pre_dry_records(pregnancy_field)
+            month_records = records[records['month'] == month]
+            total_dhi_count = len(month_records)
+            matched_count = int(month_records['matched'].sum())
+            match_rate = (matched_count / total_dhi_count) * 100 if total_dhi_count > 0 else 0
+            diagnostics['reference_date'] = records.loc[records['month'] == max(self.monthly_data), 'sample_date'].max()
             
             # 详细的匹配诊断
-            if len(matched_data) == 0:
-                print(f"❌ 匹配失败: 无法匹配任何牛只")
-                print(f"   DHI管理号标准化示例: {dhi_df['management_id_standardized'].head().tolist()}")
-                if hasattr(self.cattle_basic_info, 'ear_tag_standardized'):
-                    print(f"   牛群耳号标准化示例: {self.cattle_basic_info['ear_tag_standardized'].head().tolist()}")
+            if matched_count == 0:
                 return {
                     'value': None,
-                    'formula': f'📋 无法计算干奶前流行率 - DHI数据与牛群基础信息无法匹配<br/>📊 DHI数据：{len(dhi_df)}头牛<br/>🐄 牛群基础信息：{len(self.cattle_basic_info)}头牛<br/>🔗 匹配成功：0头 (0.0%)<br/>💡 可能原因：<br/>　• DHI数据与牛群信息来自不同时间点<br/>　• 管理号与耳号编码方式不同<br/>　• 数据来源不是同一个牧场',
+                    'formula': f'📋 无法计算干奶前流行率 - DHI数据与牛群基础信息无法匹配<br/>📊 DHI数据：{total_dhi_count}头牛<br/>🐄 牛群基础信息：{len(self.cattle_basic_info)}头牛<br/>🔗 匹配成功：0头 (0.0%)<br/>💡 可能原因：<br/>　• DHI数据与牛群信息来自不同时间点<br/>　• 管理号与耳号编码方式不同<br/>　• 数据来源不是同一个牧场',
                     'numerator': 0,
                     'denominator': 0,
                     'matched_count': 0,
-                    'total_dhi_count': len(dhi_df),
-                    'diagnosis': '数据无法匹配'
+                    'total_dhi_count': total_dhi_count,
+                    'diagnosis': '数据无法匹配',
+                    'diagnostics': diagnostics
                 }
             
-            print(f"✅ 匹配成功: {len(matched_data)}头牛")
-            
             # 低匹配率警告
             low_match_warning = ""
             if match_rate < 50:
                 low_match_warning = f"<br/>⚠️ 注意：数据匹配率较低 ({match_rate:.1f}%)，结果可能不完整"
             
             # 检查匹配数据中的在胎天数
-            print(f"\n🤰 检查在胎天数数据...")
-            pregnancy_data_count = matched_data[pregnancy_field].count()
-            pregnancy_valid_data = matched_data[pregnancy_field].dropna()
-            print(f"   匹配牛只中有在胎天数数据的: {pregnancy_data_count}头")
+            pregnancy_valid_data = month_records['gestation_days'].dropna()
+            pregnancy_data_count = len(pregnancy_valid_data)
             
             if pregnancy_data_count == 0:
-                print(f"❌ 在胎天数检查失败: 匹配成功的牛只中无在胎天数数据")
-                print(f"   匹配数据列名: {list(matched_data.columns)}")
                 return {
                     'value': None,
-                    'formula': f'📋 无法计算干奶前流行率 - 匹配成功的牛只中无在胎天数数据<br/>📊 DHI数据：{len(dhi_df)}头牛<br/>🔗 匹配成功：{len(matched_data)}头 ({match_rate:.1f}%)<br/>📉 有在胎天数数据：0头<br/>💡 可能原因：<br/>　• 牛群基础信息导出时间与DHI测试时间不同步<br/>　• 匹配成功的牛只当时处于空怀状态{low_match_warning}',
+                    'formula': f'📋 无法计算干奶前流行率 - 匹配成功的牛只中无在胎天数数据<br/>📊 DHI数据：{total_dhi_count}头牛<br/>🔗 匹配成功：{matched_count}头 ({match_rate:.1f}%)<br/>📉 有在胎天数数据：0头<br/>💡 可能原因：<br/>　• 牛群基础信息导出时间与DHI测试时间不同步<br/>　• 匹配成功的牛只当时处于空怀状态{low_match_warning}',
                     'numerator': 0,
                     'denominator': 0,
-                    'matched_count': len(matched_data),
-                    'total_dhi_count': len(dhi_df),
-                    'diagnosis': '匹配牛只无在胎天数数据'
+                    'matched_count': matched_count,
+                    'total_dhi_count': total_dhi_count,
+                    'diagnosis': '匹配牛只无在胎天数数据',
+                    'diagnostics': diagnostics
                 }
             
-            print(f"✅ 在胎天数数据检查通过: {pregnancy_data_count}头牛有数据")
-            
             # 筛选在胎天数>180天的牛只
-            print(f"\n🎯 筛选干奶前牛只(在胎天数>180天)...")
-            print(f"   在胎天数有效数据范围: {pregnancy_valid_data.min():.0f}-{pregnancy_valid_data.max():.0f}天")
-            print(f"   平均在胎天数: {pregnancy_valid_data.mean():.1f}天")
-            
-            pregnancy_condition = matched_data[pregnancy_field] > 180
-            pre_dry_cattle = matched_data[pregnancy_condition]
-            over_180_count = (pregnancy_valid_data > 180).sum()
-            print(f"   在胎天数>180天的牛只: {over_180_count}头")
-            print(f"   筛选出的干奶前牛只: {len(pre_dry_cattle)}头")
+            pre_dry_cattle = month_records[month_records['gestation_days'] > PRE_DRY_GESTATION_DAYS]
+            over_180_count = len(pre_dry_cattle)
             
             # 提供在胎天数的统计信息
-            if len(pregnancy_valid_data) > 0:
-                preg_stats = f"在胎天数范围：{pregnancy_valid_data.min():.0f}-{pregnancy_valid_data.max():.0f}天，平均{pregnancy_valid_data.mean():.0f}天"
-                preg_stats += f"，>180天：{over_180_count}头"
-            else:
-                preg_stats = "无有效在胎天数数据"
+            preg_stats = f"在胎天数范围：{pregnancy_valid_data.min():.0f}-{pregnancy_valid_data.max():.0f}天，平均{pregnancy_valid_data.mean():.0f}天"
+            preg_stats += f"，>180天：{over_180_count}头"
             
             if len(pre_dry_cattle) == 0:
-                print(f"❌ 干奶前牛只筛选失败: 无在胎天数>180天的牛只")
-                print(f"   统计信息: {preg_stats}")
                 return {
                     'value': None,
-                    'formula': f'📋 无法计算干奶前流行率 - 无在胎天数>180天的牛只<br/>📊 DHI数据：{len(dhi_df)}头牛<br/>🔗 匹配成功：{len(matched_data)}头 ({match_rate:.1f}%)<br/>📊 有在胎天数数据：{pregnancy_data_count}头<br/>📈 {preg_stats}<br/>🎯 符合干奶前条件（>180天）：0头{low_match_warning}',
+                    'formula': f'📋 无法计算干奶前流行率 - 无在胎天数>180天的牛只<br/>📊 DHI数据：{total_dhi_count}头牛<br/>🔗 匹配成功：{matched_count}头 ({match_rate:.1f}%)<br/>📊 有在胎天数数据：{pregnancy_data_count}头<br/>📈 {preg_stats}<br/>🎯 符合干奶前条件（>180天）：0头{low_match_warning}',
                     'numerator': 0,
                     'denominator': 0,
-                    'matched_count': len(matched_data),
-                    'total_dhi_count': len(dhi_df),
+                    'matched_count': matched_count,
+                    'total_dhi_count': total_dhi_count,
                     'pregnancy_stats': preg_stats,
-                    'diagnosis': '无符合干奶前条件的牛只'
+                    'diagnosis': '无符合干奶前条件的牛只',
+                    'diagnostics': diagnostics
                 }
             
-            print(f"✅ 干奶前牛只筛选成功: {len(pre_dry_cattle)}头")
-            
             # 成功计算干奶前流行率
-            print(f"\n📈 计算干奶前流行率...")
             high_scc_count = (pre_dry_cattle['somatic_cell_count'] > self.scc_threshold).sum()
             total_pre_dry = len(pre_dry_cattle)
-            
-            print(f"   干奶前牛只总数: {total_pre_dry}头")
-            print(f"   体细胞>{self.scc_threshold}万/ml的牛只: {high_scc_count}头")
-            print(f"   干奶前牛只体细胞数详情: {pre_dry_cattle['somatic_cell_count'].tolist()}")
-            
             pre_dry_prevalence = (high_scc_count / total_pre_dry) * 100
-            print(f"   计算公式: ({high_scc_count} ÷ {total_pre_dry}) × 100% = {pre_dry_prevalence:.1f}%")
-            print(f"✅ 干奶前流行率计算成功: {pre_dry_prevalence:.1f}%")
             
-            formula = f'🎯 干奶前流行率计算成功<br/>📊 DHI数据：{len(dhi_df)}头牛<br/>🔗 匹配成功：{len(matched_data)}头 ({match_rate:.1f}%)<br/>📊 有在胎天数数据：{pregnancy_data_count}头<br/>🐄 干奶前牛只（>180天）：{total_pre_dry}头<br/>🔬 体细胞>{self.scc_threshold}万/ml：{high_scc_count}头<br/>📈 干奶前流行率：{pre_dry_prevalence:.1f}%{low_match_warning}'
+            formula = f'🎯 干奶前流行率计算成功<br/>📊 DHI数据：{total_dhi_count}头牛<br/>🔗 匹配成功：{matched_count}头 ({match_rate:.1f}%)<br/>📊 有在胎天数数据：{pregnancy_data_count}头<br/>🐄 干奶前牛只（>180天）：{total_pre_dry}头<br/>🔬 体细胞>{self.scc_threshold}万/ml：{high_scc_count}头<br/>📈 干奶前流行率：{pre_dry_prevalence:.1f}%{low_match_warning}'
             
             # 添加详细计算过程
             formula += f'<br/><br/>💡 计算公式：({high_scc_count} ÷ {total_pre_dry}) × 100% = {pre_dry_prevalence:.1f}%'
@@ -946,13 +1285,14 @@ class MastitisMonitoringCalculator:
                 'formula': formula,
                 'numerator': high_scc_count,
                 'denominator': total_pre_dry,
-                'matched_count': len(matched_data),
-                'total_dhi_count': len(dhi_df),
+                'matched_count': matched_count,
+                'total_dhi_count': total_dhi_count,
                 'pregnancy_stats': preg_stats,
                 'match_rate': match_rate,
-                'latest_month': month,
+                'month': month,
                 'pregnancy_field': pregnancy_field,
-                'diagnosis': '计算成功'
+                'diagnosis': '计算成功',
+                'diagnostics': diagnostics
             }
             
         except Exception as e:
@@ -967,50 +1307,6 @@ class MastitisMonitoringCalculator:
                 'diagnosis': '计算异常'
             }
     
-    def _match_management_id_with_ear_tag(self, dhi_df: pd.DataFrame) -> pd.DataFrame:
-        """匹配DHI报告的管理号与牛群基础信息的耳号"""
-        try:
-            # 将牛群基础信息的耳号标准化
-            if self.cattle_basic_info is None:
-                print("   ❌ 牛群基础信息为空")
-                return pd.DataFrame()
-            
-            cattle_info = self.cattle_basic_info.copy()
-            print(f"   🔍 开始匹配: DHI数据{len(dhi_df)}头，牛群信息{len(cattle_info)}头")
-            
-            # 检查标准化字段是否存在
-            if 'ear_tag_standardized' not in cattle_info.columns:
-                print("   ❌ 牛群信息缺少ear_tag_standardized字段")
-                return pd.DataFrame()
-                
-            if 'management_id_standardized' not in dhi_df.columns:
-                print("   ❌ DHI数据缺少management_id_standardized字段")
-                return pd.DataFrame()
-            
-            print(f"   📋 DHI管理号标准化示例: {dhi_df['management_id_standardized'].head().tolist()}")
-            print(f"   📋 牛群耳号标准化示例: {cattle_info['ear_tag_standardized'].head().tolist()}")
-            
-            # 基于标准化后的ID进行匹配
-            matched_data = dhi_df.merge(
-                cattle_info,
-                left_on='management_id_standardized',
-                right_on='ear_tag_standardized',
-                how='inner'
-            )
-            
-            print(f"   🔗 匹配结果: {len(matched_data)}头牛匹配成功")
-            if len(matched_data) > 0:
-                print(f"   📋 匹配成功的ID示例: {matched_data['management_id_standardized'].head().tolist()}")
-            
-            logger.info(f"管理号匹配结果: DHI数据{len(dhi_df)}头，成功匹配{len(matched_data)}头")
-            
-            return matched_data
-            
-        except Exception as e:
-            print(f"   ❌ 匹配过程异常: {e}")
-            logger.error(f"管理号与耳号匹配失败: {e}")
-            return pd.DataFrame()
-    
     def get_summary_statistics(self) -> Dict[str, Any]:
         """获取汇总统计信息"""
         if not self.results:
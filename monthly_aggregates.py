@@ -0,0 +1,251 @@
+"""
+月度汇总聚合模块
+按(牛场, 月份, 性状)物化月度报告的汇总量：记录数、合计、离均差平方和、极值，以及与产奶量配对的
+加权合计和产奶量合计。统计面板直接查表（O(月份数)），报告行被后续筛选剔除时只扣减被剔除牛只
+的贡献，无需重新扫描整张宽表；报告attrs中的平均值需与逐列计算的舍入一致，按报告行顺序由保留的
+各行数值求和。
+"""
+
+import re
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+# 可直接相加/相减的汇总量
+ADDITIVE_COLUMNS = ['count', 'total', 'pairs', 'weighted_total', 'milk_total']
+EXTREMA_COLUMNS = ['minimum', 'maximum']
+# 离均差平方和Σ(x-均值)²：按组的均值差合并/扣减（Chan等的并行方差公式），避免Σx²-n·均值²的相消误差
+MOMENT_COLUMN = 'm2'
+
+
+def _reduce_blocks(values: np.ndarray, starts: np.ndarray, reducer) -> np.ndarray:
+    """按牛场分块（行已按牛场排序）对每个月份做归约"""
+    if not len(values):
+        return np.empty((0,) + values.shape[1:], dtype=values.dtype)
+    return reducer.reduceat(values, starts, axis=0)
+
+
+def _subtract_moment(table: pd.DataFrame, removed: pd.DataFrame) -> pd.Series:
+    """从各单元的离均差平方和中扣减被剔除记录：M2剩余 = M2 - M2剔除 - n剩余·n剔除/n·(均值剩余-均值剔除)²"""
+    count = table['count'].to_numpy(dtype=float)
+    removed_count = removed['count'].to_numpy(dtype=float)
+    remaining_count = count - removed_count
+    with np.errstate(invalid='ignore', divide='ignore'):
+        remaining_mean = (table['total'].to_numpy() - removed['total'].to_numpy()) / remaining_count
+        removed_mean = removed['total'].to_numpy() / removed_count
+        correction = remaining_count * removed_count / count * (remaining_mean - removed_mean) ** 2
+    moment = table[MOMENT_COLUMN].to_numpy() - removed[MOMENT_COLUMN].to_numpy() - np.nan_to_num(correction)
+    # 剩余不足两条记录时没有离散程度
+    moment = np.where(remaining_count > 1, np.clip(moment, 0, None), 0.0)
+    return pd.Series(moment, index=table.index)
+
+
+class MonthlyAggregates:
+    """按(牛场, 月份, 性状)物化的月度报告汇总
+
+    table索引为(farm_id, month, trait)，列为ADDITIVE_COLUMNS、MOMENT_COLUMN与EXTREMA_COLUMNS；同时保留
+    报告各行（每头牛）的月度数值，剔除报告行时扣减这些行的贡献，极值只在被剔除的牛
+    曾是极值的单元重新计算。实例不可变，without返回新实例。
+    """
+
+    def __init__(self, row_labels, farms: np.ndarray, months: List[str],
+                 cells: Dict[str, np.ndarray], milk: np.ndarray, table: Optional[pd.DataFrame] = None):
+        """
+        Args:
+            row_labels: 报告行索引
+            farms: 每行的牛场编号（无牛场编号列时为''）
+            months: 月份名称（YYYY年MM月，按时间排序）
+            cells: 性状 -> (行数, 月份数)的数值，空值为NaN
+            milk: (行数, 月份数)的产奶量，用于加权
+        """
+        self.row_labels = pd.Index(row_labels)
+        self.farms = np.asarray(farms, dtype=object)
+        self.months = list(months)
+        self.cells = cells
+        self.milk = milk
+        self.traits = list(cells)
+        self.table = table if table is not None else self._aggregate(np.arange(len(self.row_labels)))
+
+    def _aggregate(self, positions: np.ndarray) -> pd.DataFrame:
+        """对给定行汇总出(牛场, 月份, 性状)表"""
+        farm_codes, farm_names = pd.factorize(self.farms[positions])
+        order = np.argsort(farm_codes, kind='stable')
+        positions = positions[order]
+        sorted_codes = farm_codes[order]
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]]) if len(positions) \
+            else np.empty(0, dtype=np.int64)
+        block_ids = np.repeat(np.arange(len(starts)), np.diff(np.r_[starts, len(positions)]))
+
+        milk = self.milk[positions]
+        milk_present = ~np.isnan(milk)
+        columns = {name: [] for name in ADDITIVE_COLUMNS + [MOMENT_COLUMN] + EXTREMA_COLUMNS}
+        for trait in self.traits:
+            values = self.cells[trait][positions]
+            present = ~np.isnan(values)
+            paired = present & milk_present
+            filled = np.where(present, values, 0.0)
+            count = _reduce_blocks(present.astype(np.int64), starts, np.add)
+            total = _reduce_blocks(filled, starts, np.add)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                block_mean = np.where(count > 0, total / count, 0.0)
+            deviations = np.where(present, values - block_mean[block_ids], 0.0)
+            blocks = {
+                'count': count,
+                'total': total,
+                MOMENT_COLUMN: _reduce_blocks(deviations * deviations, starts, np.add),
+                'pairs': _reduce_blocks(paired.astype(np.int64), starts, np.add),
+                'weighted_total': _reduce_blocks(np.where(paired, values * milk, 0.0), starts, np.add),
+                'milk_total': _reduce_blocks(np.where(paired, milk, 0.0), starts, np.add),
+                'minimum': _reduce_blocks(values, starts, np.fmin),
+                'maximum': _reduce_blocks(values, starts, np.fmax),
+            }
+            for name, block in blocks.items():
+                columns[name].append(block)
+
+        # (牛场, 月份, 性状)展开为长表
+        index = pd.MultiIndex.from_product([list(farm_names), self.months, self.traits],
+                                           names=['farm_id', 'month', 'trait'])
+        data = {}
+        for name, blocks in columns.items():
+            if blocks:
+                data[name] = np.stack(blocks, axis=-1).ravel()
+            else:
+                data[name] = np.empty(0, dtype=np.int64 if name in ('count', 'pairs') else float)
+        return pd.DataFrame(data, index=index)
+
+    def without(self, labels) -> 'MonthlyAggregates':
+        """剔除给定报告行后的聚合：扣减这些行的汇总量，只重算受影响单元的极值"""
+        removed = self.row_labels.get_indexer(pd.Index(labels))
+        removed = removed[removed >= 0]
+        if not len(removed):
+            return self
+        keep = np.ones(len(self.row_labels), dtype=bool)
+        keep[removed] = False
+
+        removed_table = self._aggregate(removed).reindex(self.table.index)
+        table = self.table.copy()
+        for name in ADDITIVE_COLUMNS:
+            table[name] = table[name] - removed_table[name].fillna(0).astype(table[name].dtype)
+        table[MOMENT_COLUMN] = _subtract_moment(self.table, removed_table.fillna(
+            {'count': 0, 'total': 0.0, MOMENT_COLUMN: 0.0}))
+        # 单元已无记录时合计清零，避免浮点残差
+        table.loc[table['count'] == 0, ['total', MOMENT_COLUMN]] = 0.0
+        table.loc[table['pairs'] == 0, ['weighted_total', 'milk_total']] = 0.0
+
+        # 被剔除的牛是某单元的最小/最大值时，按该牛场剩余的牛重新计算极值
+        affected = ((removed_table['minimum'] <= table['minimum'])
+                    | (removed_table['maximum'] >= table['maximum'])).to_numpy()
+        if affected.any():
+            affected_farms = set(table.index.get_level_values('farm_id')[affected])
+            remaining = np.flatnonzero(keep & np.isin(self.farms, list(affected_farms)))
+            recomputed = self._aggregate(remaining).reindex(table.index[affected])
+            table.loc[affected, EXTREMA_COLUMNS] = recomputed[EXTREMA_COLUMNS].to_numpy()
+
+        logger.info(f"月度汇总已扣减{len(removed)}头牛")
+        return MonthlyAggregates(
+            self.row_labels[keep], self.farms[keep], self.months,
+            {trait: values[keep] for trait, values in self.cells.items()}, self.milk[keep], table
+        )
+
+    def _trait_rows(self, trait: str) -> pd.DataFrame:
+        return self.table[self.table.index.get_level_values('trait') == trait]
+
+    def totals(self, trait: str) -> pd.Series:
+        """某性状所有牛场、所有月份的汇总量"""
+        return self._trait_rows(trait)[ADDITIVE_COLUMNS].sum()
+
+    def month_totals(self, trait: str) -> pd.DataFrame:
+        """某性状各月份（合并所有牛场）的汇总量，按月份顺序"""
+        part = self._trait_rows(trait)
+        grouped = part.groupby(level='month', sort=False)
+        totals = grouped[ADDITIVE_COLUMNS].sum()
+        # 离均差平方和：各牛场内部的平方和 + 各牛场均值与总均值之差的平方×记录数
+        with np.errstate(invalid='ignore', divide='ignore'):
+            farm_mean = part['total'] / part['count']
+            month_mean = (totals['total'] / totals['count']).reindex(part.index.get_level_values('month'))
+        between = part['count'] * (farm_mean - month_mean.to_numpy()) ** 2
+        totals[MOMENT_COLUMN] = (part[MOMENT_COLUMN] + between.where(part['count'] > 0, 0.0)) \
+            .groupby(level='month', sort=False).sum()
+        totals['minimum'] = grouped['minimum'].min()
+        totals['maximum'] = grouped['maximum'].max()
+        totals = totals.reindex(self.months)
+        totals[['count', 'pairs']] = totals[['count', 'pairs']].fillna(0).astype(np.int64)
+        return totals
+
+    def record_month_totals(self, trait: str) -> pd.DataFrame:
+        """某性状各月份按报告行顺序求得的记录数、合计、配对数、加权合计与产奶量合计
+
+        与对报告月度列去掉空值后直接求和逐位一致，不受按牛场分组后再合并的求和顺序影响，
+        供报告attrs中的各月平均值使用（舍入边界上的结果与逐列计算相同）。
+        """
+        values = self.cells[trait]
+        present = ~np.isnan(values)
+        paired = present & ~np.isnan(self.milk)
+        rows = []
+        for j in range(len(self.months)):
+            column, milk = values[:, j], self.milk[:, j]
+            rows.append({
+                'count': int(present[:, j].sum()),
+                'total': column[present[:, j]].sum(),
+                'pairs': int(paired[:, j].sum()),
+                'weighted_total': (column[paired[:, j]] * milk[paired[:, j]]).sum(),
+                'milk_total': milk[paired[:, j]].sum(),
+            })
+        return pd.DataFrame(rows, index=self.months,
+                            columns=['count', 'total', 'pairs', 'weighted_total', 'milk_total'])
+
+    def record_weighted_totals(self, traits: List[str]) -> Tuple[Dict[str, Tuple[int, float]], float]:
+        """加权字段按逐条累加的顺序（牛→月份→字段）求得的配对数与Σ(值×产奶量)，以及各字段共用的产奶量合计"""
+        milk_terms = np.zeros(self.milk.shape + (len(traits),))
+        weighted = {}
+        for k, trait in enumerate(traits):
+            values = self.cells[trait]
+            paired = ~np.isnan(values) & ~np.isnan(self.milk)
+            milk_terms[:, :, k] = np.where(paired, self.milk, 0.0)
+            products = np.where(paired, values * self.milk, 0.0).ravel()
+            weighted[trait] = (int(paired.sum()), float(np.cumsum(products)[-1]) if products.size else 0.0)
+        all_total_milk = float(np.cumsum(milk_terms.ravel())[-1]) if milk_terms.size else 0.0
+        return weighted, all_total_milk
+
+    def month_stats(self, trait: str) -> pd.DataFrame:
+        """某性状各月份的样本数、平均值、标准差（样本标准差）与范围"""
+        totals = self.month_totals(trait)
+        count = totals['count'].to_numpy()
+        total = totals['total'].to_numpy()
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(count > 0, total / count, np.nan)
+            variance = totals[MOMENT_COLUMN].to_numpy() / (count - 1)
+        std = np.where(count > 1, np.sqrt(np.clip(variance, 0, None)), np.nan)
+        return pd.DataFrame({
+            'count': count, 'mean': mean, 'std': std,
+            'min': totals['minimum'].to_numpy(), 'max': totals['maximum'].to_numpy(),
+        }, index=totals.index)
+
+
+def report_month_stats(df: pd.DataFrame, trait: str, column_suffix: str,
+                       aggregates: Optional[MonthlyAggregates] = None) -> Optional[pd.DataFrame]:
+    """月度报告中某性状各月份的统计（index为YYYY年MM月）
+
+    提供与报告各行对应的汇总聚合（DataProcessor.report_aggregates）时直接查表；否则（如外部载入的结果、
+    报告行已被进一步筛选）按“YYYY年MM月+列名”的月度明细列计算。报告中没有该性状时返回None。
+    """
+    if aggregates is not None and aggregates.row_labels.equals(df.index):
+        if trait not in aggregates.traits or not aggregates.months:
+            return None
+        return aggregates.month_stats(trait)
+
+    pattern = re.compile(r'(\d{4}年\d{2}月)' + re.escape(column_suffix))
+    columns = sorted((match.group(1), col) for col in df.columns
+                     if isinstance(col, str) and (match := pattern.fullmatch(col)))
+    if not columns:
+        return None
+    rows = {}
+    for month, col in columns:
+        values = pd.to_numeric(df[col], errors='coerce').dropna()
+        rows[month] = {'count': len(values), 'mean': values.mean(), 'std': values.std(),
+                       'min': values.min(), 'max': values.max()}
+    return pd.DataFrame.from_dict(rows, orient='index')
@@ -0,0 +1,90 @@
+"""
+筛选结果缓存模块
+按数据内容摘要与规范化后的筛选条件缓存多筛选项结果和月度报告（内存LRU，按占用字节数限额），
+在几套常用筛选条件之间来回切换时无需重新筛选和生成报告
+"""
+
+import hashlib
+import json
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_filters(filters: Dict[str, Any]) -> str:
+    """筛选条件的稳定文本形式：键排序，未启用的筛选项只保留enabled=False"""
+    normalized = {}
+    for name, config in filters.items():
+        if isinstance(config, dict) and not config.get('enabled', False):
+            normalized[name] = {'enabled': False}
+        else:
+            normalized[name] = config
+    return json.dumps(normalized, sort_keys=True, ensure_ascii=False, default=str)
+
+
+def make_cache_key(*parts: Any) -> str:
+    """把若干组成部分拼成缓存键（SHA-1）"""
+    text = '\x1f'.join(part if isinstance(part, str) else json.dumps(part, ensure_ascii=False, default=str)
+                       for part in parts)
+    return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+
+def _entry_bytes(value: Any) -> int:
+    if isinstance(value, pd.DataFrame):
+        return int(value.memory_usage(index=True, deep=True).sum())
+    return 0
+
+
+class ResultCache:
+    """按最近使用淘汰的内存缓存，条目为DataFrame，读写都复制以免调用方修改缓存内容"""
+
+    def __init__(self, max_bytes: int = 256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries: "OrderedDict[str, pd.DataFrame]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def get(self, key: str) -> Optional[pd.DataFrame]:
+        value = self._entries.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value.copy()
+
+    def put(self, key: str, value: pd.DataFrame) -> None:
+        self.discard(key)
+        size = _entry_bytes(value)
+        if size > self.max_bytes:
+            logger.info(f"结果过大（{size / 1024 / 1024:.1f}MB），不缓存")
+            return
+        self._entries[key] = value.copy()
+        self._sizes[key] = size
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes and self._entries:
+            oldest, _ = self._entries.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(oldest)
+
+    def discard(self, key: str) -> None:
+        if self._entries.pop(key, None) is not None:
+            self.total_bytes -= self._sizes.pop(key)
+
+    def clear(self) -> None:
+        if self._entries:
+            logger.info(f"清空筛选结果缓存（{len(self._entries)}条）")
+        self._entries.clear()
+        self._sizes.clear()
+        self.total_bytes = 0
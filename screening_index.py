@@ -0,0 +1,262 @@
+"""
+筛选位图索引模块
+在基础筛选后的牛群长表上按牛只×月份建立索引：每个性状按单元格保存原始取值，
+每个月份保存一组按牛只排列的位图（有数据/有空值）。任意min/max/min_match_months
+组合都可以用numpy位运算和计数回答，修改阈值后重新筛选无需再分组聚合。
+"""
+
+import math
+import time
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def popcount(bitmap: np.ndarray) -> int:
+    """位图中置位的数量"""
+    return int(np.unpackbits(bitmap).sum())
+
+
+def binomial_tail(trials: int, probability: float, at_least: int) -> float:
+    """二项分布P(X >= at_least)"""
+    if at_least <= 0:
+        return 1.0
+    if at_least > trials:
+        return 0.0
+    probability = min(max(probability, 0.0), 1.0)
+    return sum(math.comb(trials, k) * probability ** k * (1 - probability) ** (trials - k)
+               for k in range(at_least, trials + 1))
+
+
+def format_plan(plan: List[Dict]) -> List[str]:
+    """把执行计划整理为过程日志行"""
+    lines = []
+    for step, item in enumerate(plan, start=1):
+        if item.get('skipped'):
+            lines.append(f"   {step}. {item['filter']}: 候选牛只已为空，跳过")
+            continue
+        lines.append(
+            f"   {step}. {item['filter']}: 预估通过率{item['estimated'] * 100:.1f}%，"
+            f"候选{item['candidates']}头 → 通过{item['passed']}头，耗时{item['seconds'] * 1000:.1f}ms"
+        )
+    return lines
+
+
+class ScreeningIndex:
+    """牛只×月份位图索引
+
+    位图形状为(月份数, ceil(牛只数/8))，每一行是一个月份的牛只位集；性状取值按
+    单元格(牛只, 月份)连续存放，首次查询某性状时建立并缓存。
+    缺少管理号的行不属于任何一头牛，不参与索引；牛场编号缺失时与cow_key一致，
+    按一个单独的牛场处理（例如混入没有牛场编号列的旧格式文件）。
+    """
+
+    def __init__(self, df: pd.DataFrame, all_months: List[str]):
+        self.df = df
+        self.all_months = list(all_months)
+
+        keyed = (df['cow_key'] >= 0).to_numpy()
+        self.keyed_rows = keyed
+
+        # 牛只轴：按cow_key排序的有效牛只
+        row_cow_idx = np.full(len(df), -1, dtype=np.int64)
+        self.cow_keys = np.unique(df['cow_key'].to_numpy()[keyed])
+        row_cow_idx[keyed] = np.searchsorted(self.cow_keys, df['cow_key'].to_numpy()[keyed])
+        self.row_cow_idx = row_cow_idx
+        self.n_cows = len(self.cow_keys)
+        self.n_months = len(self.all_months)
+
+        # 单元格：有月份的有效行，按cow_idx*月份数+month_idx稳定排序
+        month_idx = pd.Categorical(df['year_month'], categories=self.all_months).codes.astype(np.int64)
+        in_cell = keyed & (month_idx >= 0)
+        cells = row_cow_idx[in_cell] * self.n_months + month_idx[in_cell]
+        order = np.argsort(cells, kind='stable')
+        self.cell_rows = np.flatnonzero(in_cell)[order]
+        sorted_cells = cells[order]
+        if len(sorted_cells):
+            boundaries = np.flatnonzero(np.diff(sorted_cells)) + 1
+            self.segment_starts = np.concatenate(([0], boundaries))
+        else:
+            self.segment_starts = np.empty(0, dtype=np.int64)
+        self.cells = sorted_cells[self.segment_starts]
+        self.segment_lengths = np.diff(np.append(self.segment_starts, len(sorted_cells)))
+
+        self.present = self._pack_cells(self.cells)
+        # 至少有一个有数据月份的牛只
+        self.cows_with_data = np.bitwise_or.reduce(self.present, axis=0) if self.n_months \
+            else np.zeros((self.n_cows + 7) // 8, dtype=np.uint8)
+        self._traits: Dict[str, Dict] = {}
+        # 最近一次query的执行计划（按执行顺序）
+        self.last_plan: List[Dict] = []
+
+        logger.info(f"筛选位图索引已建立：{self.n_cows}头牛 × {self.n_months}个月，{len(self.cells)}个有数据单元格")
+
+    def _pack_cells(self, cells: np.ndarray) -> np.ndarray:
+        """把单元格编号集合转为(月份, 牛只)位图"""
+        matrix = np.zeros((self.n_months, self.n_cows), dtype=bool)
+        if len(cells):
+            matrix[cells % self.n_months, cells // self.n_months] = True
+        return np.packbits(matrix, axis=1)
+
+    def _trait(self, field: str) -> Dict:
+        """某性状按单元格排列的取值与空值位图（首次使用时建立）"""
+        trait = self._traits.get(field)
+        if trait is not None:
+            return trait
+
+        raw = self.df[field].iloc[self.cell_rows]
+        numeric = pd.to_numeric(raw, errors='coerce')
+        # 保持原始精度比较（float32字段与旧实现逐行比较的结果一致）
+        if isinstance(numeric.dtype, np.dtype):
+            values = numeric.to_numpy()
+        else:
+            values = numeric.to_numpy(dtype=np.float64, na_value=np.nan)
+
+        is_null = raw.isna().to_numpy()
+        if raw.dtype == object:
+            is_null |= (raw == '').to_numpy()
+        if len(is_null):
+            null_cells = self.cells[np.logical_or.reduceat(is_null, self.segment_starts)]
+        else:
+            null_cells = self.cells
+
+        # 列统计：排序后的非空取值与空值比例，用于预估筛选项的选择性
+        non_null = values[~np.isnan(values)] if values.dtype.kind == 'f' else values
+        trait = {
+            'values': values,
+            'has_null': self._pack_cells(null_cells),
+            'sorted_values': np.sort(non_null),
+            'null_fraction': float(is_null.mean()) if len(is_null) else 0.0,
+        }
+        self._traits[field] = trait
+        return trait
+
+    def estimate_pass_rate(self, field: str, min_val=0, max_val=100, min_match_months: int = 3,
+                           treat_empty_as_match: bool = False) -> float:
+        """按列统计预估牛只通过率
+
+        记录落在范围内的比例近似为单元格符合的概率，牛只通过率按二项分布估计
+        （各月份独立）；只用于确定筛选项的执行顺序。
+        """
+        trait = self._trait(field)
+        sorted_values = trait['sorted_values']
+        total = len(trait['values'])
+        if total == 0 or self.n_cows == 0 or self.n_months == 0:
+            return 1.0 if treat_empty_as_match else 0.0
+
+        in_range = (np.searchsorted(sorted_values, max_val, side='right')
+                    - np.searchsorted(sorted_values, min_val, side='left'))
+        cell_probability = max(int(in_range), 0) / total
+        if treat_empty_as_match:
+            present_ratio = len(self.cells) / (self.n_cows * self.n_months)
+            cell_probability = (min(cell_probability + trait['null_fraction'], 1.0) * present_ratio
+                                + (1 - present_ratio))
+        return binomial_tail(self.n_months, cell_probability, min_match_months)
+
+    def matching_cows(self, field: str, min_val=0, max_val=100, min_match_months: int = 3,
+                      treat_empty_as_match: bool = False, candidates: Optional[np.ndarray] = None) -> np.ndarray:
+        """符合某性状条件的月份数达到要求的牛只位图
+
+        某月至少一条记录落在[min_val, max_val]内即符合；treat_empty_as_match时，
+        该月有空值记录或没有数据也算符合。给定candidates位图时只计算其中牛只的单元格。
+        """
+        trait = self._trait(field)
+        values = trait['values']
+        cells = self.cells
+        starts = self.segment_starts
+        if candidates is not None:
+            candidate_cows = np.unpackbits(candidates, count=self.n_cows).astype(bool)
+            cell_selected = candidate_cows[cells // self.n_months]
+            values = values[np.repeat(cell_selected, self.segment_lengths)]
+            lengths = self.segment_lengths[cell_selected]
+            cells = cells[cell_selected]
+            starts = np.cumsum(lengths) - lengths
+
+        if len(values):
+            with np.errstate(invalid='ignore'):
+                row_pass = (values >= min_val) & (values <= max_val)
+            in_range = self._pack_cells(cells[np.logical_or.reduceat(row_pass, starts)])
+        else:
+            in_range = self._pack_cells(cells)
+
+        if treat_empty_as_match:
+            matched = in_range | trait['has_null'] | ~self.present
+            eligible = np.full_like(self.cows_with_data, 0xFF)
+        else:
+            matched = in_range
+            eligible = self.cows_with_data
+        if candidates is not None:
+            eligible = eligible & candidates
+
+        counts = np.unpackbits(matched, axis=1, count=self.n_cows).sum(axis=0)
+        return np.packbits(counts >= min_match_months) & eligible
+
+    def plan(self, special_filters: Dict[str, Dict]) -> List[Tuple[str, Dict, float]]:
+        """执行计划：可用的筛选项按预估通过率从低到高排列"""
+        steps = []
+        for filter_name, filter_config in special_filters.items():
+            field = filter_config.get('field')
+            if not field or field not in self.df.columns:
+                logger.warning(f"跳过筛选项{filter_name}：字段{field}不存在")
+                continue
+            estimated = self.estimate_pass_rate(
+                field,
+                filter_config.get('min', 0),
+                filter_config.get('max', 100),
+                filter_config.get('min_match_months', 3),
+                filter_config.get('treat_empty_as_match', False),
+            )
+            steps.append((filter_name, filter_config, estimated))
+        steps.sort(key=lambda step: step[2])
+        return steps
+
+    def query(self, special_filters: Dict[str, Dict], should_stop=None) -> Optional[np.ndarray]:
+        """所有启用的筛选项都符合的牛只位图；没有可用的筛选项时返回None，被取消时返回空位图
+
+        按plan的顺序执行，后面的筛选项只计算仍在候选中的牛只，候选为空时不再计算。
+        """
+        self.last_plan = []
+        result = None
+        for filter_name, filter_config, estimated in self.plan(special_filters):
+            if should_stop and should_stop():
+                logger.info("筛选被用户取消")
+                return np.zeros((self.n_cows + 7) // 8, dtype=np.uint8)
+
+            if result is not None and not result.any():
+                self.last_plan.append({'filter': filter_name, 'skipped': True})
+                continue
+
+            min_match_months = filter_config.get('min_match_months', 3)
+            treat_empty_as_match = filter_config.get('treat_empty_as_match', False)
+            candidates = self.n_cows if result is None else popcount(result)
+            started = time.perf_counter()
+            result = self.matching_cows(
+                filter_config['field'],
+                filter_config.get('min', 0),
+                filter_config.get('max', 100),
+                min_match_months,
+                treat_empty_as_match,
+                candidates=result,
+            )
+            passed = popcount(result)
+            self.last_plan.append({
+                'filter': filter_name,
+                'estimated': estimated,
+                'candidates': candidates,
+                'passed': passed,
+                'seconds': time.perf_counter() - started,
+            })
+            logger.info(f"筛选项{filter_name}: {passed}/{candidates}头牛通过（需要{min_match_months}个月，"
+                        f"treat_empty_as_match={treat_empty_as_match}）")
+        return result
+
+    def rows_for(self, bitmap: np.ndarray) -> np.ndarray:
+        """位图中牛只的全部行（布尔掩码，对应self.df）"""
+        cow_pass = np.unpackbits(bitmap, count=self.n_cows).astype(bool)
+        mask = self.keyed_rows.copy()
+        mask[mask] = cow_pass[self.row_cow_idx[mask]]
+        return mask
@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+"""规范化阶段微基准：对比逐关键字/逐字段的旧实现与合并后的规范化阶段（行/秒）"""
+import argparse
+import logging
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+PROJECT_ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(PROJECT_ROOT))
+
+from data_processor import DataProcessor  # noqa: E402
+
+SUMMARY_KEYWORDS = ["小计", "平均与总计", "合计", "总计", "平均"]
+
+
+def build_frame(rows: int, seed: int = 0) -> pd.DataFrame:
+    """构造带汇总行和占位符的原始报表（列名已映射为英文字段）"""
+    rng = np.random.default_rng(seed)
+    protein = rng.normal(3.3, 0.3, rows).round(2).astype(object)
+    protein[rng.random(rows) < 0.03] = '-'
+    scc = rng.gamma(1.2, 30, rows).round(1).astype(object)
+    scc[rng.random(rows) < 0.02] = '—'
+    management_ids = np.array([f'{i % 3000:05d}' for i in range(rows)], dtype=object)
+    management_ids[::500] = '平均'
+    return pd.DataFrame({
+        'farm_id': np.where(np.arange(rows) % 2, 'F001', 'F002'),
+        'management_id': management_ids,
+        'parity': rng.integers(1, 8, rows),
+        'sample_date': pd.Series(pd.date_range('2024-01-01', periods=28).strftime('%Y-%m-%d'))
+        .sample(rows, replace=True, random_state=seed).to_numpy(),
+        'protein_pct': protein,
+        'fat_pct': rng.normal(3.9, 0.4, rows).round(2),
+        'lactation_days': rng.integers(5, 400, rows).astype(float),
+        'milk_yield': rng.normal(30, 6, rows).round(1),
+        'somatic_cell_count': scc,
+    })
+
+
+def legacy_normalize(df: pd.DataFrame) -> pd.DataFrame:
+    """旧实现：逐关键字str.contains，逐字段转换（日期格式逐文件推断，管理号逐行intern）"""
+    id_values = df['management_id'].astype(str)
+    keep = pd.Series([True] * len(df))
+    for keyword in SUMMARY_KEYWORDS:
+        keep = keep & ~id_values.str.contains(keyword, na=False, case=False)
+    df = df[keep].copy()
+
+    for field in ['farm_id', 'management_id']:
+        values = df[field].astype(object).where(df[field].notna(), None).astype(str)
+        values = values.where(~values.isin(['nan', 'None', '']), None)
+        if field == 'management_id':
+            values = values.map(lambda value: sys.intern(value) if isinstance(value, str) else value)
+        df[field] = values
+    df['sample_date'] = pd.to_datetime(df['sample_date'], errors='coerce')
+    for field in ['parity', 'protein_pct', 'fat_pct', 'lactation_days', 'milk_yield', 'somatic_cell_count']:
+        df[field] = pd.to_numeric(df[field], errors='coerce')
+    return df
+
+
+def compiled_normalize(processor: DataProcessor, df: pd.DataFrame) -> pd.DataFrame:
+    """新实现：合并正则过滤汇总行，按field_schema一次转换"""
+    df = processor.normalizer.filter_summary_rows(df, 'management_id', SUMMARY_KEYWORDS)
+    processor.normalizer.cast_frame(df)
+    return df
+
+
+def measure(func, frame: pd.DataFrame, repeat: int) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        data = frame.copy()
+        start = time.perf_counter()
+        func(data)
+        best = min(best, time.perf_counter() - start)
+    return len(frame) / best
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--rows', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    logging.disable(logging.CRITICAL)
+    processor = DataProcessor(rules_file=str(PROJECT_ROOT / 'rules.yaml'),
+                              config_file=str(PROJECT_ROOT / 'config.yaml'))
+    frame = build_frame(args.rows)
+
+    before = measure(legacy_normalize, frame, args.repeat)
+    after = measure(lambda data: compiled_normalize(processor, data), frame, args.repeat)
+    print(f"rows: {args.rows}")
+    print(f"before: {before:,.0f} rows/sec")
+    print(f"after:  {after:,.0f} rows/sec ({after / before:.1f}x)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,566 @@
+import os
+import tempfile
+import time
+import unittest
+import zipfile
+from unittest import mock
+
+import pandas as pd
+
+from columnar_store import ParseCache
+from data_processor import DataProcessor
+from header_templates import HeaderTemplateRegistry
+
+
+def write_dhi_report(path, month, cow_count=5, farm_id='F001'):
+    """写入一个带标题行和汇总行的综合测定结果表"""
+    report = pd.DataFrame({
+        '牛场编号': [farm_id] * cow_count,
+        '管理号': [f'{i + 1}' for i in range(cow_count)],
+        '胎次(胎)': [1 + i % 3 for i in range(cow_count)],
+        '采样日期': [f'{month}-15'] * cow_count,
+        '蛋白率(%)': [3.0 + i * 0.1 for i in range(cow_count)],
+        '泌乳天数(天)': [30 + i * 20 for i in range(cow_count)],
+        '产奶量(Kg)': [30.0 + i for i in range(cow_count)],
+        '体细胞数(万/ml)': [10.0 + i * 5 for i in range(cow_count)],
+    })
+    with pd.ExcelWriter(path) as writer:
+        pd.DataFrame([['综合测定结果表']]).to_excel(writer, header=False, index=False)
+        report.to_excel(writer, index=False, startrow=2)
+
+
+class ParallelIngestTest(unittest.TestCase):
+    def test_results_follow_upload_order(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            months = ['2024-03', '2024-01', '2024-02']
+            file_paths = []
+            for i, month in enumerate(months):
+                path = os.path.join(temp_dir, f'{month}.xlsx')
+                write_dhi_report(path, month, cow_count=3 + i)
+                file_paths.append(path)
+            file_paths.append(os.path.join(temp_dir, 'notes.txt'))
+            filenames = [os.path.basename(path) for path in file_paths]
+
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            done = []
+            results = processor.parse_files_parallel(
+                file_paths, filenames, max_workers=2,
+                on_file_done=lambda index, *_: done.append(index),
+            )
+
+        self.assertEqual(sorted(done), [0, 1, 2, 3])
+        self.assertEqual([success for success, _, _ in results], [True, True, True, False])
+        self.assertEqual([len(df) for _, _, df in results[:3]], [3, 4, 5])
+        self.assertEqual(
+            [df['sample_date'].iloc[0].strftime('%Y-%m') for _, _, df in results[:3]],
+            months,
+        )
+
+
+class HeaderDetectionTest(unittest.TestCase):
+    def test_detects_header_below_title_and_blank_rows(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'report.xlsx')
+            write_dhi_report(path, '2024-01')
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+
+            header_row = processor._detect_header_row(path)
+            columns = list(pd.read_excel(path, header=header_row, nrows=1).columns)
+
+        self.assertEqual(header_row, 2)
+        self.assertEqual(columns[:2], ['牛场编号', '管理号'])
+
+
+class HeaderTemplateTest(unittest.TestCase):
+    def test_same_layout_skips_header_detection(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for month in ['2024-01', '2024-02']:
+                path = os.path.join(temp_dir, f'{month}.xlsx')
+                write_dhi_report(path, month)
+                paths.append(path)
+            flat_path = os.path.join(temp_dir, 'flat.xlsx')
+            pd.DataFrame({'管理号': ['9'], '胎次(胎)': [2], '采样日期': ['2024-03-15']}).to_excel(flat_path, index=False)
+
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            first = processor.process_uploaded_file(paths[0], '2024-01.xlsx')
+            # 新实例从磁盘读取注册表
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            with mock.patch.object(processor, '_detect_header_row', wraps=processor._detect_header_row) as detect:
+                second = processor.process_uploaded_file(paths[1], '2024-02.xlsx')
+                detect.assert_not_called()
+                flat = processor.process_uploaded_file(flat_path, 'flat.xlsx')
+                detect.assert_called_once()
+
+        self.assertTrue(second[0])
+        self.assertEqual(list(second[2].columns), list(first[2].columns))
+        self.assertEqual(second[2]['sample_date'].iloc[0], pd.Timestamp('2024-02-15'))
+        self.assertTrue(flat[0])
+        self.assertEqual(flat[2]['management_id'].tolist(), ['9'])
+
+    def test_mixed_layouts_hit_their_templates_from_one_preview(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            paths = []
+            for month in ['2024-01', '2024-02']:
+                report_path = os.path.join(temp_dir, f'report-{month}.xlsx')
+                write_dhi_report(report_path, month)
+                flat_path = os.path.join(temp_dir, f'flat-{month}.xlsx')
+                pd.DataFrame({'管理号': ['9'], '胎次(胎)': [2], '采样日期': [f'{month}-15'],
+                              None: [1]}).to_excel(flat_path, index=False)
+                paths.append((report_path, flat_path))
+
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            for path in paths[0]:
+                self.assertTrue(processor.process_uploaded_file(path, os.path.basename(path))[0])
+
+            # 两种表头行不同的布局都从同一份预览命中模板：每个文件只有预览和整表两次读取
+            with mock.patch.object(processor, '_detect_header_row') as detect, \
+                    mock.patch('data_processor.pd.read_excel', wraps=pd.read_excel) as read_excel:
+                results = [processor.process_uploaded_file(path, os.path.basename(path)) for path in paths[1]]
+            detect.assert_not_called()
+
+        self.assertEqual(read_excel.call_count, 4)
+        self.assertEqual([result[2]['sample_date'].iloc[0] for result in results], [pd.Timestamp('2024-02-15')] * 2)
+        self.assertEqual(results[1][2]['management_id'].tolist(), ['9'])
+
+
+    def test_lookup_hit_refreshes_recency_for_ordering_and_eviction(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'header_templates.json')
+            registry = HeaderTemplateRegistry(path, 'v1')
+            clock = [1.0]
+            with mock.patch('header_templates.time.time', lambda: clock[0]):
+                registry.register(['管理号', '胎次'], 0, {'管理号': 'management_id'})
+                clock[0] = 2.0
+                registry.register(['牛号', '胎次'], 2, {'牛号': 'management_id'})
+                self.assertEqual(registry.header_rows(), [2, 0])
+                clock[0] = 100.0
+                self.assertIsNotNone(registry.lookup(['管理号', '胎次'], 0))
+
+            self.assertEqual(registry.header_rows(), [0, 2])
+            # 命中记录已写回，新实例读到同样的顺序；超出上限时淘汰最久未使用的模板
+            reloaded = HeaderTemplateRegistry(path, 'v1')
+            self.assertEqual(reloaded.header_rows(), [0, 2])
+            with mock.patch('header_templates.MAX_TEMPLATES', 2):
+                reloaded.register(['耳号', '胎次'], 1, {'耳号': 'ear_tag'})
+            self.assertEqual(sorted(reloaded.header_rows()), [0, 1])
+
+
+class FieldSchemaTest(unittest.TestCase):
+    def test_compact_dtypes_and_memory_report(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, '2024-01.xlsx')
+            write_dhi_report(path, '2024-01', cow_count=200)
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            _, _, df = processor.process_uploaded_file(path, '2024-01.xlsx')
+            unified = processor.unify_farm_ids([{'filename': '2024-01.xlsx', 'data': df}], 'F009')
+
+        self.assertEqual(str(df['farm_id'].dtype), 'category')
+        self.assertEqual(str(df['parity'].dtype), 'Int8')
+        self.assertEqual(str(df['lactation_days'].dtype), 'Int16')
+        self.assertEqual(df['protein_pct'].dtype, 'float32')
+        self.assertEqual(df['somatic_cell_count'].dtype, 'float64')
+        report = df.attrs['memory_report']
+        self.assertLess(report['after_bytes'], report['before_bytes'])
+        self.assertIn('protein_pct', report['columns'])
+        self.assertEqual(unified[0]['data']['farm_id'].unique().tolist(), ['F009'])
+
+
+class CrossMonthFilterTest(unittest.TestCase):
+    def test_keeps_cows_matching_in_every_selected_month(self):
+        def month_frame(month, rows):
+            return pd.DataFrame({
+                'farm_id': [farm for farm, _, _ in rows],
+                'management_id': [cow for _, cow, _ in rows],
+                'sample_date': pd.to_datetime([f'{month}-15'] * len(rows)),
+                'protein_pct': [value for _, _, value in rows],
+            })
+
+        data_list = [
+            {'filename': 'jan.xlsx', 'date_range': {'start': '2024-01-15'},
+             'data': month_frame('2024-01', [('F001', '1', 3.2), ('F001', '2', 3.3), ('F002', '1', 3.1), ('F001', None, 3.2)])},
+            {'filename': 'feb.xlsx', 'date_range': {'start': '2024-02-15'},
+             'data': month_frame('2024-02', [('F001', '1', 3.4), ('F001', '2', 2.1), ('F002', '1', 3.0), ('F001', None, 3.2)])},
+        ]
+        filters = {'protein_pct': {'field': 'protein_pct', 'enabled': True, 'min': 3.0, 'max': 4.0}}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            result = processor.apply_cross_month_filters(data_list, filters, ['jan.xlsx', 'feb.xlsx'])
+
+        self.assertEqual(
+            sorted(zip(result['farm_id'], result['management_id'], result['year_month'])),
+            [('F001', '1', '2024-01'), ('F001', '1', '2024-02'), ('F002', '1', '2024-01'), ('F002', '1', '2024-02')],
+        )
+        self.assertNotIn('cow_key', result.columns)
+
+
+class PartialMonthFilterTest(unittest.TestCase):
+    def test_counts_matching_months_per_cow(self):
+        data_list = []
+        for month, values in [('2024-01', [3.2, 3.3, 2.0]), ('2024-02', [3.4, None, 2.1]), ('2024-03', [2.5, None])]:
+            data_list.append({'filename': f'{month}.xlsx', 'data': pd.DataFrame({
+                'farm_id': ['F001'] * len(values),
+                'management_id': ['1', '2', '3'][:len(values)],
+                'sample_date': pd.to_datetime([f'{month}-15'] * len(values)),
+                'protein_pct': values,
+            })})
+        filters = {'protein_pct': {'field': 'protein_pct', 'enabled': True, 'min': 3.0, 'max': 4.0}}
+        selected = [item['filename'] for item in data_list]
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            strict = processor.apply_partial_month_filters(data_list, filters, selected, 2, False)
+            lenient = processor.apply_partial_month_filters(data_list, filters, selected, 2, True)
+
+        # 空值不符合：只有1号牛有两个月在范围内；空值符合：2号牛的空值月份和缺测月份也计入
+        self.assertEqual(sorted(strict['management_id'].unique()), ['1'])
+        self.assertEqual(sorted(lenient['management_id'].unique()), ['1', '2'])
+        self.assertEqual(len(lenient), 6)
+        self.assertNotIn('cow_key', lenient.columns)
+
+
+class FilterResultCacheTest(unittest.TestCase):
+    def test_reuses_results_until_data_changes(self):
+        def month_frame(month, values):
+            return pd.DataFrame({
+                'farm_id': ['F001'] * len(values),
+                'management_id': [str(i + 1) for i in range(len(values))],
+                'sample_date': pd.to_datetime([f'{month}-15'] * len(values)),
+                'protein_pct': values,
+            })
+
+        data_list = [{'filename': 'jan.xlsx', 'data': month_frame('2024-01', [3.2, 2.0])}]
+        filters = {'protein_pct': {'field': 'protein_pct', 'enabled': True, 'min': 3.0, 'max': 4.0,
+                                   'min_match_months': 1}}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            first = processor.apply_multi_filter_logic(data_list, filters, ['jan.xlsx'])
+            with mock.patch.object(processor, '_run_multi_filter_logic') as run:
+                second = processor.apply_multi_filter_logic(data_list, filters, ['jan.xlsx'])
+            run.assert_not_called()
+
+            data_list = processor.unify_farm_ids(data_list, 'F009')
+            third = processor.apply_multi_filter_logic(data_list, filters, ['jan.xlsx'])
+
+        pd.testing.assert_frame_equal(first, second)
+        self.assertEqual(third['farm_id'].tolist(), ['F009'])
+
+    def test_keeps_cows_from_files_without_farm_id(self):
+        data_list = [
+            {'filename': 'new.xlsx', 'data': pd.DataFrame({
+                'farm_id': ['F001', 'F001'],
+                'management_id': ['1', '2'],
+                'sample_date': pd.to_datetime(['2024-01-15'] * 2),
+                'protein_pct': [3.2, 3.3],
+            })},
+            # 旧格式文件没有牛场编号列
+            {'filename': 'old.xlsx', 'data': pd.DataFrame({
+                'management_id': ['7', '8', '9'],
+                'sample_date': pd.to_datetime(['2024-01-20'] * 3),
+                'protein_pct': [3.4, 3.5, 2.0],
+            })},
+        ]
+        filters = {'protein_pct': {'field': 'protein_pct', 'enabled': True, 'min': 3.0, 'max': 4.0,
+                                   'min_match_months': 1}}
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            result = processor.apply_multi_filter_logic(data_list, filters, ['new.xlsx', 'old.xlsx'])
+
+        self.assertEqual(sorted(result['management_id']), ['1', '2', '7', '8'])
+        self.assertEqual(result['farm_id'].isna().sum(), 2)
+
+
+class FileSignatureCacheTest(unittest.TestCase):
+    def test_recomputes_replaced_frame_and_drops_removed_files(self):
+        def month_frame(values):
+            return pd.DataFrame({
+                'management_id': [str(i + 1) for i in range(len(values))],
+                'protein_pct': values,
+            })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            jan = month_frame([3.1, 3.2])
+            first = processor.file_signature('jan.xlsx', jan)
+            self.assertIs(processor.file_signature('jan.xlsx', jan), first)
+
+            # 同形状的新对象（即使id被复用）必须重新计算签名
+            with mock.patch('data_processor.id', create=True, return_value=1):
+                replaced = processor.file_signature('jan.xlsx', month_frame([3.5, 3.6]))
+            self.assertIsNot(replaced, first)
+
+            processor.detect_duplicate_data([{'filename': 'feb.xlsx', 'data': month_frame([3.0, 3.3])}])
+            self.assertEqual(list(processor._file_signatures), ['feb.xlsx'])
+
+
+class HistoryFillTest(unittest.TestCase):
+    def test_fills_several_fields_per_cow_in_date_order(self):
+        df = pd.DataFrame({
+            'management_id': ['2', '1', '1', '1', '2', None],
+            'sample_date': pd.to_datetime(['2024-01-15', '2024-03-15', '2024-01-15', '2024-02-15',
+                                           '2024-02-15', '2024-01-15']),
+            'protein_pct': [None, None, 3.1, None, 3.4, None],
+            'somatic_cell_count': [20.0, 30.0, None, None, None, 10.0],
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            filled = processor._fill_empty_values_with_history(df, ['protein_pct', 'somatic_cell_count'])
+
+        self.assertEqual(filled['management_id'].tolist(), ['1', '1', '1', '2', '2'])
+        self.assertEqual(filled['protein_pct'].tolist(), [3.1, 3.1, 3.1, 3.4, 3.4])
+        self.assertEqual(filled['somatic_cell_count'].tolist(), [30.0, 30.0, 30.0, 20.0, 20.0])
+        self.assertEqual(filled['protein_pct_historical_filled'].tolist(), [False, True, True, True, False])
+        self.assertEqual(filled['somatic_cell_count_historical_filled'].tolist(), [True, True, False, False, True])
+
+
+class FutureLactationDaysTest(unittest.TestCase):
+    def setUp(self):
+        self.df = pd.DataFrame({
+            'farm_id': ['F001'] * 5,
+            'management_id': ['1', '1', '2', '2', '3'],
+            'parity': [1, 1, 2, 2, 1],
+            'sample_date': pd.to_datetime(['2024-01-15', '2024-02-15', '2024-01-15', '2024-02-10', '2024-02-15']),
+            'lactation_days': [100, 131, 300, None, 20],
+            'milk_yield': [30.0, 31.0, 25.0, 24.0, 35.0],
+        })
+
+    def test_last_record_per_cow_for_several_plan_dates(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            single = processor._calculate_future_lactation_days(self.df, pd.Timestamp('2024-03-15'))
+            multi = processor._calculate_future_lactation_days(
+                self.df, [pd.Timestamp('2024-03-15'), pd.Timestamp('2023-12-01')])
+
+        self.assertEqual(single['management_id'].tolist(), ['1', '2', '3'])
+        self.assertEqual(single['future_lactation_days'].tolist()[0], 160)
+        self.assertTrue(pd.isna(single['future_lactation_days'].iloc[1]))
+        self.assertEqual(single['days_from_last_sample'].tolist()[2], 29)
+        self.assertEqual(multi[DataProcessor.future_days_column('2024-03-15')].tolist()[2], 49)
+        self.assertTrue(pd.isna(multi[DataProcessor.future_days_column('2023-12-01')].iloc[2]))
+
+    def test_monthly_report_adds_one_column_per_plan_date(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            report = processor.create_monthly_report(
+                self.df, ['management_id', 'parity', 'lactation_days', 'milk_yield'], ['2024-03-15', '2024-04-14'])
+
+        self.assertEqual(report['未来泌乳天数(天)'].tolist(), [160, 334, 49])
+        self.assertEqual(report['未来泌乳天数(天)[2024-04-14]'].tolist(), [190, 364, 79])
+        self.assertEqual(list(report.columns[-2:]), ['未来泌乳天数(天)', '未来泌乳天数(天)[2024-04-14]'])
+
+
+class MonthlyReportTest(unittest.TestCase):
+    def test_keeps_last_record_per_month_and_weights_by_milk(self):
+        df = pd.DataFrame({
+            'farm_id': ['F001'] * 5,
+            'management_id': ['1', '1', '1', '2', '2'],
+            'parity': [1, 1, 2, 3, None],
+            'sample_date': pd.to_datetime(['2024-01-10', '2024-01-20', '2024-02-15', '2024-02-15', '2024-01-15']),
+            'protein_pct': [9.9, 3.0, 3.6, 3.2, None],
+            'milk_yield': [10.0, 20.0, 40.0, 30.0, 25.0],
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            report = processor.create_monthly_report(df, ['management_id', 'parity', 'protein_pct', 'milk_yield'])
+
+        self.assertEqual(list(report.columns), [
+            'farm_id', 'management_id', 'parity', '2024年01月蛋白率(%)', '2024年01月产奶量(Kg)',
+            '2024年02月蛋白率(%)', '2024年02月产奶量(Kg)', '平均蛋白率(%)', '最后一次采样日', '未来泌乳天数(天)'])
+        self.assertEqual(report['parity'].tolist(), [2, 3])
+        self.assertEqual(report['2024年01月蛋白率(%)'].tolist()[0], 3.0)
+        self.assertEqual(report['平均蛋白率(%)'].tolist(), [3.4, 3.2])
+        self.assertEqual(report['最后一次采样日'].tolist(), ['2024-02-15', '2024-02-15'])
+        self.assertEqual(report.attrs['overall_protein_avg'], 3.33)
+        self.assertEqual(report.attrs['monthly_averages']['2024年02月蛋白率(%)'], 3.43)
+        self.assertNotIn('monthly_aggregates', report.attrs)
+        self.assertEqual(processor.report_aggregates(report).months, ['2024年01月', '2024年02月'])
+
+        # 剔除一头牛后由汇总表重算，与只用剩余数据生成的报告一致
+        refreshed = processor.refresh_report_summary(report[report['management_id'] == '1'])
+        expected = processor.create_monthly_report(
+            df[df['management_id'] == '1'], ['management_id', 'parity', 'protein_pct', 'milk_yield'])
+        self.assertEqual(refreshed.attrs['overall_protein_avg'], expected.attrs['overall_protein_avg'])
+        self.assertEqual(refreshed.attrs['monthly_averages'], expected.attrs['monthly_averages'])
+        self.assertEqual(refreshed.attrs['parity_avg'], 2)
+        self.assertEqual(report.attrs['overall_protein_avg'], 3.33)
+
+
+    def test_cached_report_is_rebuilt_when_its_aggregates_were_evicted(self):
+        df = pd.DataFrame({
+            'management_id': ['1', '2'],
+            'sample_date': pd.to_datetime(['2024-01-15', '2024-01-15']),
+            'milk_yield': [30.0, 20.0],
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            first = processor.create_monthly_report(df, ['management_id', 'milk_yield'], filter_key='k')
+            with mock.patch.object(processor, '_build_monthly_report') as build:
+                cached = processor.create_monthly_report(df, ['management_id', 'milk_yield'], filter_key='k')
+            build.assert_not_called()
+            self.assertIs(processor.report_aggregates(cached), processor.report_aggregates(first))
+
+            processor._report_aggregates.clear()
+            rebuilt = processor.create_monthly_report(df, ['management_id', 'milk_yield'], filter_key='k')
+            refreshed = processor.refresh_report_summary(rebuilt[rebuilt['management_id'] == '1'])
+
+        self.assertEqual(refreshed.attrs['monthly_averages']['2024年01月产奶量(Kg)'], 30.0)
+
+    def test_cow_average_rounds_like_legacy_on_boundary_value(self):
+        df = pd.DataFrame({
+            'farm_id': ['F001', 'F001'],
+            'management_id': ['1', '2'],
+            'sample_date': pd.to_datetime(['2024-01-15', '2024-01-15']),
+            'protein_pct': [1.575, 1.575],
+            'milk_yield': [1.0, None],
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            report = processor.create_monthly_report(df, ['management_id', 'protein_pct'])
+
+        # 旧版逐条累加为Python float：round(1.575, 2) == 1.57
+        self.assertEqual(report['平均蛋白率(%)'].tolist()[0], 1.57)
+
+
+    def test_summary_attrs_match_legacy_rounding_and_summation_order(self):
+        df = pd.DataFrame({
+            'farm_id': ['F001', 'F002', 'F002'],
+            'management_id': ['1', '2', '3'],
+            'sample_date': pd.to_datetime(['2024-01-15'] * 3),
+            'protein_pct': [1.575, 1.575, 1.575],
+            'milk_yield': [1.0, None, None],
+            'somatic_cell_count': [2.3, 1.05, 1.3],
+        })
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            report = processor.create_monthly_report(
+                df, ['farm_id', 'management_id', 'protein_pct', 'somatic_cell_count'])
+
+        # 旧版：总平均值逐条累加为Python float；各月平均值对报告列按行顺序求平均（先分牛场求和会得到1.55）
+        self.assertEqual(report.attrs['overall_protein_avg'], 1.57)
+        self.assertEqual(report.attrs['monthly_averages']['2024年01月体细胞数(万/ml)'], 1.5)
+        self.assertEqual(report.attrs['monthly_averages']['2024年01月蛋白率(%)'], 1.58)
+
+
+class ZipMemberResolutionTest(unittest.TestCase):
+    def test_reads_highest_priority_member_only(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report_path = os.path.join(temp_dir, 'report.xlsx')
+            write_dhi_report(report_path, '2024-05', cow_count=4)
+            zip_path = os.path.join(temp_dir, '123(2024-05).zip')
+            with zipfile.ZipFile(zip_path, 'w') as archive:
+                archive.writestr('lab/统计表.xlsx', b'excluded')
+                archive.writestr('lab/说明.pdf', b'pdf')
+                archive.writestr('lab/综合测定结果表.xlsx', b'lower priority')
+                archive.write(report_path, 'lab/04-2综合测定结果表.xlsx')
+
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+            with zipfile.ZipFile(zip_path) as archive:
+                member, member_name, found_files = processor._resolve_zip_member(archive)
+            success, _, df = processor.process_uploaded_file(zip_path, '123(2024-05).zip')
+
+        self.assertEqual(member.filename, 'lab/04-2综合测定结果表.xlsx')
+        self.assertEqual(member_name, '04-2综合测定结果表.xlsx')
+        self.assertEqual(len(found_files), 4)
+        self.assertTrue(success)
+        self.assertEqual(len(df), 4)
+
+
+class ParseCacheTest(unittest.TestCase):
+    def test_reupload_skips_excel_parsing(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, '2024-01.xlsx')
+            write_dhi_report(path, '2024-01')
+            processor = DataProcessor(temp_dir=os.path.join(temp_dir, 'temp'))
+
+            first = processor.process_uploaded_file(path, '2024-01.xlsx')
+            with mock.patch.object(processor, '_process_excel_file') as parse:
+                second = processor.process_uploaded_file(path, '2024-01.xlsx')
+
+        parse.assert_not_called()
+        self.assertTrue(second[0])
+        pd.testing.assert_frame_equal(first[2], second[2])
+
+    def test_evicts_expired_and_oversize_entries(self):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            cache = ParseCache(temp_dir, retention_hours=1, max_bytes=10 ** 9)
+            df = pd.DataFrame({'management_id': ['1', '2'], 'protein_pct': [3.1, 3.2]})
+            cache.put('old', df)
+            cache.put('new', df)
+            stale = time.time() - 2 * 3600
+            for name in os.listdir(temp_dir):
+                if name.startswith('old'):
+                    os.utime(os.path.join(temp_dir, name), (stale, stale))
+
+            self.assertEqual(cache.evict()['expired'], 1)
+            self.assertIsNone(cache.get('old'))
+            self.assertIsNotNone(cache.get('new'))
+
+            cache.max_bytes = 0
+            self.assertEqual(cache.evict()['oversize'], 1)
+            self.assertIsNone(cache.get('new'))
+
+
+class TempDataStoreTest(unittest.TestCase):
+    def test_round_trip_with_projection_and_pushdown(self):
+        df = pd.DataFrame({
+            'farm_id': ['F001', 'F002', 'F001', 'F001'],
+            'management_id': ['001', '002', '003', '001'],
+            'sample_date': pd.to_datetime(['2024-01-10', '2024-01-12', '2024-02-10', '2024-02-11']),
+            'protein_pct': [3.1, 3.2, 3.3, 3.4],
+            'lactation_days': pd.array([10, None, 40, 41], dtype='Int64'),
+        })
+        df.attrs['source'] = '2024.xlsx'
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            processor.save_temp_data(df, 'batch')
+
+            full = processor.load_temp_data('batch')
+            subset = processor.load_temp_data(
+                'batch', columns=['management_id', 'protein_pct'],
+                months=['2024-02'], farm_ids=['F001'],
+            )
+
+        pd.testing.assert_frame_equal(full, df)
+        self.assertEqual(full.attrs, {'source': '2024.xlsx'})
+        self.assertEqual(list(subset.columns), ['management_id', 'protein_pct'])
+        self.assertEqual(subset['management_id'].tolist(), ['003', '001'])
+
+    def test_mixed_type_column_falls_back_and_failed_save_keeps_old_data(self):
+        mixed = pd.DataFrame({'management_id': ['1', '2'], 'note': ['a', 1.5]})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            processor.save_temp_data(mixed, 'f1')
+            pd.testing.assert_frame_equal(processor.load_temp_data('f1'), mixed)
+
+            replacement = mixed.assign(note=['b', 2.5])
+            with mock.patch.object(pd.DataFrame, 'to_pickle', side_effect=OSError('disk full')):
+                with self.assertRaises(OSError):
+                    processor.save_temp_data(replacement, 'f1')
+
+            pd.testing.assert_frame_equal(processor.load_temp_data('f1'), mixed)
+            self.assertEqual(os.listdir(processor.temp_store.root_dir), ['f1'])
+
+    def test_cleanup_removes_temp_data_and_keeps_parse_cache(self):
+        df = pd.DataFrame({'management_id': ['1'], 'sample_date': pd.to_datetime(['2024-01-10'])})
+        with tempfile.TemporaryDirectory() as temp_dir:
+            processor = DataProcessor(temp_dir=temp_dir)
+            processor.save_temp_data(df, 'batch')
+            processor.parse_cache.put('key', df)
+
+            processor.cleanup_temp_files()
+
+            self.assertIsNone(processor.load_temp_data('batch'))
+            self.assertEqual(os.listdir(processor.temp_store.root_dir), [])
+            self.assertIsNotNone(processor.parse_cache.get('key'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from file_signatures import FileSignature, SignatureIndex, minhash, signature_similarity
+
+
+def make_file(ids, month='2024-01', protein=3.2):
+    return pd.DataFrame({
+        'farm_id': ['F001'] * len(ids),
+        'management_id': [str(i) for i in ids],
+        'sample_date': pd.to_datetime([f'{month}-15'] * len(ids)),
+        'protein_pct': [protein + i % 5 * 0.1 for i in range(len(ids))],
+    })
+
+
+class FileSignatureTest(unittest.TestCase):
+    def test_minhash_agreement_tracks_jaccard(self):
+        same = minhash({str(i) for i in range(500)})
+        self.assertTrue(np.array_equal(same, minhash({str(i) for i in range(500)})))
+        half = minhash({str(i) for i in range(250, 750)})
+        agreement = (same == half).mean()
+        self.assertGreater(agreement, 0.15)
+        self.assertLess(agreement, 0.55)
+        self.assertIsNone(minhash(set()))
+
+    def test_similarity_from_signatures(self):
+        df = make_file(range(100))
+        same = signature_similarity(FileSignature(df), FileSignature(df.copy()))
+        self.assertTrue(same['is_duplicate'])
+        self.assertAlmostEqual(same['score'], 1.0)
+
+        other = signature_similarity(FileSignature(df), FileSignature(make_file(range(500, 600), '2024-02')))
+        self.assertFalse(other['is_duplicate'])
+        self.assertEqual(other['details']['field_similarities']['management_id'], 0.0)
+
+    def test_index_returns_overlapping_exact_and_id_less_files(self):
+        index = SignatureIndex()
+        base = make_file(range(300))
+        index.add('base', FileSignature(base))
+        index.add('copy', FileSignature(base.copy()))
+        index.add('overlap', FileSignature(make_file(range(30, 330), '2024-02')))
+        index.add('unrelated', FileSignature(make_file(range(5000, 5300))))
+        index.add('no_ids', FileSignature(base.drop(columns=['management_id'])))
+
+        self.assertEqual(index.candidates('base'), {'copy', 'overlap', 'no_ids'})
+        self.assertEqual(index.candidates('no_ids'), {'base', 'copy', 'overlap', 'unrelated'})
+
+
+if __name__ == '__main__':
+    unittest.main()
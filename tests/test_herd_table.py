@@ -0,0 +1,99 @@
+import unittest
+from unittest import mock
+
+import numpy as np
+import pandas as pd
+
+from herd_table import HerdTable
+
+
+def make_month(month, management_ids, farm_id='F001'):
+    return pd.DataFrame({
+        'farm_id': pd.Series([farm_id] * len(management_ids), dtype='category'),
+        'management_id': management_ids,
+        'sample_date': pd.to_datetime([f'{month}-15'] * len(management_ids)),
+        'somatic_cell_count': [10.0 + i for i in range(len(management_ids))],
+    })
+
+
+class HerdTableTest(unittest.TestCase):
+    def test_sync_prepares_only_new_or_replaced_files(self):
+        table = HerdTable()
+        jan = make_month('2024-01', ['001', '002', None])
+        feb = make_month('2024-02', ['002', '003'])
+        data_list = [{'filename': 'jan.xlsx', 'data': jan}]
+
+        table.sync(data_list)
+        jan_frame = next(table.file_frames())[1]
+        table.sync(data_list + [{'filename': 'feb.xlsx', 'data': feb}])
+
+        self.assertIs(next(table.file_frames())[1], jan_frame)
+        self.assertEqual(table.filenames, ['jan.xlsx', 'feb.xlsx'])
+        self.assertEqual(table.months(), ['2024-01', '2024-02'])
+
+        table.sync([{'filename': 'feb.xlsx', 'data': feb.copy()}])
+        self.assertEqual(table.filenames, ['feb.xlsx'])
+
+    def test_sync_detects_replaced_frame_with_same_shape(self):
+        table = HerdTable()
+        data_list = [{'filename': 'jan.xlsx', 'data': make_month('2024-01', ['001', '002'])}]
+        table.sync(data_list)
+        # 旧对象释放后其id可能被同形状的新对象复用：令所有id相同来模拟这种情况
+        with mock.patch('herd_table.id', create=True, return_value=1):
+            for value in (1.0, 2.0):
+                replacement = make_month('2024-01', ['001', '002'])
+                replacement['somatic_cell_count'] = value
+                data_list[0]['data'] = replacement
+                table.sync(data_list)
+                self.assertEqual(table.frame()['somatic_cell_count'].tolist(), [value, value])
+
+    def test_prepare_shares_source_columns_without_modifying_source(self):
+        jan = make_month('2024-01', ['001', '002'])
+        original = jan.copy()
+        table = HerdTable().sync([{'filename': 'jan.xlsx', 'data': jan}])
+        frame = next(table.file_frames())[1]
+
+        pd.testing.assert_frame_equal(jan, original)
+        self.assertTrue(np.shares_memory(frame['somatic_cell_count'].to_numpy(),
+                                         jan['somatic_cell_count'].to_numpy()))
+
+    def test_cow_keys_are_stable_across_files(self):
+        table = HerdTable().sync([
+            {'filename': 'jan.xlsx', 'data': make_month('2024-01', ['001', '002', None])},
+            {'filename': 'feb.xlsx', 'data': make_month('2024-02', ['002', '003'])},
+            {'filename': 'feb-f2.xlsx', 'data': make_month('2024-02', ['002'], farm_id='F002')},
+        ])
+
+        combined = table.frame()
+        keys = combined.set_index(['source_file', 'management_id'])['cow_key']
+
+        self.assertEqual(combined['cow_key'].dtype, 'int32')
+        self.assertEqual(keys[('jan.xlsx', '002')], keys[('feb.xlsx', '002')])
+        self.assertNotEqual(keys[('feb.xlsx', '002')], keys[('feb-f2.xlsx', '002')])
+        self.assertEqual(combined['cow_key'].iloc[2], -1)
+        self.assertIsNone(combined['management_id'].iloc[2])
+        self.assertEqual(combined['year_month'].tolist()[:2], ['2024-01', '2024-01'])
+        self.assertEqual(table.cow_count, 4)
+        self.assertNotIn('cow_key', table.frame(internal=False).columns)
+
+    def test_file_stats_merge_without_row_data(self):
+        feb = make_month('2024-02', ['002', '003'])
+        feb['somatic_cell_count'] = pd.Series([12.5, None], dtype='float32')
+        table = HerdTable(stats_fields=['somatic_cell_count', 'protein_pct']).sync([
+            {'filename': 'jan.xlsx', 'data': make_month('2024-01', ['001', '002', None])},
+            {'filename': 'feb.xlsx', 'data': feb},
+        ])
+
+        self.assertEqual(table.file_stats('jan.xlsx')['cow_count'], 2)
+        merged = table.merged_stats()
+        self.assertEqual(merged['fields']['somatic_cell_count'],
+                         {'count': 4, 'min': 10.0, 'max': 12.5, 'sum': 45.5})
+        self.assertNotIn('protein_pct', merged['fields'])
+        self.assertEqual(merged['months'], ['2024-01', '2024-02'])
+        self.assertEqual(merged['sample_dates'], (pd.Timestamp('2024-01-15'), pd.Timestamp('2024-02-15')))
+        self.assertEqual(table.management_ids().tolist(), ['001', '002', '003'])
+        self.assertEqual(table.management_ids(['feb.xlsx']).tolist(), ['002', '003'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import pandas as pd
+
+from ingest_normalizer import IngestNormalizer
+
+
+class IngestNormalizerTest(unittest.TestCase):
+    def setUp(self):
+        self.normalizer = IngestNormalizer({
+            'management_id': 'interned_string',
+            'sample_date': 'datetime64[ns]',
+            'protein_pct': 'float32',
+            'parity': 'Int8',
+        })
+
+    def test_filters_summary_rows_with_one_pattern(self):
+        df = pd.DataFrame({'管理号': ['001', '平均与总计', None, '本月小计', 'Total'], 'x': range(5)},
+                          index=[10, 11, 12, 13, 14])
+
+        filtered = self.normalizer.filter_summary_rows(df, '管理号', ['小计', '平均与总计', 'total'])
+
+        self.assertEqual(filtered['x'].tolist(), [0, 2])
+
+    def test_placeholders_become_missing(self):
+        df = pd.DataFrame({
+            'management_id': ['001', '002', '003', '004'],
+            'sample_date': ['2024-03-15', ' 2024-03-16', None, '2024-03-15'],
+            'protein_pct': [3.1, '-', '—', ' 3.4 '],
+            'parity': [1, '/', 2, 3],
+        })
+
+        placeholder_counts = self.normalizer.cast_frame(df)
+
+        self.assertEqual(placeholder_counts, {'protein_pct': 2, 'parity': 1})
+        self.assertEqual(df['protein_pct'].isna().tolist(), [False, True, True, False])
+        self.assertAlmostEqual(float(df['protein_pct'].iloc[3]), 3.4, places=5)
+        self.assertEqual(str(df['parity'].dtype), 'Int8')
+        self.assertEqual(df['sample_date'].dt.day.tolist()[:2], [15, 16])
+        self.assertTrue(pd.isna(df['sample_date'].iloc[2]))
+
+    def test_date_format_is_detected_and_cached(self):
+        first = self.normalizer.parse_dates(pd.Series(['2024/03/15', '2024/03/16']), 'sample_date')
+        self.assertEqual(self.normalizer.date_formats['sample_date'], '%Y/%m/%d')
+
+        second = self.normalizer.parse_dates(pd.Series(['20240415']), 'sample_date')
+
+        self.assertEqual(first.dt.strftime('%Y-%m-%d').tolist(), ['2024-03-15', '2024-03-16'])
+        self.assertEqual(second.iloc[0], pd.Timestamp('2024-04-15'))
+        self.assertEqual(self.normalizer.date_formats['sample_date'], '%Y%m%d')
+
+    def test_values_outside_the_sample_fall_back_to_per_value_parsing(self):
+        text = ['2024-03-15'] * 25 + ['2024/03/16', '16.03.2024', '-', None]
+        parsed = self.normalizer.parse_dates(pd.Series(text), 'sample_date')
+
+        self.assertEqual(self.normalizer.date_formats['sample_date'], '%Y-%m-%d')
+        self.assertEqual(parsed.iloc[25], pd.Timestamp('2024-03-16'))
+        self.assertEqual(parsed.iloc[26], pd.Timestamp('2024-03-16'))
+        self.assertTrue(parsed.iloc[27:].isna().all())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,8 +1,18 @@
 import unittest
+from unittest import mock
 
 import pandas as pd
 
-from mastitis_monitoring import MastitisMonitoringCalculator
+from herd_table import HerdTable
+from mastitis_monitoring import CowMonthMatrix, MastitisMonitoringCalculator
+
+
+def make_test(management_ids, sample_dates, scc):
+    return pd.DataFrame({
+        'management_id': management_ids,
+        'sample_date': pd.to_datetime(sample_dates),
+        'somatic_cell_count': scc,
+    })
 
 
 class ChronicInfectionProportionTest(unittest.TestCase):
@@ -31,5 +41,198 @@ class ChronicInfectionProportionTest(unittest.TestCase):
         self.assertNotIn('重叠牛只', result['formula'])
 
 
+class CowMonthMatrixTest(unittest.TestCase):
+    def setUp(self):
+        self.monthly_data = {
+            '2026-05': pd.DataFrame({
+                'management_id_standardized': ['1', '1', '2', '3'],
+                'somatic_cell_count': [30.0, 10.0, 10.0, None],
+                'parity': [1, 1, 2, 2],
+                'lactation_days': [10, 40, 20, 30],
+            }),
+            '2026-06': pd.DataFrame({
+                'management_id_standardized': ['1', '2', '3'],
+                'somatic_cell_count': [25.0, 30.0, 40.0],
+            }),
+            '2026-07': pd.DataFrame({
+                'management_id_standardized': ['1', '2'],
+                'somatic_cell_count': [5.0, 50.0],
+            }),
+        }
+
+    def test_pair_counts_match_merged_rows(self):
+        matrix = CowMonthMatrix(self.monthly_data)
+
+        # 同月重复的管理号按配对行数计
+        pair = matrix.pair_counts(20.0, '2026-05', '2026-06')
+        self.assertEqual(pair['overlap'], 3)
+        self.assertEqual(pair['low_prev'], 2)
+        self.assertEqual(pair['new_infections'], 2)
+        self.assertEqual(pair['chronic'], 1)
+
+        skipped = matrix.pair_counts(20.0, '2026-05', '2026-07')
+        self.assertEqual(skipped['high_prev'], 1)
+        self.assertEqual(skipped['chronic'], 0)
+
+        may = matrix.month_counts(20.0, '2026-05')
+        self.assertEqual((may['valid'], may['high'], may['first_test']), (3, 1, 3))
+        self.assertEqual((may['primiparous'], may['primiparous_high']), (1, 1))
+        self.assertTrue(matrix.matches(self.monthly_data))
+        self.assertFalse(matrix.matches(dict(self.monthly_data, **{'2026-07': self.monthly_data['2026-06']})))
+
+    def test_indicators_follow_threshold_changes(self):
+        calculator = MastitisMonitoringCalculator(scc_threshold=20.0)
+        calculator.monthly_data = self.monthly_data
+        result = calculator.calculate_all_indicators()
+
+        june = result['indicators']['2026-06']
+        self.assertEqual(june['new_infection_rate']['formula'],
+                         '(2026-06月SCC>20.0 且 2026-05月SCC≤20.0的牛头数(2)) ÷ (2026-05月SCC≤20.0的牛头数(2)) = 100.0%')
+        self.assertEqual(result['indicators']['2026-05']['first_test_prevalence']['multiparous']['denominator'], 2)
+
+        calculator.set_scc_threshold(35.0)
+        june = calculator.calculate_all_indicators()['indicators']['2026-06']
+        self.assertEqual(june['current_prevalence']['numerator'], 1)
+        self.assertIsNone(june['chronic_infection_rate']['value'])
+
+    def test_threshold_sweep_matches_single_threshold_results(self):
+        calculator = MastitisMonitoringCalculator(scc_threshold=20.0)
+        calculator.monthly_data = self.monthly_data
+        sweep = calculator.sweep_scc_thresholds([10.0, 20.0, 30.0])
+
+        self.assertTrue(sweep['success'])
+        self.assertEqual(calculator.scc_threshold, 20.0)
+        for threshold in sweep['thresholds']:
+            calculator.set_scc_threshold(threshold)
+            indicators = calculator.calculate_all_indicators()['indicators']
+            for month in sweep['months']:
+                for name in ('current_prevalence', 'new_infection_rate',
+                             'chronic_infection_rate', 'chronic_infection_proportion'):
+                    expected = indicators[month].get(name, {}).get('value')
+                    value = sweep['indicators'][name].loc[month, threshold]
+                    if expected is None:
+                        self.assertTrue(pd.isna(value))
+                    else:
+                        self.assertEqual(value, expected)
+
+        primiparous = sweep['indicators']['first_test_primiparous']
+        self.assertEqual(primiparous.loc['2026-05'].tolist(), [100.0, 100.0, 0.0])
+        self.assertTrue(primiparous.loc['2026-06'].isna().all())
+
+
+class IncrementalIndicatorTest(unittest.TestCase):
+    def test_appended_month_computes_only_new_indicators(self):
+        calculator = MastitisMonitoringCalculator(scc_threshold=20.0)
+        calculator.load_dhi_data([
+            make_test(['1', '2'], ['2026-05-10'] * 2, [30.0, 10.0]),
+            make_test(['1', '2'], ['2026-06-10'] * 2, [25.0, 30.0]),
+        ])
+        first = calculator.calculate_all_indicators()
+        matrix = calculator._cow_month_matrix()
+
+        calculator.add_dhi_data([make_test(['1', '2', '3'], ['2026-07-10'] * 3, [5.0, 50.0, 10.0])])
+        with mock.patch.object(calculator, '_calculate_current_prevalence',
+                               wraps=calculator._calculate_current_prevalence) as current, \
+                mock.patch.object(calculator, '_calculate_new_infection_rate',
+                                  wraps=calculator._calculate_new_infection_rate) as new_infection:
+            second = calculator.calculate_all_indicators()
+
+        current.assert_called_once_with('2026-07')
+        new_infection.assert_called_once_with('2026-06', '2026-07')
+        self.assertIs(calculator._cow_month_matrix(), matrix)
+        self.assertIs(second['indicators']['2026-06']['new_infection_rate'],
+                      first['indicators']['2026-06']['new_infection_rate'])
+        self.assertEqual(second['indicators']['2026-07']['chronic_infection_rate']['numerator'], 1)
+
+        calculator.set_scc_threshold(26.0)
+        with mock.patch.object(calculator, '_calculate_current_prevalence',
+                               wraps=calculator._calculate_current_prevalence) as current:
+            calculator.calculate_all_indicators()
+        self.assertEqual(current.call_count, 3)
+
+
+class PreDryPrevalenceTest(unittest.TestCase):
+    def test_gestation_is_projected_back_to_each_test_date(self):
+        calculator = MastitisMonitoringCalculator(scc_threshold=20.0)
+        calculator.load_dhi_data([
+            make_test(['1', '2', '3'], ['2026-05-11'] * 3, [30.0, 25.0, 10.0]),
+            make_test(['01', '2', '3'], ['2026-06-10'] * 3, [30.0, 10.0, 10.0]),
+        ])
+        calculator.load_cattle_basic_info(pd.DataFrame({
+            '耳号': ['001', '2', '3', '9'],
+            'gestation_days': [200, 250, 20, None],
+        }), 'yiqiniu')
+
+        indicators = calculator.calculate_all_indicators()['indicators']
+        may = indicators['2026-05']['pre_dry_prevalence']
+        june = indicators['2026-06']['pre_dry_prevalence']
+
+        # 5月时1号牛在胎170天、3号牛尚未受孕
+        self.assertEqual((may['numerator'], may['denominator']), (1, 1))
+        self.assertEqual(may['matched_count'], 3)
+        self.assertIn('有在胎天数数据：2头', may['formula'])
+        self.assertEqual((june['numerator'], june['denominator']), (1, 2))
+        self.assertEqual(june['value'], 50.0)
+        self.assertEqual(june['diagnostics']['reference_date'], pd.Timestamp('2026-06-10'))
+
+    def test_latest_month_records_keep_the_herd_gestation(self):
+        calculator = MastitisMonitoringCalculator(scc_threshold=20.0)
+        # '01'和'1'标准化后是同一头牛，最新月份测定日不同
+        calculator.load_dhi_data([
+            make_test(['1', '2'], ['2026-05-11'] * 2, [30.0, 30.0]),
+            make_test(['01', '1', '2'], ['2026-06-01', '2026-06-20', '2026-06-20'], [30.0, 10.0, 25.0]),
+        ])
+        calculator.load_cattle_basic_info(pd.DataFrame({
+            '耳号': ['1', '2'],
+            'gestation_days': [185, 190],
+        }), 'yiqiniu')
+
+        indicators = calculator.calculate_all_indicators()['indicators']
+        may = indicators['2026-05']['pre_dry_prevalence']
+        june = indicators['2026-06']['pre_dry_prevalence']
+
+        self.assertEqual((june['numerator'], june['denominator']), (2, 3))
+        # 较早月份仍以该牛最新月份的最后测定日为基准推算
+        self.assertEqual(may['diagnosis'], '无符合干奶前条件的牛只')
+
+
+class LoadDhiDataTest(unittest.TestCase):
+    def test_keeps_last_test_per_cow_and_month(self):
+        calculator = MastitisMonitoringCalculator()
+        result = calculator.load_dhi_data([
+            make_test(['001', '001', '2', None], ['2026-05-20', '2026-05-03', '2026-05-10', '2026-05-10'],
+                      [30.0, 10.0, 15.0, 50.0]),
+            make_test(['2', '3'], ['2026-05-10', '2026-06-01'], [25.0, 5.0]),
+        ])
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['months'], ['2026-05', '2026-06'])
+        may = calculator.monthly_data['2026-05']
+        self.assertEqual(may['management_id'].tolist(), ['001', '2'])
+        self.assertEqual(may['management_id_standardized'].tolist(), ['1', '2'])
+        # 采样日期相同时以后加载的文件为准
+        self.assertEqual(may['somatic_cell_count'].tolist(), [30.0, 25.0])
+
+    def test_herd_table_reload_merges_only_new_files(self):
+        data_list = [
+            {'filename': 'may.xlsx', 'data': make_test(['1', '2'], ['2026-05-10'] * 2, [30.0, 10.0])},
+            {'filename': 'jun.xlsx', 'data': make_test(['1'], ['2026-06-10'], [12.0])},
+        ]
+        table = HerdTable().sync(data_list[:1])
+        calculator = MastitisMonitoringCalculator()
+        calculator.load_dhi_data(table)
+        may = calculator.monthly_data['2026-05']
+
+        result = calculator.load_dhi_data(table.sync(data_list))
+
+        self.assertIs(calculator.monthly_data['2026-05'], may)
+        self.assertEqual(result['processed_files'], 2)
+        self.assertEqual(result['months'], ['2026-05', '2026-06'])
+        self.assertNotIn('month', calculator.monthly_data['2026-06'].columns)
+
+        calculator.load_dhi_data(table.sync(data_list[1:]))
+        self.assertEqual(list(calculator.monthly_data), ['2026-06'])
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from monthly_aggregates import MonthlyAggregates, report_month_stats
+
+
+class MonthlyAggregatesTest(unittest.TestCase):
+    def setUp(self):
+        nan = np.nan
+        self.aggregates = MonthlyAggregates(
+            pd.Index([10, 11, 12]),
+            np.array(['F001', 'F001', 'F002'], dtype=object),
+            ['2024年01月', '2024年02月'],
+            {'protein_pct': np.array([[3.0, 3.2], [3.6, nan], [3.3, 3.4]])},
+            np.array([[20.0, 30.0], [40.0, 25.0], [nan, 10.0]]),
+        )
+
+    def test_month_totals_combine_farms(self):
+        totals = self.aggregates.month_totals('protein_pct')
+
+        self.assertEqual(totals['count'].tolist(), [3, 2])
+        self.assertEqual(totals['pairs'].tolist(), [2, 2])
+        self.assertAlmostEqual(totals.loc['2024年01月', 'weighted_total'], 3.0 * 20 + 3.6 * 40)
+        self.assertAlmostEqual(totals.loc['2024年02月', 'milk_total'], 40.0)
+        self.assertEqual(totals.loc['2024年01月', 'maximum'], 3.6)
+
+        stats = self.aggregates.month_stats('protein_pct')
+        self.assertAlmostEqual(stats.loc['2024年01月', 'mean'], 3.3)
+        self.assertAlmostEqual(stats.loc['2024年01月', 'std'], pd.Series([3.0, 3.6, 3.3]).std())
+
+    def test_without_subtracts_rows_and_recomputes_extrema(self):
+        remaining = self.aggregates.without([11, 99])
+
+        self.assertEqual(list(remaining.row_labels), [10, 12])
+        stats = remaining.month_stats('protein_pct')
+        self.assertEqual(stats['count'].tolist(), [2, 2])
+        self.assertEqual(stats.loc['2024年01月', 'max'], 3.3)
+        self.assertAlmostEqual(remaining.totals('protein_pct')['milk_total'], 60.0)
+        # 原实例不变
+        self.assertEqual(self.aggregates.month_stats('protein_pct')['count'].tolist(), [3, 2])
+
+        empty = remaining.without([10, 12])
+        self.assertEqual(empty.month_stats('protein_pct')['count'].tolist(), [0, 0])
+
+    def test_std_is_precise_for_large_offsets(self):
+        values = 1e9 + np.array([[0.1], [0.2], [0.3], [0.4], [0.6]])
+        aggregates = MonthlyAggregates(
+            pd.Index(range(5)), np.array(['F001', 'F002', 'F001', 'F002', 'F002'], dtype=object),
+            ['2024年01月'], {'milk_yield': values}, np.full((5, 1), np.nan),
+        )
+
+        stats = aggregates.month_stats('milk_yield')
+        self.assertAlmostEqual(stats['std'].iloc[0], pd.Series(values[:, 0]).std(), places=6)
+
+        remaining = aggregates.without([4])
+        self.assertAlmostEqual(remaining.month_stats('milk_yield')['std'].iloc[0],
+                               pd.Series(values[:4, 0]).std(), places=6)
+
+    def test_report_month_stats_falls_back_to_monthly_columns(self):
+        report = pd.DataFrame({
+            'management_id': ['1', '2'],
+            '2024年02月蛋白率(%)': [3.2, None],
+            '2024年01月蛋白率(%)': [3.0, 3.6],
+            '平均蛋白率(%)': [3.1, 3.6],
+        })
+
+        stats = report_month_stats(report, 'protein_pct', '蛋白率(%)')
+        self.assertEqual(list(stats.index), ['2024年01月', '2024年02月'])
+        self.assertEqual(stats['count'].tolist(), [2, 1])
+        self.assertIsNone(report_month_stats(report, 'fat_pct', '乳脂率(%)'))
+
+        # 汇总聚合与报告行对应时直接查表，否则按月度明细列计算
+        report.index = pd.Index([10, 11])
+        self.assertEqual(report_month_stats(report, 'protein_pct', '蛋白率(%)', self.aggregates)['count'].tolist(),
+                         [2, 1])
+        report = pd.concat([report, report.iloc[[0]].rename(index={10: 12})])
+        self.assertEqual(report_month_stats(report, 'protein_pct', '蛋白率(%)', self.aggregates)['count'].tolist(),
+                         [3, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
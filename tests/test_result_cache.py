@@ -0,0 +1,39 @@
+import unittest
+
+import pandas as pd
+
+from result_cache import ResultCache, normalize_filters
+
+
+class ResultCacheTest(unittest.TestCase):
+    def test_evicts_least_recently_used_over_byte_limit(self):
+        frame = pd.DataFrame({'x': range(100)})
+        size = int(frame.memory_usage(index=True, deep=True).sum())
+        cache = ResultCache(max_bytes=size * 2)
+
+        cache.put('a', frame)
+        cache.put('b', frame)
+        cache.get('a')
+        cache.put('c', frame)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertEqual(cache.total_bytes, size * 2)
+
+    def test_returned_frames_are_copies(self):
+        cache = ResultCache()
+        cache.put('a', pd.DataFrame({'x': [1, 2]}))
+
+        cache.get('a').loc[0, 'x'] = 99
+
+        self.assertEqual(cache.get('a')['x'].tolist(), [1, 2])
+
+    def test_disabled_filter_settings_do_not_change_key(self):
+        first = {'protein_pct': {'enabled': False, 'min': 3.0}, 'parity': {'enabled': True, 'min': 1}}
+        second = {'parity': {'min': 1, 'enabled': True}, 'protein_pct': {'enabled': False, 'min': 2.5}}
+
+        self.assertEqual(normalize_filters(first), normalize_filters(second))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from herd_table import HerdTable
+from screening_index import ScreeningIndex, format_plan, popcount
+
+
+def make_month(month, rows):
+    management_ids, protein = zip(*rows)
+    return pd.DataFrame({
+        'farm_id': ['F001'] * len(rows),
+        'management_id': list(management_ids),
+        'sample_date': pd.to_datetime([f'{month}-15'] * len(rows)),
+        'protein_pct': pd.Series(protein, dtype='float32'),
+    })
+
+
+class ScreeningIndexTest(unittest.TestCase):
+    def setUp(self):
+        table = HerdTable()
+        table.sync([
+            {'filename': 'jan.xlsx', 'data': make_month('2024-01', [('001', 3.0), ('002', 3.5), (None, 3.0)])},
+            {'filename': 'feb.xlsx', 'data': make_month('2024-02', [('001', 3.1), ('002', None), ('001', 4.0)])},
+            {'filename': 'mar.xlsx', 'data': make_month('2024-03', [('002', 3.6)])},
+        ])
+        self.df = table.frame()
+        self.index = ScreeningIndex(self.df, table.months())
+
+    def cows(self, bitmap):
+        passing = np.unpackbits(bitmap, count=self.index.n_cows).astype(bool)
+        keys = set(self.index.cow_keys[passing])
+        return set(self.df.loc[self.df['cow_key'].isin(keys), 'management_id'])
+
+    def test_counts_months_with_a_value_in_range(self):
+        self.assertEqual(self.index.n_cows, 2)
+        self.assertEqual(self.cows(self.index.matching_cows('protein_pct', 2.9, 3.2, 2)), {'001'})
+        self.assertEqual(self.cows(self.index.matching_cows('protein_pct', 3.4, 3.7, 2)), {'002'})
+        self.assertEqual(self.cows(self.index.matching_cows('protein_pct', 3.4, 3.7, 3)), set())
+
+    def test_empty_values_and_missing_months_can_count_as_match(self):
+        passing = self.index.matching_cows('protein_pct', 3.4, 3.7, 3, treat_empty_as_match=True)
+        self.assertEqual(self.cows(passing), {'002'})
+        passing = self.index.matching_cows('protein_pct', 2.9, 3.2, 3, treat_empty_as_match=True)
+        self.assertEqual(self.cows(passing), {'001'})
+
+    def test_query_combines_filters_and_returns_keyed_rows(self):
+        passing = self.index.query({
+            'protein_pct': {'field': 'protein_pct', 'min': 2.9, 'max': 4.0, 'min_match_months': 2},
+            'missing': {'field': 'not_a_column', 'min': 0, 'max': 1},
+        })
+
+        self.assertEqual(popcount(passing), 2)
+        rows = self.df[self.index.rows_for(passing)]
+        self.assertEqual(len(rows), 6)
+        self.assertTrue(rows['management_id'].notna().all())
+        self.assertIsNone(self.index.query({'missing': {'field': 'not_a_column'}}))
+
+    def test_plan_runs_most_selective_filter_first_and_short_circuits(self):
+        self.df['fat_pct'] = 4.0
+        self.index = ScreeningIndex(self.df, self.index.all_months)
+
+        passing = self.index.query({
+            'fat_pct': {'field': 'fat_pct', 'min': 3.0, 'max': 5.0, 'min_match_months': 1},
+            'protein_pct': {'field': 'protein_pct', 'min': 9.0, 'max': 10.0, 'min_match_months': 1},
+            'protein_low': {'field': 'protein_pct', 'min': 0.0, 'max': 3.05, 'min_match_months': 1},
+        })
+
+        self.assertEqual(popcount(passing), 0)
+        plan = self.index.last_plan
+        self.assertEqual(plan[0]['filter'], 'protein_pct')
+        self.assertEqual(plan[0]['passed'], 0)
+        self.assertTrue(all(step.get('skipped') for step in plan[1:]))
+        self.assertEqual(len(format_plan(plan)), 3)
+
+
+if __name__ == '__main__':
+    unittest.main()